@@ -1,12 +1,34 @@
+import os
+import time
 import boto3
 from urllib.parse import urlparse
+from tag_matcher import SubscriptionIndex, format_digest
+from birdtag_common.metrics import instrumented, instrument_client, stage, incr
 
-sns = boto3.client('sns')
-s3 = boto3.client('s3')
+sns = instrument_client(boto3.client('sns'))
+s3 = instrument_client(boto3.client('s3'))
 
 SNS_TOPIC_ARN = 'arn:aws:sns:us-east-1:651706776121:bird-tag-notifications'  # Replace with your SNS ARN
 
+# 'sns'    : one publish per species, matched by SNS filter policies.
+# 'digest' : match in-process and send one email per user per batch.
+ALERT_MODE = os.getenv('ALERT_MODE', 'sns')
+USER_TABLE_NAME = os.getenv('USER_TABLE_NAME', 'userDetails-Alert')
+USER_STREAM_ARN = os.getenv('USER_STREAM_ARN')        # enables incremental refresh
+DIGEST_SENDER = os.getenv('DIGEST_SENDER')            # verified SES identity
+INDEX_TTL = int(os.getenv('INDEX_TTL', '300'))        # full reload period without a stream
+
+# fail at init, not on the first batch of uploads after a deploy
+if ALERT_MODE == 'digest' and not DIGEST_SENDER:
+    raise RuntimeError("ALERT_MODE=digest requires DIGEST_SENDER (a verified SES identity)")
+
+_index = None
+_index_loaded_at = 0.0
+_follower = None
+
+@instrumented
 def lambda_handler(event, context):
+    uploads = []
     for record in event['Records']:
         if record['eventName'] != 'INSERT':
             continue
@@ -39,9 +61,23 @@ def lambda_handler(event, context):
             if bucket_name and key:
                 raw_presigned = generate_presigned_url(bucket_name, key)
 
+        if ALERT_MODE == 'digest':
+            uploads.append({
+                'media_id': media_id,
+                'upload_time': upload_time,
+                'tags': tag_names,
+                'annotated_url': annotated_presigned,
+                'raw_url': raw_presigned,
+            })
+            continue
+
         for tag in tag_names:
             publish_to_sns(tag, media_id, upload_time, annotated_presigned, raw_presigned)
 
+    if uploads:
+        with stage("digest"):
+            send_digests(uploads)
+
     return {
         'statusCode': 200,
         'body': 'Processed bird detection records.'
@@ -66,21 +102,70 @@ Time: {upload_time}
     message += "\n\nThank you for using Bird Alert Service."
 
     try:
-        response = sns.publish(
-            TopicArn=SNS_TOPIC_ARN,
-            Message=message,
-            Subject="🐦 Bird Alert: New Sighting",
-            MessageAttributes={
-                'tag': {
-                    'DataType': 'String',
-                    'StringValue': tag_lower  # consistent lowercase for filter policy
+        with stage("publish"):
+            response = sns.publish(
+                TopicArn=SNS_TOPIC_ARN,
+                Message=message,
+                Subject="🐦 Bird Alert: New Sighting",
+                MessageAttributes={
+                    'tag': {
+                        'DataType': 'String',
+                        'StringValue': tag_lower  # consistent lowercase for filter policy
+                    }
                 }
-            }
-        )
+            )
+        incr("published")
         print(f"Published notification for tag '{tag}': {response['MessageId']}")
     except Exception as e:
         print(f"Error publishing for tag '{tag}': {e}")
 
+def get_subscription_index():
+    """
+    Warm-container copy of the user table as a species -> subscribers index.
+    Loaded once, then refreshed from the user table's stream when
+    USER_STREAM_ARN is set, otherwise fully reloaded every INDEX_TTL seconds.
+    """
+    global _index, _index_loaded_at, _follower
+    stale = time.time() - _index_loaded_at > INDEX_TTL
+
+    if _index is None or (stale and _follower is None):
+        if USER_STREAM_ARN and _follower is None:
+            from birdtag_common.streams import StreamFollower
+            _follower = StreamFollower(boto3.client('dynamodbstreams'), USER_STREAM_ARN)
+            _follower.start()
+        index = SubscriptionIndex()
+        with stage("db_read"):
+            index.load(instrument_client(boto3.resource('dynamodb').Table(USER_TABLE_NAME)))
+        _index, _index_loaded_at = index, time.time()
+        print(f"Loaded subscription index: {len(index)} users, {len(index.subscribers)} species")
+    elif _follower is not None:
+        try:
+            records = _follower.poll()
+            if records:
+                _index.apply_stream_records(records)
+                print(f"Applied {len(records)} user table changes")
+        except Exception as e:
+            print(f"Error polling user stream, forcing reload next time: {e}")
+            _follower, _index_loaded_at = None, 0.0
+    return _index
+
+def send_digests(uploads):
+    ses = boto3.client('ses')
+    per_user = get_subscription_index().digests(uploads)
+    for email, entries in per_user.items():
+        try:
+            ses.send_email(
+                Source=DIGEST_SENDER,
+                Destination={'ToAddresses': [email]},
+                Message={
+                    'Subject': {'Data': f"🐦 Bird Alert: {len(entries)} new sighting(s)"},
+                    'Body': {'Text': {'Data': format_digest(entries)}}
+                }
+            )
+        except Exception as e:
+            print(f"Error sending digest to {email}: {e}")
+    print(f"Sent {len(per_user)} digests for {len(uploads)} uploads")
+
 def extract_bucket_key_from_url(url):
     try:
         parsed_url = urlparse(url)
@@ -94,11 +179,12 @@ def extract_bucket_key_from_url(url):
 
 def generate_presigned_url(bucket, key, expiration=3600):
     try:
-        url = s3.generate_presigned_url(
-            ClientMethod='get_object',
-            Params={'Bucket': bucket, 'Key': key},
-            ExpiresIn=expiration
-        )
+        with stage("presign"):
+            url = s3.generate_presigned_url(
+                ClientMethod='get_object',
+                Params={'Bucket': bucket, 'Key': key},
+                ExpiresIn=expiration
+            )
         return url
     except Exception as e:
         print(f"Error generating presigned URL: {e}")
@@ -1,16 +1,48 @@
 import boto3
 import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from birdtag_common.metrics import instrumented, instrument_client, stage
 
-dynamodb = boto3.resource('dynamodb')
-sns = boto3.client('sns')
+dynamodb = instrument_client(boto3.resource('dynamodb'))
+sns = instrument_client(boto3.client('sns'))
 
 USER_TABLE_NAME = 'userDetails-Alert'
 SNS_TOPIC_ARN = 'arn:aws:sns:us-east-1:651706776121:bird-tag-notifications'
+MAX_WORKERS = int(os.getenv('MAX_WORKERS', '8'))
+TRANSACT_LIMIT = 100  # max items per transact_write_items call
 
 user_table = dynamodb.Table(USER_TABLE_NAME)
 
+@instrumented
 def lambda_handler(event, context):
+    # Records for the same user must be applied in stream order, so group them
+    # per email and only run different users concurrently.
+    records_by_email = {}
     for record in event['Records']:
+        new_image = record.get('dynamodb', {}).get('NewImage', {})
+        old_image = record.get('dynamodb', {}).get('OldImage', {})
+        email = get_value(new_image, 'email') or get_value(old_image, 'email')
+        if not email:
+            print(f"Record {record.get('eventID')} has no email, skipping")
+            continue
+        records_by_email.setdefault(email, []).append(record)
+
+    arn_updates = {}
+    with stage("subscribe"), ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        for updates in pool.map(process_user_records, records_by_email.values()):
+            arn_updates.update(updates)
+
+    with stage("db_write"):
+        save_subscription_arns(arn_updates)
+
+def process_user_records(records):
+    """
+    Apply one user's stream records in order and return the subscription
+    ARNs that need to be written back, as {email: arn}.
+    """
+    arn_updates = {}
+    for record in records:
         eventName = record['eventName']
         new_image = record.get('dynamodb', {}).get('NewImage', {})
         old_image = record.get('dynamodb', {}).get('OldImage', {})
@@ -18,31 +50,51 @@ def lambda_handler(event, context):
         email = get_value(new_image, 'email') or get_value(old_image, 'email')
         new_tags = get_list(new_image, 'tags')
         old_tags = get_list(old_image, 'tags')
-        subscription_arn = get_value(new_image, 'subscriptionArn') or get_value(old_image, 'subscriptionArn')
+        subscription_arn = (arn_updates.get(email)
+                            or get_value(new_image, 'subscriptionArn')
+                            or get_value(old_image, 'subscriptionArn'))
 
         if eventName == 'INSERT':
             print(f"INSERT detected for {email} with tags {new_tags}")
             arn = subscribe_user(email, new_tags)
             if arn:
-                save_subscription_arn(email, arn)
+                arn_updates[email] = arn
 
         elif eventName == 'MODIFY':
             print(f"MODIFY detected for {email}")
-            if set(new_tags) != set(old_tags):
-                print(f"Tags changed for {email}, updating subscription")
+            added = set(new_tags) - set(old_tags)
+            removed = set(old_tags) - set(new_tags)
+            if not added and not removed:
+                print("Tags not changed, no action taken")
+                continue
+
+            print(f"Tags changed for {email}: +{sorted(added)} -{sorted(removed)}")
+            if not new_tags:
+                # An empty FilterPolicy list is rejected by SNS, and no tags
+                # means no alerts, so drop the subscription instead.
+                if subscription_arn:
+                    unsubscribe_user(subscription_arn)
+                    remove_subscription_arn(email)
+                    arn_updates.pop(email, None)
+            elif subscription_arn and update_filter_policy(subscription_arn, new_tags):
+                # Same subscription, nothing to write back.
+                continue
+            else:
+                # No usable subscription yet: fall back to a fresh one.
                 if subscription_arn:
                     unsubscribe_user(subscription_arn)
                 arn = subscribe_user(email, new_tags)
                 if arn:
-                    save_subscription_arn(email, arn)
-            else:
-                print("Tags not changed, no action taken")
+                    arn_updates[email] = arn
 
         elif eventName == 'REMOVE':
+            # The user row is already gone, so there is no ARN left to clear.
             print(f"REMOVE detected for {email}")
             if subscription_arn:
                 unsubscribe_user(subscription_arn)
-                remove_subscription_arn(email)
+            arn_updates.pop(email, None)
+
+    return arn_updates
 
 def get_value(image, key):
     try:
@@ -66,10 +118,10 @@ def get_list(image, key):
         pass
     return []
 
+def build_filter_policy(tags):
+    return json.dumps({"tags": sorted({tag.lower() for tag in tags})})
+
 def subscribe_user(email, tags):
-    filter_policy = {
-    "tags": [tag.lower() for tag in tags]
-}
     print(f"Subscribing {email} with tags {tags}")
     try:
         response = sns.subscribe(
@@ -77,8 +129,11 @@ def subscribe_user(email, tags):
             Protocol='email',
             Endpoint=email,
             Attributes={
-                'FilterPolicy': json.dumps(filter_policy)
-            }
+                'FilterPolicy': build_filter_policy(tags)
+            },
+            # Return the real ARN even while the email is pending
+            # confirmation, so later tag edits can target it directly.
+            ReturnSubscriptionArn=True
         )
         arn = response.get('SubscriptionArn')
         print(f"Subscription ARN: {arn}")
@@ -87,6 +142,20 @@ def subscribe_user(email, tags):
         print(f"Error subscribing {email}: {e}")
         return None
 
+def update_filter_policy(subscription_arn, tags):
+    """Replace the FilterPolicy in place. Returns False if SNS rejected it."""
+    print(f"Updating filter policy of {subscription_arn} to {tags}")
+    try:
+        sns.set_subscription_attributes(
+            SubscriptionArn=subscription_arn,
+            AttributeName='FilterPolicy',
+            AttributeValue=build_filter_policy(tags)
+        )
+        return True
+    except Exception as e:
+        print(f"Error updating filter policy of {subscription_arn}: {e}")
+        return False
+
 def unsubscribe_user(subscription_arn):
     print(f"Unsubscribing subscription {subscription_arn}")
     try:
@@ -94,12 +163,36 @@ def unsubscribe_user(subscription_arn):
     except Exception as e:
         print(f"Error unsubscribing {subscription_arn}: {e}")
 
+def save_subscription_arns(arn_updates):
+    """Write {email: arn} back to the user table, up to 100 per transaction."""
+    pending = list(arn_updates.items())
+    for start in range(0, len(pending), TRANSACT_LIMIT):
+        chunk = pending[start:start + TRANSACT_LIMIT]
+        print(f"Saving {len(chunk)} subscription ARNs")
+        try:
+            dynamodb.meta.client.transact_write_items(TransactItems=[
+                {'Update': {
+                    'TableName': USER_TABLE_NAME,
+                    'Key': {'email': {'S': email}},
+                    'UpdateExpression': 'SET subscriptionArn = :arn',
+                    'ConditionExpression': 'attribute_exists(email)',
+                    'ExpressionAttributeValues': {':arn': {'S': arn}}
+                }}
+                for email, arn in chunk
+            ])
+        except Exception as e:
+            # One deleted user cancels the whole transaction; retry singly.
+            print(f"Batch save failed ({e}), saving individually")
+            for email, arn in chunk:
+                save_subscription_arn(email, arn)
+
 def save_subscription_arn(email, subscription_arn):
     print(f"Saving subscription ARN for {email}")
     try:
         user_table.update_item(
             Key={'email': email},
             UpdateExpression='SET subscriptionArn = :arn',
+            ConditionExpression='attribute_exists(email)',
             ExpressionAttributeValues={':arn': subscription_arn}
         )
     except Exception as e:
@@ -110,7 +203,8 @@ def remove_subscription_arn(email):
     try:
         user_table.update_item(
             Key={'email': email},
-            UpdateExpression='REMOVE subscriptionArn'
+            UpdateExpression='REMOVE subscriptionArn',
+            ConditionExpression='attribute_exists(email)'
         )
     except Exception as e:
         print(f"Error removing subscription ARN for {email}: {e}")
@@ -0,0 +1,114 @@
+from collections import defaultdict
+
+
+def _attr_value(image, key):
+    """Read a plain value out of a DynamoDB-JSON stream image."""
+    val = image.get(key)
+    if not val:
+        return None
+    if 'S' in val:
+        return val['S']
+    if 'L' in val:
+        return [v.get('S') for v in val['L'] if 'S' in v]
+    if 'SS' in val:
+        return list(val['SS'])
+    return None
+
+
+class SubscriptionIndex:
+    """
+    In-memory species -> subscribers index over the userDetails-Alert table.
+
+    Matches the semantics of the SNS filter policies written by
+    subscribe_users_to_sns.py: a user is a recipient for an upload when one
+    of their (lower-cased) tags equals one of the upload's tags.
+    """
+
+    def __init__(self):
+        self.subscribers = defaultdict(set)   # species -> {email}
+        self.user_tags = {}                   # email -> frozenset(species)
+
+    def __len__(self):
+        return len(self.user_tags)
+
+    def set_user(self, email, tags):
+        self.remove_user(email)
+        tags = frozenset(t.lower() for t in tags or [] if t)
+        if not tags:
+            return
+        self.user_tags[email] = tags
+        for tag in tags:
+            self.subscribers[tag].add(email)
+
+    def remove_user(self, email):
+        for tag in self.user_tags.pop(email, ()):
+            users = self.subscribers[tag]
+            users.discard(email)
+            if not users:
+                del self.subscribers[tag]
+
+    def load(self, table):
+        """Full load from the user table (paginated scan)."""
+        self.subscribers.clear()
+        self.user_tags.clear()
+        kwargs = {'ProjectionExpression': 'email, tags'}
+        while True:
+            resp = table.scan(**kwargs)
+            for item in resp.get('Items', []):
+                self.set_user(item['email'], item.get('tags'))
+            if 'LastEvaluatedKey' not in resp:
+                break
+            kwargs['ExclusiveStartKey'] = resp['LastEvaluatedKey']
+
+    def apply_stream_records(self, records):
+        """Apply userDetails-Alert stream records (Lambda or GetRecords shape)."""
+        for record in records:
+            ddb = record.get('dynamodb', {})
+            new_image = ddb.get('NewImage', {})
+            old_image = ddb.get('OldImage', {})
+            email = (_attr_value(new_image, 'email') or _attr_value(old_image, 'email')
+                     or _attr_value(ddb.get('Keys', {}), 'email'))
+            if not email:
+                continue
+            if record['eventName'] == 'REMOVE':
+                self.remove_user(email)
+            else:
+                self.set_user(email, _attr_value(new_image, 'tags'))
+
+    def match(self, tags):
+        """Return {email: sorted matched species} for one upload's tags."""
+        matched = defaultdict(set)
+        for tag in tags:
+            tag = tag.lower()
+            for email in self.subscribers.get(tag, ()):
+                matched[email].add(tag)
+        return {email: sorted(species) for email, species in matched.items()}
+
+    def digests(self, uploads):
+        """
+        Group a batch of uploads per recipient.
+
+        `uploads` is a list of dicts with at least a 'tags' list; returns
+        {email: [(upload, matched species), ...]} so each user gets one message.
+        """
+        per_user = defaultdict(list)
+        for upload in uploads:
+            for email, species in self.match(upload['tags']).items():
+                per_user[email].append((upload, species))
+        return per_user
+
+
+def format_digest(entries):
+    """Plain-text body for one user's digest."""
+    lines = [f"{len(entries)} new bird sighting(s) matching your alerts:", ""]
+    for upload, species in entries:
+        lines.append(f"Species: {', '.join(species)}")
+        lines.append(f"Media ID: {upload.get('media_id', '')}")
+        lines.append(f"Time: {upload.get('upload_time', '')}")
+        if upload.get('annotated_url'):
+            lines.append(f"View Annotated Image: {upload['annotated_url']}")
+        if upload.get('raw_url'):
+            lines.append(f"View Raw Image: {upload['raw_url']}")
+        lines.append("")
+    lines.append("Thank you for using Bird Alert Service.")
+    return "\n".join(lines)
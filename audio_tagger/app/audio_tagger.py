@@ -1,8 +1,7 @@
 import os, subprocess, tempfile, logging
 import numpy as np
 import soundfile as sf
-import librosa
-from tensorflow.lite.python.interpreter import Interpreter
+from birdtag_common.metrics import stage, incr, put
 
 # ─── disable numba JIT & cache
 os.environ.setdefault("NUMBA_DISABLE_JIT", "1")
@@ -12,10 +11,54 @@ log = logging.getLogger()
 log.setLevel(logging.INFO)
 
 WINDOW_SEC  = 3.0
-HOP_SEC     = 0.5
+HOP_SEC     = float(os.getenv("HOP_SEC", 0.5))
 SAMPLE_RATE = 48000
 THRESHOLD   = 0.30
 
+# ─── activity gate: windows without bird-like sound are never scored
+GATE            = os.getenv("AUDIO_GATE", "1") == "1"
+GATE_FRAME_SEC  = 0.025                           # analysis frame
+GATE_BAND_HZ    = (1000, 12000)                   # wind / traffic sit below this band
+GATE_BANDS      = 32                              # flux is taken over this many sub-bands
+GATE_DB         = float(os.getenv("GATE_DB", 6))  # band energy above the noise floor
+GATE_FLUX_Z     = float(os.getenv("GATE_FLUX_Z", 5))  # spectral flux, robust z-score
+GATE_PAD_SEC    = 0.5                             # activity this close still counts
+NOISE_BLOCK_SEC = 10.0                            # noise floor is tracked per block
+NOISE_PCT       = 20
+# ─── coarse-then-fine: score every COARSE_HOP_SEC, then HOP_SEC around hits
+COARSE_HOP_SEC  = float(os.getenv("COARSE_HOP_SEC", 0))   # 0 = one pass at HOP_SEC
+FINE_TRIGGER    = float(os.getenv("FINE_TRIGGER", 0.1))
+# ─── every invoke() runs this many windows, from any number of recordings
+BATCH_WINDOWS   = int(os.getenv("BATCH_WINDOWS", 32))
+
+_models = {}    # (model_path, label_path) -> (interpreter, labels, input index, output index)
+
+def _interpreter_class():
+    """tflite_runtime is a few MB; full TensorFlow only as a fallback."""
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        from tensorflow.lite.python.interpreter import Interpreter
+    return Interpreter
+
+def load_model(model_path: str, label_path: str, reload: bool = False):
+    """
+    Build the interpreter and read labels once per (model, labels) pair;
+    `reload` rebuilds them when a file was replaced under the same path.
+    """
+    key = (model_path, label_path)
+    if reload or key not in _models:
+        with stage("model_load"):
+            with open(label_path, encoding="utf-8") as fh:
+                labels = [l.strip() for l in fh]
+            itp = _interpreter_class()(model_path=model_path, num_threads=4)
+            itp.allocate_tensors()
+            _models.clear()            # only the newest model is ever used
+            _models[key] = (itp, labels,
+                            itp.get_input_details()[0]["index"],
+                            itp.get_output_details()[0]["index"])
+    return _models[key]
+
 def _ffmpeg_convert(in_file: str) -> str:
     """Return a 48 kHz mono wav copy (tmp)."""
     tmp = tempfile.mktemp(suffix=".wav")
@@ -29,47 +72,185 @@ def _read_audio(path: str) -> np.ndarray:
     y, sr = sf.read(path, always_2d=True)
     y = y.mean(axis=1) if y.shape[1] > 1 else y[:, 0]
     if sr != SAMPLE_RATE:
+        import librosa      # slow to import; 48 kHz input never needs it
         y = librosa.resample(y, orig_sr=sr, target_sr=SAMPLE_RATE)
     return y.astype(np.float32)
 
-def _frame_audio(y: np.ndarray) -> np.ndarray:
-    win  = int(WINDOW_SEC * SAMPLE_RATE)
-    hop  = int(HOP_SEC    * SAMPLE_RATE)
-    n_fr = 1 + max(0, len(y) - win) // hop
-    return np.stack([y[i*hop : i*hop + win] for i in range(n_fr)])
+def _starts(n_samples: int, hop: int) -> np.ndarray:
+    win = int(WINDOW_SEC * SAMPLE_RATE)
+    return np.arange(1 + max(0, n_samples - win) // hop) * hop
 
-def main(audio_path: str, model_path: str, label_path: str) -> dict:
-    # labels
-    with open(label_path, encoding="utf-8") as fh:
-        labels = [l.strip() for l in fh]
+def activity(y: np.ndarray) -> np.ndarray:
+    """
+    Per GATE_FRAME_SEC frame: does it look like a call? Band energy above an
+    adaptive noise floor (a low percentile per NOISE_BLOCK_SEC, interpolated)
+    or a spectral-flux onset well above the recording's typical flux.
+    """
+    flen  = int(GATE_FRAME_SEC * SAMPLE_RATE)
+    n     = len(y) // flen
+    freqs = np.fft.rfftfreq(flen, 1 / SAMPLE_RATE)
+    lo, hi = np.searchsorted(freqs, GATE_BAND_HZ)
+    edges = np.linspace(lo, hi, GATE_BANDS + 1).astype(int)[:-1]
+    taper = np.hanning(flen).astype(np.float32)
+    bands = np.empty((n, GATE_BANDS), np.float32)
+    step  = 4096                                  # frames per FFT chunk, bounds memory
+    for i in range(0, n, step):
+        frames = y[i * flen:min(n, i + step) * flen].reshape(-1, flen) * taper
+        power  = np.abs(np.fft.rfft(frames, axis=1)[:, lo:hi]) ** 2
+        bands[i:i + len(frames)] = np.add.reduceat(power, edges - lo, axis=1)
+
+    level = 10 * np.log10(bands.sum(axis=1) + 1e-10)
+    block = max(1, int(NOISE_BLOCK_SEC / GATE_FRAME_SEC))
+    n_blk = -(-n // block)
+    floor = np.percentile(np.pad(level, (0, n_blk * block - n), mode="edge").reshape(n_blk, block),
+                          NOISE_PCT, axis=1)
+    floor = np.interp(np.arange(n), (np.arange(n_blk) + 0.5) * block, floor)
+
+    logb = np.log(bands + 1e-10)
+    flux = np.maximum(np.diff(logb, axis=0, prepend=logb[:1]), 0).sum(axis=1)
+    med  = np.median(flux)
+    mad  = np.median(np.abs(flux - med)) * 1.4826 + 1e-9
+    return (level - floor >= GATE_DB) | ((flux - med) / mad >= GATE_FLUX_Z)
 
-    # .wav
+class WindowPlan:
+    """
+    Which WINDOW_SEC windows of one recording get scored: gated by
+    `activity()`, at HOP_SEC, or at COARSE_HOP_SEC first and then at HOP_SEC
+    only around windows that scored FINE_TRIGGER or more.
+    """
+    def __init__(self, y: np.ndarray, gate: bool = GATE):
+        self.y      = y
+        self.win    = int(WINDOW_SEC * SAMPLE_RATE)
+        self.hop    = int(HOP_SEC * SAMPLE_RATE)
+        self.coarse = int(COARSE_HOP_SEC * SAMPLE_RATE) if COARSE_HOP_SEC > HOP_SEC else 0
+        self.total  = len(_starts(len(y), self.hop))    # windows an ungated pass would score
+        self.scored = 0
+        self._flen  = int(GATE_FRAME_SEC * SAMPLE_RATE)
+        self._active = None
+        if gate:
+            self._active = np.concatenate([[0], np.cumsum(activity(y))])   # prefix sums
+
+    def _gated(self, starts: np.ndarray) -> np.ndarray:
+        if self._active is None or not len(starts):
+            return starts
+        pad   = int(GATE_PAD_SEC * SAMPLE_RATE)
+        n     = len(self._active) - 1
+        first = np.clip((starts - pad) // self._flen, 0, n)
+        last  = np.clip((starts + self.win + pad) // self._flen, 0, n)
+        return starts[self._active[last] > self._active[first]]
+
+    def first(self) -> np.ndarray:
+        starts = self._gated(_starts(len(self.y), self.coarse or self.hop))
+        self.scored += len(starts)
+        return starts
+
+    def refine(self, starts: np.ndarray, scores: np.ndarray) -> np.ndarray:
+        """Fine-hop starts overlapping a coarse hit that were not scored yet."""
+        if not self.coarse or not len(starts):
+            return starts[:0]
+        hits = starts[scores.max(axis=1) >= FINE_TRIGGER]
+        if not len(hits):
+            return starts[:0]
+        fine = _starts(len(self.y), self.hop)
+        j    = np.searchsorted(hits, fine)          # nearest hit on either side
+        dist = np.minimum(np.abs(fine - hits[np.minimum(j, len(hits) - 1)]),
+                          np.abs(fine - hits[np.maximum(j - 1, 0)]))
+        fine = self._gated(np.setdiff1d(fine[dist < self.win], starts))
+        self.scored += len(fine)
+        return fine
+
+    @property
+    def skipped(self) -> float:
+        """Fraction of the HOP_SEC windows that were never scored."""
+        return max(0.0, 1 - self.scored / self.total) if self.total else 0.0
+
+def _score(itp, inp_i: int, out_i: int, jobs: list, n_labels: int,
+           batch: int = BATCH_WINDOWS) -> list:
+    """
+    Scores of [(plan, starts)]: the windows of all recordings are packed into
+    [batch, window] inputs, so the interpreter is resized at most once per
+    model, and the rows are split back per recording.
+    """
+    counts = [len(starts) for _, starts in jobs]
+    total  = sum(counts)
+    out    = np.empty((total, n_labels), np.float32)
+    if total:
+        win = int(WINDOW_SEC * SAMPLE_RATE)
+        if list(itp.get_input_details()[0]["shape"]) != [batch, win]:
+            itp.resize_tensor_input(inp_i, [batch, win])
+            itp.allocate_tensors()
+        owner = np.repeat(np.arange(len(jobs)), counts)
+        at    = np.concatenate([starts for _, starts in jobs])
+        buf   = np.zeros((batch, win), np.float32)
+        for i in range(0, total, batch):
+            m = min(batch, total - i)
+            for r in range(m):
+                y = jobs[owner[i + r]][0].y
+                buf[r] = y[at[i + r]:at[i + r] + win]
+            buf[m:] = 0                                # padding rows, scores dropped
+            itp.set_tensor(inp_i, buf)
+            itp.invoke()
+            out[i:i + m] = itp.get_tensor(out_i)[:m]
+    return np.split(out, np.cumsum(counts)[:-1])
+
+def _decode(audio_path: str) -> np.ndarray:
     wav = _ffmpeg_convert(audio_path) if not audio_path.endswith(".wav") else audio_path
     y   = _read_audio(wav)
     if len(y) < int(WINDOW_SEC * SAMPLE_RATE):
         raise ValueError("Audio shorter than analysis window.")
+    return y
 
-    samples = _frame_audio(y)                       
-    log.info("Frames: %d", len(samples))
+def main_batch(audio_paths: list, model_path: str, label_path: str) -> list:
+    """
+    Tag many recordings with shared fixed-shape inference batches. Returns
+    one entry per path: (species, duration), or the exception that
+    recording raised while decoding; inference errors propagate.
+    """
+    itp, labels, inp_i, out_i = load_model(model_path, label_path)
 
-    # TF-Lite inference
-    itp = Interpreter(model_path=model_path, num_threads=4)
-    itp.allocate_tensors()
-    inp_i = itp.get_input_details()[0]["index"]
-    out_i = itp.get_output_details()[0]["index"]
+    results, plans = [None] * len(audio_paths), {}
+    for k, path in enumerate(audio_paths):
+        try:
+            with stage("decode"):
+                y = _decode(path)
+            with stage("gate"):
+                plans[k] = WindowPlan(y)
+        except Exception as e:
+            log.warning("Cannot tag %s: %s", path, e)
+            results[k] = e
 
-    itp.resize_tensor_input(inp_i, [len(samples), samples.shape[1]])
-    itp.allocate_tensors()
-    itp.set_tensor(inp_i, samples)
-    itp.invoke()
-    scores = itp.get_tensor(out_i)            
+    # TF-Lite inference: first pass, then the fine re-scan around coarse hits
+    keys   = list(plans)
+    starts = [plans[k].first() for k in keys]
+    with stage("inference"):
+        scores = _score(itp, inp_i, out_i, [(plans[k], s) for k, s in zip(keys, starts)], len(labels))
+    fine = [plans[k].refine(s, sc) for k, s, sc in zip(keys, starts, scores)]
+    if any(len(f) for f in fine):
+        with stage("inference"):
+            more = _score(itp, inp_i, out_i, [(plans[k], f) for k, f in zip(keys, fine)], len(labels))
+        scores = [np.vstack([a, b]) for a, b in zip(scores, more)]
 
-    # max over frames
-    max_scores = scores.max(axis=0)
-    idx = np.where(max_scores >= THRESHOLD)[0]
-    species = {labels[i]: 1 for i in idx}
+    for k, sc in zip(keys, scores):
+        plan = plans[k]
+        # max over frames
+        max_scores = sc.max(axis=0) if len(sc) else np.zeros(len(labels))
+        species = {labels[i]: 1 for i in np.where(max_scores >= THRESHOLD)[0]}
+        log.info("%s: %d windows scored, %.0f%% of %d skipped; %d species: %s",
+                 os.path.basename(audio_paths[k]), plan.scored, plan.skipped * 100, plan.total,
+                 len(species), list(species.keys())[:5])
+        results[k] = (species, len(plan.y) / SAMPLE_RATE)
 
-    log.info("Detected %d species: %s", len(species), list(species.keys())[:5])
-    duration = len(y) / SAMPLE_RATE
+    scored = sum(p.scored for p in plans.values())
+    total  = sum(p.total for p in plans.values())
+    incr("audio_windows", scored)
+    incr("audio_windows_skipped", max(0, total - scored))
+    if total:
+        put("audio_skipped_fraction", round(max(0.0, 1 - scored / total), 3))
+    return results
 
-    return species, duration
\ No newline at end of file
+def main(audio_path: str, model_path: str, label_path: str) -> dict:
+    """(species, duration) of one recording."""
+    result, = main_batch([audio_path], model_path, label_path)
+    if isinstance(result, Exception):
+        raise result
+    return result
@@ -1,7 +1,13 @@
 import os, tempfile, json, logging, boto3
-from datetime import datetime, timezone
 from decimal import Decimal
-from audio_tagger import main as run_birdnet
+from audio_tagger import main_batch as run_birdnet_batch, load_model
+from birdtag_common.item_keys import media_item_id, event_time, already_ingested, upsert_item
+from birdtag_common.s3_events import iter_s3_records, until_low_on_time, respond
+from birdtag_common.metrics import instrumented, instrument_client, stage, incr
+from birdtag_common.model_cache import LatestModelFiles
+from birdtag_common.species import default_vocabulary
+from birdtag_common.query_cache import bump_species_safely, SPECIES_VERSION_TABLE
+from birdtag_common.stats import record_change_safely
 import subprocess
 
 log = logging.getLogger()
@@ -10,43 +16,38 @@ log.setLevel(logging.INFO)
 MODEL_BUCKET = os.environ["MODEL_BUCKET"]
 MODEL_PREFIX = os.getenv("MODEL_PREFIX", "birdnet-audio-model/")
 TABLE_NAME   = os.environ["TABLE_NAME"]
+MIN_TIME_LEFT_MS = int(os.getenv("MIN_TIME_LEFT_MS", 30000))  # don't start work after this
+PRELOAD_MODEL    = os.getenv("PRELOAD_MODEL", "1") == "1"     # load model during init
+AUDIO_BATCH      = int(os.getenv("AUDIO_BATCH", 8))           # recordings per inference batch
 
-REGION = "us-east-1"
-s3     = boto3.client("s3")
-table  = boto3.resource("dynamodb", region_name=REGION).Table(TABLE_NAME)
-
-def _download_latest_model(tmpdir: str) -> tuple[str, str]:
-    """
-    Pick the most-recent .tflite and the most-recent .txt under
-    MODEL_BUCKET / MODEL_PREFIX and return their LOCAL paths.
-    """
-    resp   = s3.list_objects_v2(Bucket=MODEL_BUCKET, Prefix=MODEL_PREFIX)
-    objs   = resp.get("Contents", [])
-
-    # newest model
-    models = [o for o in objs if o["Key"].lower().endswith(".tflite")]
-    if not models:
-        raise RuntimeError("No .tflite model found in S3")
-    mod_obj = max(models, key=lambda o: o["LastModified"])
-
-    # newest label file
-    labels = [o for o in objs if o["Key"].lower().endswith(".txt")]
-    if not labels:
-        raise RuntimeError("No .txt label file found in S3")
-    lab_obj = max(labels, key=lambda o: o["LastModified"])
-
-    # local paths
-    local_model = os.path.join(tmpdir, os.path.basename(mod_obj["Key"]))
-    local_label = os.path.join(tmpdir, os.path.basename(lab_obj["Key"]))
-
-    # download
-    s3.download_file(MODEL_BUCKET, mod_obj["Key"], local_model)
-    s3.download_file(MODEL_BUCKET, lab_obj["Key"], local_label)
-
-    print(f"[INFO] Using model : s3://{MODEL_BUCKET}/{mod_obj['Key']}")
-    print(f"[INFO] Using labels: s3://{MODEL_BUCKET}/{lab_obj['Key']}")
-    return local_model, local_label
+AUDIO_EXT = ("wav", "mp3", "flac", "m4a", "ogg")
 
+REGION = "us-east-1"
+s3       = instrument_client(boto3.client("s3"))
+dynamodb = instrument_client(boto3.resource("dynamodb", region_name=REGION))
+table    = instrument_client(dynamodb.Table(TABLE_NAME))
+# per-species versions that invalidate cached /search results (optional)
+versions_table = (instrument_client(dynamodb.Table(SPECIES_VERSION_TABLE))
+                  if SPECIES_VERSION_TABLE else None)
+
+# newest .tflite + newest .txt under MODEL_PREFIX, kept in /tmp across invocations
+_model_files = LatestModelFiles(s3, MODEL_BUCKET, MODEL_PREFIX, [".tflite", ".txt"])
+
+def _load_latest_model(force=False) -> tuple[str, str]:
+    """Return local (model, labels) paths, downloading only new versions."""
+    with stage("model_download"):
+        (model_path, label_path), changed = _model_files.get(force)
+    # a re-upload under the same file name lands on the same local path
+    load_model(model_path, label_path, reload=changed)
+    return model_path, label_path
+
+# Build the interpreter during the init phase so the first event does not
+# wait for it; a failure here is retried in the handler.
+if PRELOAD_MODEL:
+    try:
+        _load_latest_model(force=True)
+    except Exception as e:
+        log.warning("Model preload failed, loading on first event: %s", e)
 
 
 def convert_mp3_to_wav(mp3_path, wav_path):
@@ -58,45 +59,128 @@ def convert_mp3_to_wav(mp3_path, wav_path):
     subprocess.check_call(cmd)
 
 
-def lambda_handler(event, _ctx):
-    rec = event["Records"][0]
-    bucket = rec["s3"]["bucket"]["name"]
-    key    = rec["s3"]["object"]["key"]
+def _prepare(up, tmp):
+    """Checks and download of one upload: (response, None) if nothing is left to do, else (None, local path)."""
+    bucket, key = up.bucket, up.key
     fname  = os.path.basename(key)
     ext    = os.path.splitext(fname)[1].lstrip(".").lower()
 
-    if ext not in ("wav", "mp3","flac", "m4a", "ogg"):
+    if ext not in AUDIO_EXT:
         log.warning("Unsupported file type: %s", ext)
-        return {"statusCode": 415, "msg": "unsupported file type"}
+        return {"statusCode": 415, "msg": "unsupported file type"}, None
 
-    with tempfile.TemporaryDirectory() as tmp:
-        local_audio = os.path.join(tmp, fname)
+    # Same object => same row; a retried invocation has nothing left to do
+    item_id = media_item_id(bucket, key, up.version_id)
+    if already_ingested(table, item_id, up.etag):
+        log.info("%s already ingested as %s, skipping", key, item_id)
+        return {"statusCode": 200, "msg": "already ingested", "uniqueId": item_id}, None
+
+    workdir = tempfile.mkdtemp(dir=tmp)     # same basename can arrive twice
+    local_audio = os.path.join(workdir, fname)
+    with stage("download"):
         s3.download_file(bucket, key, local_audio)
-        model_path, label_path = _download_latest_model(tmp)
-
-
-        tags, duration = run_birdnet(local_audio, model_path, label_path)
-        detected = bool(tags)
-
-        upload_time = datetime.utcnow().replace(tzinfo=timezone.utc).isoformat()
-        item = {
-            "uniqueId"     : upload_time,
-            "uploadTime"   : upload_time,
-            "deleted"      : False,
-            "detected"     : detected,
-            "fileSize"     : Decimal(os.path.getsize(local_audio)),
-            "format"       : ext,
-            "mediaID"      : fname,
-            "mediaType"    : "audio",
-            "originalURL"  : f"https://{bucket}.s3.{REGION}.amazonaws.com/{key}",
-            "annotatedURL" : None,
-            "thumbnailURL" : None,
-            "tags"         : {k: Decimal(1) for k in tags},
-            "duration"     : Decimal(str(duration))
-        }
-
-        table.put_item(Item=item)
+    return None, local_audio
+
+
+def _write(up, local_audio, labels, duration):
+    """Build and write the catalog row of one tagged upload."""
+    bucket, key = up.bucket, up.key
+    fname   = os.path.basename(key)
+    ext     = os.path.splitext(fname)[1].lstrip(".").lower()
+    item_id = media_item_id(bucket, key, up.version_id)
+
+    # "Corvus brachyrhynchos_American Crow" -> "american crow"
+    tags = {default_vocabulary().add(label): 1 for label in labels}
+    detected = bool(tags)
+
+    upload_time = event_time(up.record)
+    item = {
+        "uniqueId"     : item_id,
+        "sourceETag"   : up.etag,
+        "uploadTime"   : upload_time,
+        "deleted"      : False,
+        "detected"     : detected,
+        "fileSize"     : Decimal(os.path.getsize(local_audio)),
+        "format"       : ext,
+        "mediaID"      : fname,
+        "mediaType"    : "audio",
+        "originalURL"  : f"https://{bucket}.s3.{REGION}.amazonaws.com/{key}",
+        "annotatedURL" : None,
+        "thumbnailURL" : None,
+        "tags"         : {k: Decimal(1) for k in tags},
+        "duration"     : Decimal(str(duration))
+    }
+
+    with stage("db_write"):
+        written, replaced, row = upsert_item(table, item)
+    if written:
         log.info("DynamoDB item written")
+        # a replaced row may have carried species the new one no longer has
+        old_tags = default_vocabulary().canonical_tags((replaced or {}).get("tags") or {})
+        new_tags = default_vocabulary().canonical_tags(row.get("tags") or {})  # user edits kept
+        bump_species_safely(versions_table, set(new_tags) | set(old_tags))
+        record_change_safely(dynamodb, replaced, row)      # STATS_TABLE counters
+    else:
+        log.info("DynamoDB item %s already written by another invocation", item_id)
+
+    return {"statusCode": 200, "uniqueId": item_id,
+            "meta": {"file": fname, "detected": detected, "tags": tags}}
+
+
+def _run_batch(batch):
+    """Tag [(upload, local path)] in shared inference batches; isolate failures to single uploads."""
+    results, failed = [], []
+    try:
+        model_path, label_path = _load_latest_model()
+        outputs = run_birdnet_batch([local for _, local in batch], model_path, label_path)
+    except Exception:
+        log.exception("Inference failed for a batch of %d recordings", len(batch))
+        return [], [up for up, _ in batch]
+    for (up, local), out in zip(batch, outputs):
+        try:
+            if isinstance(out, Exception):
+                raise out
+            results.append(_write(up, local, *out))
+        except Exception:
+            log.exception("Failed to process s3://%s/%s", up.bucket, up.key)
+            failed.append(up)
+    return results, failed
+
+
+@instrumented
+def lambda_handler(event, ctx):
+    """
+    Accepts a direct S3 notification or an SQS batch of S3 notifications and
+    processes every record, tagging up to AUDIO_BATCH recordings per
+    `main_batch` call. With SQS, failed or deferred records are
+    returned as batchItemFailures so the queue retries only those.
+    """
+    results, failed = [], []
 
-        return {"statusCode": 200,
-                "meta": {"file": fname, "detected": detected, "tags": tags}}
+    with tempfile.TemporaryDirectory() as tmp:
+        pending = []
+        # Backpressure: leave the rest in the queue rather than time out
+        for up in until_low_on_time(iter_s3_records(event), ctx, MIN_TIME_LEFT_MS, failed):
+            try:
+                response, local = _prepare(up, tmp)
+                if response:
+                    results.append(response)
+                else:
+                    pending.append((up, local))
+            except Exception:
+                log.exception("Failed to process s3://%s/%s", up.bucket, up.key)
+                failed.append(up)
+            # recordings of one batch share fixed-shape interpreter calls
+            if len(pending) == AUDIO_BATCH:
+                ok, bad = _run_batch(pending)
+                results += ok
+                failed  += bad
+                pending = []
+        if pending:
+            ok, bad = _run_batch(pending)
+            results += ok
+            failed  += bad
+
+    incr("records_ok", len(results))
+    incr("records_failed", len(failed))
+    return respond(event, results, failed)
@@ -0,0 +1,94 @@
+"""
+Fan-out cost of tag alerts: SNS filter policies vs the in-process matcher.
+
+Runs locally with synthetic users and uploads, no AWS access needed:
+
+    python benchmarks/bench_tag_matcher.py --users 1000 10000 --species 300
+
+Per batch it reports, for the current per-species publish approach, the
+number of publishes, filter-policy evaluations SNS performs and emails
+delivered; and for the digest approach, index lookups, emails delivered
+and the measured in-process matching time.
+"""
+import argparse
+import functools
+import itertools
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "SNS"))
+from tag_matcher import SubscriptionIndex  # noqa: E402
+
+
+@functools.lru_cache(maxsize=None)
+def _zipf_cum_weights(n, s):
+    return list(itertools.accumulate(1.0 / (i + 1) ** s for i in range(n)))
+
+
+def zipf_choice(rng, n, k, s=1.1):
+    """k distinct species ids, popular species more likely (bird sightings are skewed)."""
+    cum = _zipf_cum_weights(n, s)
+    picked = set()
+    while len(picked) < min(k, n):
+        picked.add(rng.choices(range(n), cum_weights=cum)[0])
+    return [f"species-{i}" for i in picked]
+
+
+def build(rng, users, species, tags_per_user):
+    index = SubscriptionIndex()
+    for u in range(users):
+        index.set_user(f"user{u}@example.com",
+                       zipf_choice(rng, species, rng.randint(1, tags_per_user)))
+    return index
+
+
+def run(users, species, tags_per_user, uploads, tags_per_upload, seed):
+    rng = random.Random(seed)
+    index = build(rng, users, species, tags_per_user)
+    batch = [{"media_id": f"m{i}", "tags": zipf_choice(rng, species, rng.randint(1, tags_per_upload))}
+             for i in range(uploads)]
+
+    # Current approach: one publish per (upload, species); SNS evaluates every
+    # subscription's filter policy against each message.
+    publishes = sum(len(u["tags"]) for u in batch)
+    sns_evals = publishes * len(index)
+    sns_emails = sum(len(index.subscribers.get(t, ())) for u in batch for t in u["tags"])
+
+    start = time.perf_counter()
+    digests = index.digests(batch)
+    match_ms = (time.perf_counter() - start) * 1000
+
+    return {
+        "users": users,
+        "publishes": publishes,
+        "sns_filter_evals": sns_evals,
+        "sns_emails": sns_emails,
+        "digest_lookups": publishes,
+        "digest_emails": len(digests),
+        "match_ms": round(match_ms, 2),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--users", type=int, nargs="+", default=[100, 1000, 10000, 100000])
+    ap.add_argument("--species", type=int, default=300)
+    ap.add_argument("--tags-per-user", type=int, default=5)
+    ap.add_argument("--uploads", type=int, default=100, help="uploads per stream batch")
+    ap.add_argument("--tags-per-upload", type=int, default=3)
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+
+    cols = ["users", "publishes", "sns_filter_evals", "sns_emails",
+            "digest_lookups", "digest_emails", "match_ms"]
+    print("  ".join(f"{c:>16}" for c in cols))
+    for users in args.users:
+        row = run(users, args.species, args.tags_per_user, args.uploads,
+                  args.tags_per_upload, args.seed)
+        print("  ".join(f"{row[c]:>16}" for c in cols))
+
+
+if __name__ == "__main__":
+    main()
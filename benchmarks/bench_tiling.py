@@ -0,0 +1,169 @@
+"""
+Latency vs recall of the image tagger's inference modes on large photos.
+
+Every image is run through `image_video_tagger.detect_images` in each
+TILE_MODE (off: full decode + one letterboxed pass; auto: reduced decode,
+coarse pass, tiles only where unsure; full: reduced decode + every tile)
+and the detections are scored against ground truth at IoU >= 0.5:
+
+    python benchmarks/bench_tiling.py --yolo-weights model.pt --images data/birds
+    python benchmarks/bench_tiling.py --yolo-weights model.pt --images data/birds --synthetic 20
+
+`--images` is a directory of photos with YOLO labels next to them
+(`photo.jpg` + `photo.txt`, lines of `class cx cy w h`, normalized).
+`--synthetic N` instead builds N 24 MP scenes by pasting the labelled birds,
+shrunk to distant-bird sizes, onto enlarged backgrounds from the same
+photos, which is where the modes differ most. Per mode it reports p50/p95
+latency, recall, precision and tiles per image.
+"""
+import argparse
+import glob
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+
+import stand_ins  # noqa: E402
+
+stand_ins.ensure_common_on_path()
+sys.path.insert(0, os.path.join(ROOT, "object-detection-lambda"))
+
+MODES = ("off", "auto", "full")
+
+
+def read_labels(image_path, width, height):
+    """YOLO label file -> [(class, x1, y1, x2, y2)] in pixels."""
+    boxes = []
+    label_path = os.path.splitext(image_path)[0] + ".txt"
+    if os.path.exists(label_path):
+        with open(label_path) as fh:
+            for line in fh:
+                parts = line.split()
+                if len(parts) == 5:
+                    c, cx, cy, w, h = int(parts[0]), *map(float, parts[1:])
+                    boxes.append((c, (cx - w / 2) * width, (cy - h / 2) * height,
+                                  (cx + w / 2) * width, (cy + h / 2) * height))
+    return boxes
+
+
+def synthetic_scenes(paths, n, out_dir, seed=0, size=(6000, 4000), birds=(3, 12), bird_px=(24, 160)):
+    """Paste shrunken labelled birds onto enlarged backgrounds; [(path, truth)]."""
+    import cv2
+    rng = random.Random(seed)
+    crops = []
+    for path in paths:
+        img = cv2.imread(path)
+        for c, x1, y1, x2, y2 in read_labels(path, img.shape[1], img.shape[0]):
+            crop = img[int(y1):int(y2), int(x1):int(x2)]
+            if crop.size:
+                crops.append((c, crop))
+    if not crops:
+        raise SystemExit("--synthetic needs labelled birds in --images")
+    scenes = []
+    W, H = size
+    for i in range(n):
+        scene = cv2.resize(cv2.imread(rng.choice(paths)), (W, H), interpolation=cv2.INTER_LINEAR)
+        truth = []
+        for _ in range(rng.randint(*birds)):
+            c, crop = rng.choice(crops)
+            s = rng.randint(*bird_px) / max(crop.shape[:2])
+            small = cv2.resize(crop, (max(1, int(crop.shape[1] * s)), max(1, int(crop.shape[0] * s))),
+                               interpolation=cv2.INTER_AREA)
+            h, w = small.shape[:2]
+            x, y = rng.randint(0, W - w), rng.randint(0, H - h)
+            scene[y:y + h, x:x + w] = small
+            truth.append((c, x, y, x + w, y + h))
+        path = os.path.join(out_dir, f"scene{i:03d}.jpg")
+        cv2.imwrite(path, scene, [cv2.IMWRITE_JPEG_QUALITY, 92])
+        scenes.append((path, truth))
+    return scenes
+
+
+def _iou(a, b):
+    w = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+    h = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = w * h
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def score(pred, truth, iou=0.5):
+    """(true positives, predictions, ground-truth boxes), greedy one-to-one matching."""
+    used, tp = set(), 0
+    for box in pred:
+        best, best_iou = None, iou
+        for j, t in enumerate(truth):
+            if j not in used and _iou(box, t[1:]) >= best_iou:
+                best, best_iou = j, _iou(box, t[1:])
+        if best is not None:
+            used.add(best)
+            tp += 1
+    return tp, len(pred), len(truth)
+
+
+def run_mode(iv, samples, mode, conf):
+    from birdtag_common.metrics import METRICS
+    latencies, tp, n_pred, n_true, tiles = [], 0, 0, 0, 0
+    for path, truth in samples:
+        METRICS.reset()
+        start = time.perf_counter()
+        (_, boxes, _, _, scale), = iv.detect_images([path], conf, mode)
+        latencies.append((time.perf_counter() - start) * 1000)
+        tiles += METRICS.counts.get("tiles", 0)
+        a, b, c = score([tuple(b * scale) for b in boxes], truth)
+        tp, n_pred, n_true = tp + a, n_pred + b, n_true + c
+    latencies.sort()
+    return {"mode": mode, "images": len(samples),
+            "p50_ms": round(statistics.median(latencies), 1),
+            "p95_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 1),
+            "recall": round(tp / n_true, 3) if n_true else None,
+            "precision": round(tp / n_pred, 3) if n_pred else None,
+            "tiles_per_image": round(tiles / len(samples), 1)}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--yolo-weights", required=True)
+    ap.add_argument("--images", required=True, help="directory of photos with YOLO .txt labels")
+    ap.add_argument("--synthetic", type=int, default=0, help="build this many 24 MP scenes instead")
+    ap.add_argument("--modes", nargs="+", default=list(MODES), choices=MODES)
+    ap.add_argument("--conf", type=float, default=0.7)
+    ap.add_argument("--json", help="write the results to this file")
+    args = ap.parse_args(argv)
+
+    import cv2
+    import image_video_tagger as iv
+    iv.get_model(args.yolo_weights)
+
+    paths = sorted(p for ext in ("jpg", "jpeg", "png")
+                   for p in glob.glob(os.path.join(args.images, f"*.{ext}")))
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.synthetic:
+            samples = synthetic_scenes(paths, args.synthetic, tmp)
+        else:
+            samples = []
+            for p in paths:
+                img = cv2.imread(p)
+                samples.append((p, read_labels(p, img.shape[1], img.shape[0])))
+        iv.detect_images([samples[0][0]], args.conf, "off")       # warm-up
+        results = [run_mode(iv, samples, mode, args.conf) for mode in args.modes]
+
+    print(f"{'mode':6} {'p50 ms':>8} {'p95 ms':>8} {'recall':>7} {'precision':>9} {'tiles':>6}")
+    for r in results:
+        print(f"{r['mode']:6} {r['p50_ms']:>8} {r['p95_ms']:>8} {str(r['recall']):>7} "
+              f"{str(r['precision']):>9} {r['tiles_per_image']:>6}")
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(results, fh, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
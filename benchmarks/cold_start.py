@@ -0,0 +1,161 @@
+"""
+Cold-start report per Lambda.
+
+Every Lambda is imported in a fresh Python process (like a new execution
+environment) against the in-memory AWS stand-ins, and three numbers are
+reported: init (module import incl. anything done at module level, such as
+model preloading), the first invocation and a warm invocation. The heaviest
+imports done during init (from `python -X importtime`) are listed, so it is
+visible which package a cold start pays for. boto3 itself is replaced by
+the stand-ins, so its import time is not part of the numbers.
+
+    python benchmarks/cold_start.py
+    python benchmarks/cold_start.py --lambdas tagger.image --yolo-weights yolov8n.pt
+    python benchmarks/cold_start.py --json cold.json
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MARK = "@@cold_start@@"
+
+# lambda name -> route builder in run_benchmarks and the module(s) it imports
+GROUPS = {
+    "web": "web_routes",
+    "sns": "sns_routes",
+    "thumbnail": "thumbnail_routes",
+    "tagger.image": "image_tagger_routes",
+    "tagger.audio": "audio_tagger_routes",
+}
+
+
+# ─────────────────────────────── child process ──────────────────────────────
+def child(group, args):
+    sys.path.insert(0, HERE)
+    import run_benchmarks as rb
+
+    inits = {}
+    load = rb.load_lambda
+
+    def timed_load(alias, rel_path, env=None):
+        print(f"{MARK} begin {alias}", file=sys.stderr, flush=True)
+        start = time.perf_counter()
+        try:
+            return load(alias, rel_path, env)
+        finally:
+            inits[alias] = (time.perf_counter() - start) * 1000
+            print(f"{MARK} end {alias}", file=sys.stderr, flush=True)
+    rb.load_lambda = timed_load
+
+    env, catalog = rb.build_environment(args.items, 100, 50)
+    build = getattr(rb, GROUPS[group])
+    extra = {"image_tagger_routes": (args.yolo_weights,),
+             "audio_tagger_routes": (args.birdnet_model, args.birdnet_labels)}.get(GROUPS[group], ())
+    devnull = open(os.devnull, "w")
+    real_stdout, sys.stdout = sys.stdout, devnull
+    try:
+        try:
+            routes = build(env, catalog, args.items, *extra)
+        except rb.Skip as e:
+            sys.stdout = real_stdout
+            print(json.dumps({"group": group, "skipped": str(e)}))
+            return
+        # first route per Lambda module: first call is the cold one
+        seen, rows = set(), []
+        for name, (handler, make_event) in routes.items():
+            module = handler.__module__
+            if module in seen:
+                continue
+            seen.add(module)
+            times = []
+            for i in range(2):
+                start = time.perf_counter()
+                handler(make_event(i), rb.LambdaContext())
+                times.append((time.perf_counter() - start) * 1000)
+            rows.append({"route": name, "module": module,
+                         "init_ms": round(inits.get(module, 0.0), 1),
+                         "first_ms": round(times[0], 1), "warm_ms": round(times[1], 1)})
+    finally:
+        sys.stdout = real_stdout
+    rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({"group": group, "rows": rows, "max_rss_mb": round(rss_mb, 1)}))
+
+
+# ─────────────────────────────── parent process ─────────────────────────────
+def heavy_imports(stderr, top):
+    """Top-level imports done between the begin/end markers, by cumulative time."""
+    per_alias, alias = {}, None
+    for line in stderr.splitlines():
+        if line.startswith(MARK):
+            _, what, name = line.split()
+            alias = name if what == "begin" else None
+            continue
+        if alias is None or not line.startswith("import time:"):
+            continue
+        try:
+            _, cumulative, name = line[len("import time:"):].split("|")
+            cumulative = int(cumulative)
+        except ValueError:
+            continue        # header line
+        if name.startswith("  "):
+            continue        # nested import, already counted by its parent
+        per_alias.setdefault(alias, []).append((cumulative / 1000, name.strip()))
+    return {a: sorted(v, reverse=True)[:top] for a, v in per_alias.items()}
+
+
+def run_group(group, args):
+    cmd = [sys.executable, "-X", "importtime", os.path.abspath(__file__), "--child", group,
+           "--items", str(args.items)]
+    for flag in ("yolo_weights", "birdnet_model", "birdnet_labels"):
+        if getattr(args, flag):
+            cmd += [f"--{flag.replace('_', '-')}", getattr(args, flag)]
+    proc = subprocess.run(cmd, capture_output=True, text=True)
+    if proc.returncode != 0:
+        return {"group": group, "error": proc.stderr.strip().splitlines()[-1:]}
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    imports = heavy_imports(proc.stderr, args.top)
+    for row in result.get("rows", []):
+        row["imports"] = imports.get(row["module"], [])
+    return result
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--lambdas", nargs="+", default=list(GROUPS), choices=list(GROUPS))
+    ap.add_argument("--items", type=int, default=1000)
+    ap.add_argument("--top", type=int, default=3, help="heaviest imports to list per Lambda")
+    ap.add_argument("--yolo-weights")
+    ap.add_argument("--birdnet-model")
+    ap.add_argument("--birdnet-labels")
+    ap.add_argument("--json", help="write results to this file")
+    ap.add_argument("--child", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        return child(args.child, args)
+
+    results = []
+    print(f"{'lambda':30} {'init ms':>9} {'1st ms':>9} {'warm ms':>9} {'rss MB':>8}  heaviest imports")
+    for group in args.lambdas:
+        res = run_group(group, args)
+        results.append(res)
+        if "skipped" in res or "error" in res:
+            print(f"{group:30} {'skipped: ' + str(res.get('skipped') or res.get('error'))}")
+            continue
+        for row in res["rows"]:
+            imports = ", ".join(f"{name} {ms:.0f}ms" for ms, name in row["imports"])
+            print(f"{row['module']:30} {row['init_ms']:>9} {row['first_ms']:>9} {row['warm_ms']:>9} "
+                  f"{res['max_rss_mb']:>8}  {imports}")
+
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
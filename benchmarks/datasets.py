@@ -0,0 +1,166 @@
+"""
+Synthetic catalog rows, users and media for the benchmarks.
+
+Rows mirror what the tagger Lambdas write (numbers as Decimal, as boto3
+returns them). Species popularity is Zipf-skewed like real sightings.
+"""
+import io
+import itertools
+import math
+import random
+import struct
+import wave
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+UPLOAD_BUCKET = "birdtag-uploads"
+ANNOT_BUCKET = "birdtag-annotated"
+REGION = "us-east-1"
+MEDIA_FORMATS = {"image": ("jpg", "png"), "video": ("mp4",), "audio": ("wav", "mp3")}
+COMMON_SPECIES = ["crow", "pigeon", "kingfisher", "myna", "sparrow", "magpie", "owl",
+                  "eagle", "parrot", "peacock"]
+
+
+def species_names(n):
+    names = list(COMMON_SPECIES[:n])
+    names += [f"species-{i}" for i in range(len(names), n)]
+    return names
+
+
+def _zipf_cum(n, s=1.1):
+    return list(itertools.accumulate(1.0 / (i + 1) ** s for i in range(n)))
+
+
+def url(bucket, key):
+    return f"https://{bucket}.s3.{REGION}.amazonaws.com/{key}"
+
+
+def synthetic_items(n, species=200, seed=0, start=datetime(2025, 1, 1, tzinfo=timezone.utc)):
+    """Yield `n` catalog rows."""
+    rng = random.Random(seed)
+    names = species_names(species)
+    cum = _zipf_cum(species)
+    media_types = ["image"] * 6 + ["video"] * 2 + ["audio"] * 2
+    for i in range(n):
+        media = rng.choice(media_types)
+        ext = rng.choice(MEDIA_FORMATS[media])
+        fname = f"bird{i:07d}.{ext}"
+        k = rng.choices((0, 1, 2, 3), weights=(10, 60, 20, 10))[0]
+        tags = {}
+        for idx in rng.choices(range(species), cum_weights=cum, k=k):
+            tags[names[idx]] = Decimal(1 if media == "audio" else rng.randint(1, 5))
+        up_time = (start + timedelta(seconds=i * 37)).isoformat()
+        item = {
+            "uniqueId": f"{i:032x}",
+            "uploadTime": up_time,
+            "deleted": False,
+            "detected": bool(tags),
+            "fileSize": Decimal(rng.randint(50_000, 20_000_000)),
+            "format": ext,
+            "mediaID": fname,
+            "mediaType": media,
+            "originalURL": url(UPLOAD_BUCKET, f"raw_uploads/{fname}"),
+            "annotatedURL": None if media == "audio" else url(ANNOT_BUCKET, f"annotated/{fname}"),
+            "thumbnailURL": None if media == "audio" else url(UPLOAD_BUCKET, f"thumbnails/{fname}"),
+            "tags": tags,
+        }
+        if media != "image":
+            item["duration"] = Decimal(str(round(rng.uniform(3, 120), 1)))
+        yield item
+
+
+def synthetic_users(n, species=200, tags_per_user=5, seed=0):
+    rng = random.Random(seed)
+    names = species_names(species)
+    cum = _zipf_cum(species)
+    for u in range(n):
+        picks = {names[i] for i in rng.choices(range(species), cum_weights=cum,
+                                               k=rng.randint(1, tags_per_user))}
+        yield {"email": f"user{u}@example.com", "tags": sorted(picks)}
+
+
+# ─────────────────────────── DynamoDB stream JSON ───────────────────────────
+def to_ddb_json(value):
+    if isinstance(value, bool):
+        return {"BOOL": value}
+    if value is None:
+        return {"NULL": True}
+    if isinstance(value, (int, float, Decimal)):
+        return {"N": str(value)}
+    if isinstance(value, str):
+        return {"S": value}
+    if isinstance(value, dict):
+        return {"M": {k: to_ddb_json(v) for k, v in value.items()}}
+    if isinstance(value, (list, tuple)):
+        return {"L": [to_ddb_json(v) for v in value]}
+    raise TypeError(type(value))
+
+
+def stream_record(event_name, new=None, old=None, keys=None):
+    ddb = {}
+    if new is not None:
+        ddb["NewImage"] = to_ddb_json(new)["M"]
+    if old is not None:
+        ddb["OldImage"] = to_ddb_json(old)["M"]
+    if keys is not None:
+        ddb["Keys"] = to_ddb_json(keys)["M"]
+    return {"eventName": event_name, "eventSource": "aws:dynamodb", "dynamodb": ddb}
+
+
+# ─────────────────────────── generated media ────────────────────────────────
+def wav_bytes(seconds=9.0, rate=48000, chirps=3, seed=0):
+    """Mono 16-bit WAV: low noise with a few short chirps (pure stdlib)."""
+    rng = random.Random(seed)
+    n = int(seconds * rate)
+    starts = sorted(rng.uniform(0, seconds - 0.5) for _ in range(chirps))
+    frames = bytearray()
+    for i in range(n):
+        t = i / rate
+        v = rng.gauss(0, 300)
+        for s in starts:
+            if s <= t < s + 0.4:
+                f = 2500 + 3000 * (t - s)
+                v += 8000 * math.sin(2 * math.pi * f * t)
+        frames += struct.pack("<h", max(-32768, min(32767, int(v))))
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(bytes(frames))
+    return buf.getvalue()
+
+
+def image_bytes(width=1920, height=1080, ext="jpg", seed=0):
+    """Noisy gradient image with a few dark blobs; needs numpy + cv2."""
+    import numpy as np
+    import cv2
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    img = np.stack([(x * 255 // max(1, width - 1)), (y * 255 // max(1, height - 1)),
+                    np.full_like(x, 128)], axis=-1).astype(np.uint8)
+    img = np.clip(img + rng.normal(0, 12, img.shape), 0, 255).astype(np.uint8)
+    for _ in range(4):
+        cx, cy = int(rng.integers(0, width)), int(rng.integers(0, height))
+        cv2.ellipse(img, (cx, cy), (width // 30, height // 40), 0, 0, 360, (20, 20, 20), -1)
+    ok, buf = cv2.imencode(f".{ext}", img)
+    if not ok:
+        raise RuntimeError("imencode failed")
+    return buf.tobytes()
+
+
+def video_bytes(path, seconds=3, fps=25, width=640, height=360, seed=0):
+    """Write a short moving-blob MP4 to `path` and return its bytes; needs cv2."""
+    import numpy as np
+    import cv2
+    rng = np.random.default_rng(seed)
+    vw = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    for f in range(int(seconds * fps)):
+        frame = np.full((height, width, 3), 170, np.uint8)
+        frame = np.clip(frame + rng.normal(0, 8, frame.shape), 0, 255).astype(np.uint8)
+        cx = int(width * (0.1 + 0.8 * f / (seconds * fps)))
+        cv2.ellipse(frame, (cx, height // 2), (30, 18), 0, 0, 360, (25, 25, 25), -1)
+        vw.write(frame)
+    vw.release()
+    with open(path, "rb") as fh:
+        return fh.read()
@@ -0,0 +1,129 @@
+"""
+In-process stand-in for an SQS queue and the Lambda event source mapping
+that drains it (batching, visibility timeout, partial batch failures,
+redrive to a dead-letter list, capped concurrency).
+"""
+import json
+import threading
+import time
+import uuid
+
+
+class LocalQueue:
+    def __init__(self, visibility_timeout=30.0, max_receive_count=3):
+        self.visibility_timeout = visibility_timeout
+        self.max_receive_count = max_receive_count
+        self.messages = {}          # id -> dict(body, sent_at, visible_at, receives)
+        self.dead_letters = []
+        self.lock = threading.Lock()
+        self.max_depth = 0
+
+    def send(self, body):
+        msg_id = str(uuid.uuid4())
+        now = time.monotonic()
+        with self.lock:
+            self.messages[msg_id] = {"body": body if isinstance(body, str) else json.dumps(body),
+                                     "sent_at": now, "visible_at": now, "receives": 0}
+            self.max_depth = max(self.max_depth, len(self.messages))
+        return msg_id
+
+    def receive(self, max_messages=10):
+        now = time.monotonic()
+        batch = []
+        with self.lock:
+            for msg_id, msg in list(self.messages.items()):
+                if len(batch) >= max_messages:
+                    break
+                if msg["visible_at"] > now:
+                    continue
+                if msg["receives"] >= self.max_receive_count:
+                    self.dead_letters.append(self.messages.pop(msg_id))
+                    continue
+                msg["receives"] += 1
+                msg["visible_at"] = now + self.visibility_timeout
+                batch.append((msg_id, msg))
+        return batch
+
+    def delete(self, msg_id):
+        with self.lock:
+            return self.messages.pop(msg_id, None)
+
+    def release(self, msg_id, delay=0.0):
+        """Make a failed message visible again after `delay` seconds."""
+        with self.lock:
+            if msg_id in self.messages:
+                self.messages[msg_id]["visible_at"] = time.monotonic() + delay
+
+    def __len__(self):
+        with self.lock:
+            return len(self.messages)
+
+
+class FakeContext:
+    def __init__(self, timeout_s):
+        self.deadline = time.monotonic() + timeout_s
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self.deadline - time.monotonic()) * 1000))
+
+
+def sqs_event(batch):
+    return {"Records": [{"messageId": msg_id, "receiptHandle": msg_id, "body": msg["body"],
+                         "eventSource": "aws:sqs", "attributes": {
+                             "ApproximateReceiveCount": str(msg["receives"])}}
+                        for msg_id, msg in batch]}
+
+
+def drive(handler, queue, batch_size=10, concurrency=4, timeout_s=900,
+          retry_delay=None, producer_done=None):
+    """
+    Drain `queue` through `handler` like an SQS event source mapping with
+    MaximumConcurrency=`concurrency`. Returns stats about the run.
+
+    Failed messages become visible again after `retry_delay` seconds
+    (defaults to the queue's visibility timeout, as in SQS). Workers exit
+    once the queue is empty and `producer_done` (an Event, if given) is set.
+    """
+    retry_delay = queue.visibility_timeout if retry_delay is None else retry_delay
+    stats = {"invocations": 0, "handler_errors": 0, "failed_records": 0,
+             "done": 0, "latencies": []}
+    stats_lock = threading.Lock()
+
+    def worker():
+        while True:
+            batch = queue.receive(batch_size)
+            if not batch:
+                if len(queue) == 0 and (producer_done is None or producer_done.is_set()):
+                    return
+                time.sleep(0.01)
+                continue
+            failed = set()
+            try:
+                resp = handler(sqs_event(batch), FakeContext(timeout_s)) or {}
+                failed = {f["itemIdentifier"] for f in resp.get("batchItemFailures", [])}
+                error = False
+            except Exception as e:
+                print(f"[local_queue] handler raised: {e}")
+                failed = {msg_id for msg_id, _ in batch}
+                error = True
+            now = time.monotonic()
+            with stats_lock:
+                stats["invocations"] += 1
+                stats["handler_errors"] += error
+                stats["failed_records"] += len(failed)
+            for msg_id, msg in batch:
+                if msg_id in failed:
+                    queue.release(msg_id, retry_delay)
+                elif queue.delete(msg_id) is not None:
+                    with stats_lock:
+                        stats["done"] += 1
+                        stats["latencies"].append(now - msg["sent_at"])
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    stats["dead_letters"] = len(queue.dead_letters)
+    stats["max_depth"] = queue.max_depth
+    return stats
@@ -0,0 +1,242 @@
+"""
+Side-by-side regression check of two model versions before one goes live.
+
+Both taggers load whichever model was uploaded last under MODEL_PREFIX, so
+a candidate is run here first against the current (baseline) model on a
+local fixture set. Each model runs in its own fresh Python process, so
+that load time and peak RSS are its own. Every fixture is tagged with the
+real code paths (`tag_image` / `tag_video`, `audio_tagger.main`):
+
+    python benchmarks/model_regression.py --kind image --baseline v1.pt --candidate v2.pt \\
+        --fixtures data/regression/images --json report.json
+    python benchmarks/model_regression.py --kind audio --baseline v1.tflite --candidate v2.tflite \\
+        --labels labels.txt --fixtures data/regression/audio
+
+`--fixtures` is a directory of media files plus `expected.json` mapping each
+file name to the species it contains, e.g. {"crow1.jpg": {"crow": 2},
+"dawn.wav": ["american crow"]}. Names are compared after the same
+canonicalization the catalog uses. The report has per-species and overall
+precision/recall of species presence, per-item latency (p50/p95), model
+load time and peak RSS for both models, plus the list of regressions. The
+exit code is 1 when the candidate is worse than allowed by --max-*.
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+MARK = "@@model_regression@@"
+
+KINDS = {"image": ("jpg", "jpeg", "png"), "video": ("mp4", "avi", "mov"),
+         "audio": ("wav", "mp3", "flac", "m4a", "ogg")}
+
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def fixture_files(fixtures, kind):
+    """(file names, {name: expected tags}) of the fixtures `kind` can tag."""
+    with open(os.path.join(fixtures, "expected.json"), encoding="utf-8") as fh:
+        expected = json.load(fh)
+    exts = KINDS["image"] + KINDS["video"] if kind == "image" else KINDS[kind]
+    names = sorted(n for n in expected if n.rsplit(".", 1)[-1].lower() in exts)
+    missing = [n for n in names if not os.path.exists(os.path.join(fixtures, n))]
+    if missing:
+        raise SystemExit(f"expected.json lists missing fixtures: {missing[:5]}")
+    return names, expected
+
+
+# ─────────────────────────────── child process ──────────────────────────────
+def child(args):
+    """Load one model, tag every fixture and print one JSON line."""
+    sys.path.insert(0, HERE)
+    import stand_ins
+    stand_ins.ensure_common_on_path()
+    from birdtag_common.species import default_vocabulary
+
+    names, _ = fixture_files(args.fixtures, args.kind)
+    vocab = default_vocabulary()
+    real_stdout, sys.stdout = sys.stdout, sys.stderr      # taggers print progress
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        start = time.perf_counter()
+        if args.kind == "audio":
+            sys.path.insert(0, os.path.join(ROOT, "audio_tagger", "app"))
+            import audio_tagger as at
+            at.load_model(args.model, args.labels)
+
+            def run(path):
+                labels, _ = at.main(path, args.model, args.labels)
+                return {vocab.canonical(label): 1 for label in labels}
+        else:
+            sys.path.insert(0, os.path.join(ROOT, "object-detection-lambda"))
+            import image_video_tagger as iv
+            iv.get_model(args.model)
+
+            def run(path):
+                if path.rsplit(".", 1)[-1].lower() in KINDS["video"]:
+                    meta = iv.tag_video(path, out_dir=out_dir)
+                else:
+                    meta = iv.tag_image(path, out_dir=out_dir)
+                return vocab.canonical_tags(meta["tags"])
+        load_ms = (time.perf_counter() - start) * 1000
+        load_rss = _peak_rss_mb()
+
+        if names and args.warmup:
+            run(os.path.join(args.fixtures, names[0]))
+        items = []
+        for name in names:
+            start = time.perf_counter()
+            tags = run(os.path.join(args.fixtures, name))
+            items.append({"file": name, "latency_ms": round((time.perf_counter() - start) * 1000, 1),
+                          "tags": {k: int(v) for k, v in tags.items()}})
+
+    sys.stdout = real_stdout
+    print(MARK + json.dumps({"model": args.model, "load_ms": round(load_ms, 1),
+                             "rss_after_load_mb": load_rss, "peak_rss_mb": _peak_rss_mb(),
+                             "items": items}))
+
+
+def run_model(args, model):
+    cmd = [sys.executable, os.path.abspath(__file__), "--child", "--kind", args.kind,
+           "--fixtures", args.fixtures, "--model", model]
+    if args.labels:
+        cmd += ["--labels", args.labels]
+    if not args.warmup:
+        cmd += ["--no-warmup"]
+    proc = subprocess.run(cmd, capture_output=True, text=True)
+    lines = [l for l in proc.stdout.splitlines() if l.startswith(MARK)]
+    if proc.returncode or not lines:
+        sys.stderr.write(proc.stderr[-4000:])
+        raise SystemExit(f"evaluating {model} failed (exit {proc.returncode})")
+    return json.loads(lines[-1][len(MARK):])
+
+
+# ───────────────────────────────── scoring ──────────────────────────────────
+def _expected_tags(value, vocab):
+    if isinstance(value, dict):
+        return {vocab.canonical(k): v for k, v in value.items() if v}
+    return {vocab.canonical(k): 1 for k in value}
+
+
+def _ratio(n, d):
+    return round(n / d, 3) if d else None
+
+
+def score(run, expected, vocab):
+    """Per-species and overall precision/recall of species presence, and latency."""
+    counts = {}                 # species -> [tp, fp, fn]
+    for item in run["items"]:
+        truth = set(_expected_tags(expected[item["file"]], vocab))
+        pred = {k for k, v in item["tags"].items() if v}
+        for sp in truth | pred:
+            c = counts.setdefault(sp, [0, 0, 0])
+            c[0 if sp in truth and sp in pred else 1 if sp in pred else 2] += 1
+    per_species = {sp: {"tp": tp, "fp": fp, "fn": fn, "support": tp + fn,
+                        "precision": _ratio(tp, tp + fp), "recall": _ratio(tp, tp + fn)}
+                   for sp, (tp, fp, fn) in sorted(counts.items())}
+    tp, fp, fn = (sum(c[i] for c in counts.values()) for i in range(3))
+    latencies = sorted(item["latency_ms"] for item in run["items"])
+    return {
+        "model": run["model"],
+        "precision": _ratio(tp, tp + fp),
+        "recall": _ratio(tp, tp + fn),
+        "latency_p50_ms": round(statistics.median(latencies), 1) if latencies else None,
+        "latency_p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else None,
+        "load_ms": run["load_ms"],
+        "rss_after_load_mb": run["rss_after_load_mb"],
+        "peak_rss_mb": run["peak_rss_mb"],
+        "per_species": per_species,
+        "items": run["items"],
+    }
+
+
+def regressions(base, cand, args):
+    """Human-readable reasons the candidate should not go live."""
+    found = []
+    for metric in ("precision", "recall"):
+        if base[metric] is not None and cand[metric] is not None \
+                and base[metric] - cand[metric] > args.max_accuracy_drop:
+            found.append(f"{metric} {base[metric]} -> {cand[metric]}")
+    for sp, b in base["per_species"].items():
+        c = cand["per_species"].get(sp)
+        if c and b["support"] >= args.min_support and b["recall"] is not None \
+                and b["recall"] - (c["recall"] or 0) > args.max_species_drop:
+            found.append(f"recall of {sp} {b['recall']} -> {c['recall']}")
+    for metric, limit in (("latency_p50_ms", args.max_slowdown), ("latency_p95_ms", args.max_slowdown),
+                          ("load_ms", args.max_load_growth), ("peak_rss_mb", args.max_rss_growth)):
+        if base[metric] and cand[metric] and cand[metric] > base[metric] * (1 + limit):
+            found.append(f"{metric} {base[metric]} -> {cand[metric]} (> +{limit:.0%})")
+    return found
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--kind", choices=("image", "video", "audio"), required=True,
+                    help="image covers photos and videos in the fixtures; video only videos")
+    ap.add_argument("--fixtures", required=True, help="media files + expected.json")
+    ap.add_argument("--baseline", help="model that is live now")
+    ap.add_argument("--candidate", help="model about to be uploaded")
+    ap.add_argument("--labels", help="labels .txt for audio models")
+    ap.add_argument("--candidate-labels", help="labels of the candidate, if they differ")
+    ap.add_argument("--no-warmup", dest="warmup", action="store_false",
+                    help="time the first fixture too")
+    ap.add_argument("--max-accuracy-drop", type=float, default=0.02)
+    ap.add_argument("--max-species-drop", type=float, default=0.10)
+    ap.add_argument("--min-support", type=int, default=5, help="fixtures a species needs to be checked")
+    ap.add_argument("--max-slowdown", type=float, default=0.10)
+    ap.add_argument("--max-load-growth", type=float, default=0.50)
+    ap.add_argument("--max-rss-growth", type=float, default=0.20)
+    ap.add_argument("--json", help="write the report to this file")
+    ap.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    ap.add_argument("--model", help=argparse.SUPPRESS)
+    args = ap.parse_args(argv)
+
+    if args.child:
+        child(args)
+        return 0
+    if not (args.baseline and args.candidate):
+        ap.error("--baseline and --candidate are required")
+    if args.kind == "audio" and not args.labels:
+        ap.error("audio models need --labels")
+
+    sys.path.insert(0, HERE)
+    import stand_ins
+    stand_ins.ensure_common_on_path()
+    from birdtag_common.species import default_vocabulary
+    vocab = default_vocabulary()
+    names, expected = fixture_files(args.fixtures, args.kind)
+    if not names:
+        raise SystemExit(f"no {args.kind} fixtures in {args.fixtures}")
+
+    base = score(run_model(args, args.baseline), expected, vocab)
+    if args.candidate_labels:
+        args.labels = args.candidate_labels
+    cand = score(run_model(args, args.candidate), expected, vocab)
+    found = regressions(base, cand, args)
+
+    print(f"{len(names)} {args.kind} fixtures")
+    print(f"{'':18} {'baseline':>12} {'candidate':>12}")
+    for metric in ("precision", "recall", "latency_p50_ms", "latency_p95_ms", "load_ms",
+                   "rss_after_load_mb", "peak_rss_mb"):
+        print(f"{metric:18} {str(base[metric]):>12} {str(cand[metric]):>12}")
+    print("\n".join(["Regressions:"] + [f"  {r}" for r in found]) if found else "No regressions")
+
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump({"kind": args.kind, "fixtures": len(names), "baseline": base,
+                       "candidate": cand, "regressions": found, "passed": not found}, fh, indent=2)
+    return 1 if found else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
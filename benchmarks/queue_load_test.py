@@ -0,0 +1,115 @@
+"""
+Load-test the SQS-buffered ingest path against the local queue stand-in.
+
+By default a simulated handler is used: it parses records with the same
+birdtag_common.s3_events code as the taggers and spends --work-ms per
+record (plus --batch-overhead-ms per invocation, e.g. model setup), failing
+--fail-rate of records so partial batch failures and redrive are exercised.
+
+    python benchmarks/queue_load_test.py --messages 2000 --burst 500 --concurrency 4 --batch-size 10
+
+A real handler can be plugged in with --handler module:function (its
+environment, model files and AWS stand-ins must be set up by the caller).
+"""
+import argparse
+import importlib
+import math
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, os.path.join(ROOT, "common"))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from birdtag_common.s3_events import iter_s3_records, batch_response, time_left_ms  # noqa: E402
+from local_queue import LocalQueue, drive  # noqa: E402
+
+
+def s3_event(n):
+    return {"Records": [{
+        "eventSource": "aws:s3",
+        "eventTime": "2025-05-31T10:20:00.000Z",
+        "s3": {"bucket": {"name": "birdtag-uploads"},
+               "object": {"key": f"raw_uploads/bird{n}.jpg", "eTag": f"etag{n}"}},
+    }]}
+
+
+def simulated_handler(work_ms, batch_overhead_ms, fail_rate, min_time_left_ms, seed):
+    rng = random.Random(seed)
+    rng_lock = threading.Lock()
+
+    def handler(event, ctx):
+        time.sleep(batch_overhead_ms / 1000)
+        failed = []
+        for up in iter_s3_records(event):
+            if time_left_ms(ctx) < min_time_left_ms:
+                failed.append(up.message_id)
+                continue
+            time.sleep(work_ms / 1000)
+            with rng_lock:
+                if rng.random() < fail_rate:
+                    failed.append(up.message_id)
+        return batch_response(failed)
+    return handler
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--messages", type=int, default=1000)
+    ap.add_argument("--burst", type=int, default=250, help="messages sent back-to-back per burst")
+    ap.add_argument("--burst-gap", type=float, default=0.5, help="seconds between bursts")
+    ap.add_argument("--batch-size", type=int, default=10)
+    ap.add_argument("--concurrency", type=int, default=4, help="MaximumConcurrency of the mapping")
+    ap.add_argument("--visibility-timeout", type=float, default=2.0)
+    ap.add_argument("--max-receive-count", type=int, default=3)
+    ap.add_argument("--timeout", type=float, default=900, help="simulated Lambda timeout (s)")
+    ap.add_argument("--work-ms", type=float, default=20)
+    ap.add_argument("--batch-overhead-ms", type=float, default=50)
+    ap.add_argument("--fail-rate", type=float, default=0.01)
+    ap.add_argument("--min-time-left-ms", type=float, default=0)
+    ap.add_argument("--handler", help="module:function of a real handler to drive instead")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    if args.handler:
+        mod, func = args.handler.split(":")
+        handler = getattr(importlib.import_module(mod), func)
+    else:
+        handler = simulated_handler(args.work_ms, args.batch_overhead_ms, args.fail_rate,
+                                    args.min_time_left_ms, args.seed)
+
+    queue = LocalQueue(args.visibility_timeout, args.max_receive_count)
+    producer_done = threading.Event()
+
+    def produce():
+        for n in range(args.messages):
+            queue.send(s3_event(n))
+            if (n + 1) % args.burst == 0:
+                time.sleep(args.burst_gap)
+        producer_done.set()
+
+    start = time.monotonic()
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    stats = drive(handler, queue, args.batch_size, args.concurrency, args.timeout,
+                  producer_done=producer_done)
+    elapsed = time.monotonic() - start
+
+    lat = sorted(stats["latencies"]) or [0.0]
+    print(f"messages        {args.messages}")
+    print(f"completed       {stats['done']}")
+    print(f"dead letters    {stats['dead_letters']}")
+    print(f"invocations     {stats['invocations']}  (handler errors {stats['handler_errors']})")
+    print(f"failed records  {stats['failed_records']}  (redriven)")
+    print(f"max queue depth {stats['max_depth']}")
+    print(f"throughput      {stats['done'] / elapsed:.1f} msg/s over {elapsed:.1f}s")
+    print(f"latency p50     {statistics.median(lat) * 1000:.0f} ms")
+    print(f"latency p95     {lat[math.ceil(0.95 * len(lat)) - 1] * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
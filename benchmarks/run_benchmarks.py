@@ -0,0 +1,303 @@
+"""
+End-to-end benchmarks for the BirdTag Lambdas against in-memory AWS
+stand-ins (benchmarks/stand_ins.py) and synthetic data.
+
+    python benchmarks/run_benchmarks.py --items 1000 100000 --repeat 20
+    python benchmarks/run_benchmarks.py --routes 'web.*' --json bench.json
+
+For every route it reports p50/p95 latency, AWS API calls per invocation,
+DynamoDB bytes read per invocation and peak Python heap (tracemalloc).
+Routes that need packages or model files that are not available
+(numpy/cv2 for thumbnails, ultralytics + --yolo-weights for the image
+tagger, a BirdNET .tflite + labels for the audio tagger) are skipped with
+the reason printed.
+"""
+import argparse
+import base64
+import contextlib
+import fnmatch
+import importlib.util
+import json
+import math
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+
+import datasets  # noqa: E402
+import stand_ins  # noqa: E402
+
+stand_ins.ensure_common_on_path()
+
+CATALOG_TABLE = "BirdAnalyiser"
+USER_TABLE = "userDetails-Alert"
+MODEL_BUCKET = "birdtag-models"
+SHARED_MODULE_NAMES = ("lambda_handler", "image_video_tagger", "audio_tagger", "tag_matcher")
+
+
+class Skip(Exception):
+    pass
+
+
+class LambdaContext:
+    def __init__(self, timeout_s=900):
+        self.deadline = time.monotonic() + timeout_s
+
+    def get_remaining_time_in_millis(self):
+        return int((self.deadline - time.monotonic()) * 1000)
+
+
+def load_lambda(alias, rel_path, env=None):
+    """Import a Lambda module from its file with its directory on sys.path."""
+    path = os.path.join(ROOT, rel_path)
+    os.environ.update(env or {})
+    directory = os.path.dirname(path)
+    for name in SHARED_MODULE_NAMES:   # same file names live in several Lambdas
+        sys.modules.pop(name, None)
+    if directory in sys.path:
+        sys.path.remove(directory)
+    sys.path.insert(0, directory)
+    spec = importlib.util.spec_from_file_location(alias, path)
+    mod = importlib.util.module_from_spec(spec)
+    sys.modules[alias] = mod
+    spec.loader.exec_module(mod)
+    return mod
+
+
+def api_event(method, path, params=None, body=None):
+    return {"httpMethod": method, "path": path, "queryStringParameters": params,
+            "headers": {}, "body": json.dumps(body) if body is not None else None}
+
+
+def s3_event(bucket, key, etag="etag"):
+    return {"Records": [{"eventSource": "aws:s3", "eventTime": "2025-06-01T00:00:00.000Z",
+                         "s3": {"bucket": {"name": bucket},
+                                "object": {"key": key, "eTag": etag}}}]}
+
+
+# ─────────────────────────────── environment ────────────────────────────────
+def build_environment(n_items, n_users, species):
+    env = stand_ins.install_fake_boto3()
+    catalog = env.dynamodb.add_table(stand_ins.InMemoryTable(
+        CATALOG_TABLE, indexes={"mediaType-uploadTime-index": ("mediaType", "uploadTime")}))
+    catalog.load(datasets.synthetic_items(n_items, species))
+    users = env.dynamodb.add_table(stand_ins.InMemoryTable(USER_TABLE, hash_key="email"))
+    users.load(datasets.synthetic_users(n_users, species))
+    return env, catalog
+
+
+# ─────────────────────────────── routes ─────────────────────────────────────
+def web_routes(env, catalog, n_items):
+    web = load_lambda("web_lambda", "web-lambda/lambda_function.py",
+                      {"CATALOG_STREAM_ARN": f"{CATALOG_TABLE}/stream"})
+    sample = [catalog.items[k] for k in catalog.order[: min(1000, n_items)]]
+    with_thumb = [it for it in sample if it.get("thumbnailURL")] or sample
+    deletable = iter(catalog.order[::-1])
+
+    def delete_event(_):
+        item = catalog.items.get(next(deletable))
+        return api_event("POST", "/delete-files", body={"urls": [item["thumbnailURL"] or item["originalURL"]]})
+
+    return {
+        "web.search.tag_count": (web.lambda_handler, lambda i: api_event(
+            "GET", "/search", {"tag1": "crow", "count1": "2"})),
+        "web.search.tag_count_and": (web.lambda_handler, lambda i: api_event(
+            "POST", "/search", body={"crow": 1, "pigeon": 1})),
+        "web.search.tag": (web.lambda_handler, lambda i: api_event(
+            "GET", "/search", {"tag": "crow,owl"})),
+        "web.search.id": (web.lambda_handler, lambda i: api_event(
+            "GET", "/search", {"id": sample[i % len(sample)]["uniqueId"]})),
+        "web.search.thumbnail": (web.lambda_handler, lambda i: api_event(
+            "GET", "/search", {"thumbnailURL": with_thumb[i % len(with_thumb)]["thumbnailURL"]})),
+        "web.modify_tags": (web.lambda_handler, lambda i: api_event(
+            "POST", "/modify-tags", body={"url": [with_thumb[i % len(with_thumb)]["thumbnailURL"]],
+                                          "operation": 1, "tags": ["crow,1"]})),
+        "web.query_by_file": (web.lambda_handler, lambda i: api_event(
+            "POST", "/query-by-file", body={"file": base64.b64encode(b"x" * 1024).decode()})),
+        "web.delete_files": (web.lambda_handler, delete_event),
+    }
+
+
+def sns_routes(env, catalog, n_items):
+    publisher = load_lambda("bird_notification_publisher", "SNS/bird_notification_publisher.py")
+    subscriber = load_lambda("subscribe_users_to_sns", "SNS/subscribe_users_to_sns.py")
+    sample = [catalog.items[k] for k in catalog.order[:100]]
+    inserts = {"Records": [datasets.stream_record("INSERT", new=it) for it in sample]}
+    users = list(datasets.synthetic_users(100, seed=1))
+    modifies = {"Records": [datasets.stream_record(
+        "MODIFY", new=dict(u, subscriptionArn=f"arn:sub/{u['email']}", tags=u["tags"] + ["owl"]),
+        old=dict(u, subscriptionArn=f"arn:sub/{u['email']}")) for u in users]}
+    return {
+        "sns.publish.insert_batch100": (publisher.lambda_handler, lambda i: inserts),
+        "sns.subscribe.modify_batch100": (subscriber.lambda_handler, lambda i: modifies),
+    }
+
+
+def thumbnail_routes(env, catalog, n_items):
+    try:
+        img = datasets.image_bytes(4000, 3000)
+    except ImportError as e:
+        raise Skip(f"thumbnail needs numpy + cv2 ({e})")
+    env.s3.put(datasets.UPLOAD_BUCKET, "raw_uploads/bench.jpg", img)
+    thumb = load_lambda("thumbnail_function", "thumbnails-lambda/ThumbnailFunction.py")
+    return {"thumbnail.12mp_jpeg": (thumb.lambda_handler,
+                                    lambda i: s3_event(datasets.UPLOAD_BUCKET, "raw_uploads/bench.jpg"))}
+
+
+def image_tagger_routes(env, catalog, n_items, weights):
+    if not weights:
+        raise Skip("image tagger needs --yolo-weights")
+    try:
+        import ultralytics  # noqa: F401
+        img = datasets.image_bytes(1920, 1080)
+    except ImportError as e:
+        raise Skip(f"image tagger needs ultralytics + cv2 ({e})")
+    with open(weights, "rb") as fh:
+        env.s3.put(MODEL_BUCKET, "birdtag-ImageVideo-model/model.pt", fh.read())
+    for n in range(10):
+        env.s3.put(datasets.UPLOAD_BUCKET, f"raw_uploads/tag{n}.jpg", img)
+    with tempfile.TemporaryDirectory() as tmp:
+        vid = datasets.video_bytes(os.path.join(tmp, "v.mp4"))
+    env.s3.put(datasets.UPLOAD_BUCKET, "raw_uploads/tagv.mp4", vid)
+    tagger = load_lambda("object_detection_handler", "object-detection-lambda/lambda_handler.py",
+                         {"ANNOT_BUCKET": datasets.ANNOT_BUCKET, "TABLE_NAME": CATALOG_TABLE,
+                          "MODEL_BUCKET": MODEL_BUCKET})
+    batch = {"Records": [s3_event(datasets.UPLOAD_BUCKET, f"raw_uploads/tag{n}.jpg",
+                                  etag=f"e{n}")["Records"][0] for n in range(10)]}
+    counter = iter(range(10 ** 9))
+
+    def fresh(event):
+        # new ETags every run, otherwise the idempotency check skips the work
+        n = next(counter)
+        for rec in event["Records"]:
+            rec["s3"]["object"]["eTag"] = f"run{n}"
+        return event
+
+    return {
+        "tagger.image.single": (tagger.lambda_handler, lambda i: fresh(
+            s3_event(datasets.UPLOAD_BUCKET, "raw_uploads/tag0.jpg"))),
+        "tagger.image.batch10": (tagger.lambda_handler, lambda i: fresh(batch)),
+        "tagger.video.3s": (tagger.lambda_handler, lambda i: fresh(
+            s3_event(datasets.UPLOAD_BUCKET, "raw_uploads/tagv.mp4"))),
+    }
+
+
+def audio_tagger_routes(env, catalog, n_items, model, labels):
+    if not (model and labels):
+        raise Skip("audio tagger needs --birdnet-model and --birdnet-labels")
+    try:
+        import numpy  # noqa: F401
+        import soundfile  # noqa: F401
+    except ImportError as e:
+        raise Skip(f"audio tagger needs numpy + soundfile ({e})")
+    for local, key in ((model, "birdnet-audio-model/model.tflite"),
+                       (labels, "birdnet-audio-model/labels.txt")):
+        with open(local, "rb") as fh:
+            env.s3.put(MODEL_BUCKET, key, fh.read())
+    env.s3.put(datasets.UPLOAD_BUCKET, "raw_uploads/bench.wav", datasets.wav_bytes())
+    for n in range(8):
+        env.s3.put(datasets.UPLOAD_BUCKET, f"raw_uploads/bench{n}.wav", datasets.wav_bytes())
+    tagger = load_lambda("audio_handler", "audio_tagger/app/lambda_handler.py",
+                         {"TABLE_NAME": CATALOG_TABLE, "MODEL_BUCKET": MODEL_BUCKET})
+    counter = iter(range(10 ** 9))
+
+    def batch(i):
+        # eight clips in one invocation share fixed-shape inference batches
+        n = next(counter)
+        return {"Records": [s3_event(datasets.UPLOAD_BUCKET, f"raw_uploads/bench{k}.wav",
+                                     etag=f"run{n}")["Records"][0] for k in range(8)]}
+
+    return {"tagger.audio.9s_wav": (tagger.lambda_handler, lambda i: s3_event(
+                datasets.UPLOAD_BUCKET, "raw_uploads/bench.wav", etag=f"run{next(counter)}")),
+            "tagger.audio.batch8": (tagger.lambda_handler, batch)}
+
+
+# ─────────────────────────────── measurement ────────────────────────────────
+def measure(handler, make_event, repeat, warmup, verbose=False):
+    if not verbose:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            return measure(handler, make_event, repeat, warmup, verbose=True)
+    for i in range(warmup):
+        handler(make_event(i), LambdaContext())
+    latencies, calls, read = [], Counter(), 0
+    for i in range(warmup, warmup + repeat):
+        event = make_event(i)
+        calls_before, read_before = stand_ins.CALLS.snapshot()
+        start = time.perf_counter()
+        handler(event, LambdaContext())
+        latencies.append((time.perf_counter() - start) * 1000)
+        calls_after, read_after = stand_ins.CALLS.snapshot()
+        calls += calls_after - calls_before
+        read += read_after - read_before
+
+    event = make_event(warmup + repeat)
+    tracemalloc.start()
+    handler(event, LambdaContext())
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        "p50_ms": round(statistics.median(latencies), 2),
+        "p95_ms": round(latencies[math.ceil(0.95 * len(latencies)) - 1], 2),
+        "calls_per_inv": {k: round(v / repeat, 2) for k, v in sorted(calls.items())},
+        "read_kb_per_inv": round(read / repeat / 1024, 1),
+        "peak_mb": round(peak / 2 ** 20, 2),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--items", type=int, nargs="+", default=[1000, 10000],
+                    help="catalog sizes to run (1k .. 1M)")
+    ap.add_argument("--users", type=int, default=1000)
+    ap.add_argument("--species", type=int, default=200)
+    ap.add_argument("--repeat", type=int, default=10)
+    ap.add_argument("--warmup", type=int, default=1)
+    ap.add_argument("--routes", default="*", help="glob over route names")
+    ap.add_argument("--yolo-weights")
+    ap.add_argument("--birdnet-model")
+    ap.add_argument("--birdnet-labels")
+    ap.add_argument("--json", help="write results to this file")
+    ap.add_argument("--verbose", action="store_true", help="show the Lambdas' own output")
+    args = ap.parse_args()
+
+    results = []
+    for n_items in args.items:
+        print(f"\n== catalog: {n_items} items ==")
+        env, catalog = build_environment(n_items, args.users, args.species)
+        routes = {}
+        for build in (web_routes, sns_routes, thumbnail_routes,
+                      lambda e, c, n: image_tagger_routes(e, c, n, args.yolo_weights),
+                      lambda e, c, n: audio_tagger_routes(e, c, n, args.birdnet_model,
+                                                          args.birdnet_labels)):
+            try:
+                routes.update(build(env, catalog, n_items))
+            except Skip as e:
+                print(f"  skipped: {e}")
+
+        print(f"  {'route':34} {'p50 ms':>10} {'p95 ms':>10} {'read KB':>10} {'peak MB':>9}  calls/inv")
+        for name, (handler, make_event) in routes.items():
+            if not fnmatch.fnmatch(name, args.routes):
+                continue
+            row = measure(handler, make_event, args.repeat, args.warmup, args.verbose)
+            row.update(route=name, items=n_items)
+            results.append(row)
+            calls = " ".join(f"{k}={v:g}" for k, v in row["calls_per_inv"].items())
+            print(f"  {name:34} {row['p50_ms']:>10} {row['p95_ms']:>10} "
+                  f"{row['read_kb_per_inv']:>10} {row['peak_mb']:>9}  {calls}")
+
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,965 @@
+"""
+In-memory stand-ins for the AWS services the Lambdas use (S3, DynamoDB,
+SNS, SES, DynamoDB Streams), plus a fake `boto3` / `botocore` that hands
+them out. Every Lambda module creates its clients at import time, so
+`install_fake_boto3()` must run before the module is imported.
+
+The stand-ins count API calls per (service, operation) and the bytes a
+real table would charge read capacity for, so benchmarks can report
+call counts and read cost alongside latency. String condition / update
+expressions are evaluated with a small parser covering the subset of the
+DynamoDB expression language the repo uses.
+"""
+import hashlib
+import hmac
+import io
+import os
+import re
+import sys
+import threading
+import types
+from collections import Counter
+from datetime import datetime, timezone
+from decimal import Decimal
+
+PAGE_BYTES = 1024 * 1024     # DynamoDB scan/query page limit
+
+
+# ───────────────────────────── errors ─────────────────────────────
+class ClientError(Exception):
+    def __init__(self, error_response, operation_name):
+        self.response = error_response
+        self.operation_name = operation_name
+        code = error_response.get("Error", {}).get("Code")
+        super().__init__(f"An error occurred ({code}) when calling the {operation_name} operation")
+
+
+def _error(code, op, message=""):
+    return ClientError({"Error": {"Code": code, "Message": message}}, op)
+
+
+# ───────────────────────────── call accounting ────────────────────
+class CallLog:
+    def __init__(self):
+        self.calls = Counter()
+        self.read_bytes = 0
+        self.lock = threading.Lock()
+
+    def hit(self, service, op, read_bytes=0):
+        with self.lock:
+            self.calls[f"{service}.{op}"] += 1
+            self.read_bytes += read_bytes
+
+    def snapshot(self):
+        with self.lock:
+            return Counter(self.calls), self.read_bytes
+
+
+CALLS = CallLog()
+
+
+class _Events:
+    """Enough of botocore's event system for clients to be instrumented."""
+
+    def __init__(self):
+        self.handlers = []
+        self.unique_ids = set()
+
+    def register(self, event_name, handler, *args, unique_id=None, **kwargs):
+        if unique_id is not None:
+            if unique_id in self.unique_ids:
+                return
+            self.unique_ids.add(unique_id)
+        self.handlers.append((event_name, handler))
+
+    def emit(self, service, op):
+        for event_name, handler in self.handlers:
+            if event_name.startswith("before-call"):
+                handler(event_name=f"before-call.{service}.{op}",
+                        model=types.SimpleNamespace(name=op), params={})
+
+
+class _Service:
+    service = "service"
+
+    def __init__(self):
+        self.meta = types.SimpleNamespace(events=_Events(), client=self)
+
+    def _hit(self, op, read_bytes=0):
+        CALLS.hit(self.service, op, read_bytes)
+        self.meta.events.emit(self.service, op)
+
+
+def _copy(value):
+    """Fast deep copy for item-shaped data (callers may mutate results)."""
+    if isinstance(value, dict):
+        return {k: _copy(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_copy(v) for v in value]
+    if isinstance(value, set):
+        return set(value)
+    return value
+
+
+def _size(value):
+    """Approximate DynamoDB item size in bytes."""
+    if isinstance(value, dict):
+        return sum(len(k) + _size(v) for k, v in value.items()) + 3
+    if isinstance(value, (list, set, tuple)):
+        return sum(_size(v) for v in value) + 3
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    return 8 if value is not None else 1
+
+
+# ───────────────────────────── S3 ─────────────────────────────────
+class InMemoryS3(_Service):
+    service = "s3"
+    SIGNING_KEY = b"stand-in"
+
+    def __init__(self):
+        super().__init__()
+        self.objects = {}    # (bucket, key) -> dict(Body, ETag, LastModified)
+        self.lock = threading.Lock()
+
+    def put(self, bucket, key, body: bytes):
+        now = datetime.now(timezone.utc)
+        with self.lock:
+            self.objects[(bucket, key)] = {"Body": body, "LastModified": now,
+                                           "ETag": f'"{hashlib.md5(body).hexdigest()}"'}
+
+    def _get(self, bucket, key, op):
+        obj = self.objects.get((bucket, key))
+        if obj is None:
+            raise _error("404" if op == "HeadObject" else "NoSuchKey", op, key)
+        return obj
+
+    def put_object(self, Bucket, Key, Body=b"", **_):
+        self._hit("PutObject")
+        if hasattr(Body, "read"):
+            Body = Body.read()
+        if isinstance(Body, str):
+            Body = Body.encode()
+        self.put(Bucket, Key, Body)
+        return {"ETag": self.objects[(Bucket, Key)]["ETag"]}
+
+    def upload_file(self, Filename, Bucket, Key, **_):
+        self._hit("PutObject")
+        with open(Filename, "rb") as fh:
+            self.put(Bucket, Key, fh.read())
+
+    def download_file(self, Bucket, Key, Filename, **_):
+        self._hit("GetObject")
+        obj = self._get(Bucket, Key, "GetObject")
+        with open(Filename, "wb") as fh:
+            fh.write(obj["Body"])
+
+    def get_object(self, Bucket, Key, **_):
+        self._hit("GetObject")
+        obj = self._get(Bucket, Key, "GetObject")
+        return {"Body": io.BytesIO(obj["Body"]), "ContentLength": len(obj["Body"]),
+                "ETag": obj["ETag"], "LastModified": obj["LastModified"]}
+
+    def head_object(self, Bucket, Key, **_):
+        self._hit("HeadObject")
+        obj = self._get(Bucket, Key, "HeadObject")
+        return {"ContentLength": len(obj["Body"]), "ETag": obj["ETag"],
+                "LastModified": obj["LastModified"]}
+
+    def copy_object(self, Bucket, Key, CopySource, **_):
+        self._hit("CopyObject")
+        src = self._get(CopySource["Bucket"], CopySource["Key"], "CopyObject")
+        self.put(Bucket, Key, src["Body"])
+        return {}
+
+    def delete_object(self, Bucket, Key, **_):
+        self._hit("DeleteObject")
+        with self.lock:
+            self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def delete_objects(self, Bucket, Delete, **_):
+        self._hit("DeleteObjects")
+        deleted = []
+        with self.lock:
+            for obj in Delete["Objects"]:
+                self.objects.pop((Bucket, obj["Key"]), None)
+                deleted.append({"Key": obj["Key"]})
+        return {"Deleted": deleted}
+
+    def list_objects_v2(self, Bucket, Prefix="", MaxKeys=1000, ContinuationToken=None,
+                        StartAfter=None, **_):
+        self._hit("ListObjectsV2")
+        with self.lock:
+            keys = sorted(k for (b, k) in self.objects if b == Bucket and k.startswith(Prefix))
+        after = ContinuationToken or StartAfter
+        if after:
+            keys = [k for k in keys if k > after]
+        page, rest = keys[:MaxKeys], keys[MaxKeys:]
+        resp = {"KeyCount": len(page), "IsTruncated": bool(rest),
+                "Contents": [{"Key": k, "Size": len(self.objects[(Bucket, k)]["Body"]),
+                              "ETag": self.objects[(Bucket, k)]["ETag"],
+                              "LastModified": self.objects[(Bucket, k)]["LastModified"]}
+                             for k in page]}
+        if rest:
+            resp["NextContinuationToken"] = page[-1]
+        return resp
+
+    def get_paginator(self, op):
+        assert op == "list_objects_v2", op
+        s3 = self
+
+        class _Paginator:
+            def paginate(self, **kwargs):
+                token = None
+                while True:
+                    resp = s3.list_objects_v2(ContinuationToken=token, **kwargs)
+                    yield resp
+                    token = resp.get("NextContinuationToken")
+                    if not token:
+                        return
+        return _Paginator()
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn=3600, **_):
+        # Local computation in real boto3 too (no API call); HMAC keeps the
+        # CPU cost in the same ballpark.
+        bucket, key = Params["Bucket"], Params["Key"]
+        sig = hmac.new(self.SIGNING_KEY, f"{bucket}/{key}/{ExpiresIn}".encode(),
+                       hashlib.sha256).hexdigest()
+        return (f"https://{bucket}.s3.amazonaws.com/{key}?X-Amz-Algorithm=AWS4-HMAC-SHA256"
+                f"&X-Amz-Expires={ExpiresIn}&X-Amz-Signature={sig}")
+
+
+# ───────────────────────────── expressions ────────────────────────
+_TOKEN = re.compile(r"\s*(?:(<>|<=|>=|=|<|>|\(|\)|,|\+|-|\[\d+\]|\.)|(:[\w]+)|(#[\w]+)|([A-Za-z_][\w]*))")
+
+
+def _tokenize(expr):
+    tokens, pos = [], 0
+    expr = expr.strip()
+    while pos < len(expr):
+        m = _TOKEN.match(expr, pos)
+        if not m or m.end() == pos:
+            raise ValueError(f"Cannot parse expression at: {expr[pos:]!r}")
+        tokens.append(m.group(0).strip())
+        pos = m.end()
+    return tokens
+
+
+class _Parser:
+    """Recursive-descent parser producing closures over (item) -> value."""
+
+    def __init__(self, expr, names, values):
+        self.tokens = _tokenize(expr)
+        self.i = 0
+        self.names = names or {}
+        self.values = values or {}
+
+    def peek(self, k=0):
+        j = self.i + k
+        return self.tokens[j] if j < len(self.tokens) else None
+
+    def take(self, expected=None):
+        tok = self.peek()
+        if expected is not None and (tok is None or tok.upper() != expected.upper()):
+            raise ValueError(f"Expected {expected!r}, got {tok!r}")
+        self.i += 1
+        return tok
+
+    def done(self):
+        return self.i >= len(self.tokens)
+
+    # paths ---------------------------------------------------------
+    def path(self):
+        parts = []
+        tok = self.take()
+        parts.append(self.names.get(tok, tok))
+        while self.peek() == "." or (self.peek() or "").startswith("["):
+            tok = self.take()
+            if tok == ".":
+                nxt = self.take()
+                parts.append(self.names.get(nxt, nxt))
+            else:
+                parts.append(int(tok[1:-1]))
+        return parts
+
+    def operand(self):
+        tok = self.peek()
+        if tok.startswith(":"):
+            self.take()
+            val = self.values[tok]
+            return lambda item: val
+        if tok.lower() in ("size", "if_not_exists", "list_append") and self.peek(1) == "(":
+            fn = self.take().lower()
+            self.take("(")
+            if fn == "size":
+                p = self.path()
+                self.take(")")
+                return lambda item: (len(get_path(item, p)) if get_path(item, p) is not None else None)
+            a = self.operand()
+            self.take(",")
+            b = self.operand()
+            self.take(")")
+            if fn == "if_not_exists":
+                return lambda item: a(item) if a(item) is not None else b(item)
+            return lambda item: list(a(item) or []) + list(b(item) or [])
+        p = self.path()
+        return lambda item: get_path(item, p)
+
+    def value(self):
+        left = self.operand()
+        if self.peek() in ("+", "-"):
+            op = self.take()
+            right = self.operand()
+            if op == "+":
+                return lambda item: (left(item) or 0) + right(item)
+            return lambda item: (left(item) or 0) - right(item)
+        return left
+
+    # conditions ------------------------------------------------------
+    def condition(self):
+        left = self.and_expr()
+        while (self.peek() or "").upper() == "OR":
+            self.take()
+            right = self.and_expr()
+            left = (lambda a, b: lambda item: a(item) or b(item))(left, right)
+        return left
+
+    def and_expr(self):
+        left = self.not_expr()
+        while (self.peek() or "").upper() == "AND":
+            self.take()
+            right = self.not_expr()
+            left = (lambda a, b: lambda item: a(item) and b(item))(left, right)
+        return left
+
+    def not_expr(self):
+        if (self.peek() or "").upper() == "NOT":
+            self.take()
+            inner = self.not_expr()
+            return lambda item: not inner(item)
+        return self.primary()
+
+    def primary(self):
+        tok = self.peek()
+        if tok == "(":
+            self.take()
+            c = self.condition()
+            self.take(")")
+            return c
+        fn = tok.lower()
+        if fn in ("attribute_exists", "attribute_not_exists", "begins_with", "contains") \
+                and self.peek(1) == "(":
+            self.take()
+            self.take("(")
+            p = self.path()
+            if fn == "attribute_exists":
+                self.take(")")
+                return lambda item: _has_path(item, p)
+            if fn == "attribute_not_exists":
+                self.take(")")
+                return lambda item: not _has_path(item, p)
+            self.take(",")
+            arg = self.operand()
+            self.take(")")
+            if fn == "begins_with":
+                return lambda item: isinstance(get_path(item, p), str) and get_path(item, p).startswith(arg(item))
+            return lambda item: get_path(item, p) is not None and arg(item) in get_path(item, p)
+        left = self.operand()
+        op = self.take()
+        if op.upper() == "BETWEEN":
+            lo = self.operand()
+            self.take("AND")
+            hi = self.operand()
+            return lambda item: _cmp(left(item), ">=", lo(item)) and _cmp(left(item), "<=", hi(item))
+        if op.upper() == "IN":
+            self.take("(")
+            opts = [self.operand()]
+            while self.peek() == ",":
+                self.take()
+                opts.append(self.operand())
+            self.take(")")
+            return lambda item: any(left(item) == o(item) for o in opts)
+        right = self.operand()
+        return lambda item: _cmp(left(item), op, right(item))
+
+
+def _cmp(a, op, b):
+    if op == "=":
+        return a == b
+    if op == "<>":
+        return a != b
+    if a is None or b is None:
+        return False
+    try:
+        return {"<": a < b, "<=": a <= b, ">": a > b, ">=": a >= b}[op]
+    except TypeError:
+        return False
+
+
+def get_path(item, parts):
+    cur = item
+    for p in parts:
+        if isinstance(p, int):
+            if not isinstance(cur, list) or p >= len(cur):
+                return None
+            cur = cur[p]
+        else:
+            if not isinstance(cur, dict) or p not in cur:
+                return None
+            cur = cur[p]
+    return cur
+
+
+def _has_path(item, parts):
+    cur = item
+    for p in parts:
+        if isinstance(p, int):
+            if not isinstance(cur, list) or p >= len(cur):
+                return False
+        elif not isinstance(cur, dict) or p not in cur:
+            return False
+        cur = cur[p]
+    return True
+
+
+def _set_path(item, parts, value):
+    cur = item
+    for p in parts[:-1]:
+        cur = cur[p]
+    cur[parts[-1]] = value
+
+
+def _del_path(item, parts):
+    cur = get_path(item, parts[:-1]) if len(parts) > 1 else item
+    if isinstance(cur, dict):
+        cur.pop(parts[-1], None)
+    elif isinstance(cur, list) and parts[-1] < len(cur):
+        del cur[parts[-1]]
+
+
+def compile_condition(expr, names=None, values=None):
+    """Condition as a predicate: string expression or a fake boto3 condition."""
+    if expr is None:
+        return lambda item: True
+    if callable(expr):
+        return expr
+    parser = _Parser(expr, names, values)
+    cond = parser.condition()
+    if not parser.done():
+        raise ValueError(f"Trailing tokens in {expr!r}")
+    return cond
+
+
+def apply_update(item, expr, names=None, values=None):
+    """Apply a SET / ADD / REMOVE / DELETE update expression in place."""
+    parser = _Parser(expr, names, values)
+    while not parser.done():
+        action = parser.take().upper()
+        while True:
+            if action == "SET":
+                p = parser.path()
+                parser.take("=")
+                v = parser.value()
+                _set_path(item, p, v(item))
+            elif action == "REMOVE":
+                _del_path(item, parser.path())
+            elif action in ("ADD", "DELETE"):
+                p = parser.path()
+                v = parser.operand()(item)
+                cur = get_path(item, p)
+                if action == "ADD":
+                    if isinstance(v, set):
+                        _set_path(item, p, (cur or set()) | v)
+                    else:
+                        _set_path(item, p, (cur or 0) + v)
+                elif cur is not None:
+                    _set_path(item, p, cur - v)
+            else:
+                raise ValueError(f"Unknown update action {action!r}")
+            if parser.peek() == ",":
+                parser.take()
+                continue
+            break
+
+
+def project(item, expr, names=None):
+    if not expr:
+        return item
+    out = {}
+    for raw in expr.split(","):
+        parts = _Parser(raw, names, None).path()
+        top = parts[0]
+        if top in item:
+            out[top] = item[top]
+    return out
+
+
+# ───────────────────────────── DynamoDB ───────────────────────────
+class _BatchWriter:
+    def __init__(self, table):
+        self.table = table
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def put_item(self, Item):
+        self.table._put(Item)
+        CALLS.hit("dynamodb", "BatchWriteItem(item)")
+
+    def delete_item(self, Key):
+        self.table._delete(Key)
+        CALLS.hit("dynamodb", "BatchWriteItem(item)")
+
+
+class _StartKey(dict):
+    """LastEvaluatedKey that also remembers where the page stopped."""
+    pos = None
+
+
+class InMemoryTable(_Service):
+    """
+    A table with a simple hash (+ optional range) key and optional global
+    secondary indexes given as {index name: (hash attr, range attr or None)}.
+    """
+    service = "dynamodb"
+
+    def __init__(self, name, hash_key="uniqueId", range_key=None, indexes=None):
+        super().__init__()
+        self.name = name
+        self.hash_key = hash_key
+        self.range_key = range_key
+        self.indexes = indexes or {}
+        self.items = {}     # key tuple -> item
+        self.sizes = {}     # key tuple -> approximate bytes
+        self.order = []     # scan order (deleted keys are skipped)
+        self.segments = {}  # key tuple -> hash used for Segment/TotalSegments
+        self.version = 0
+        self.query_cache = {}
+        self.lock = threading.RLock()
+        self.stream = []    # list of (eventName, Keys, OldImage, NewImage)
+        self.fail_next = Counter()   # op -> number of ProvisionedThroughputExceeded to raise
+
+    # helpers ---------------------------------------------------------
+    def _key(self, item):
+        if self.range_key:
+            return (item[self.hash_key], item[self.range_key])
+        return (item[self.hash_key],)
+
+    def _key_dict(self, key):
+        return {self.hash_key: key[self.hash_key],
+                **({self.range_key: key[self.range_key]} if self.range_key else {})}
+
+    def _maybe_throttle(self, op):
+        if self.fail_next[op] > 0:
+            self.fail_next[op] -= 1
+            raise _error("ProvisionedThroughputExceededException", op)
+
+    def _store(self, k, item):
+        if k not in self.segments:
+            self.order.append(k)
+            self.segments[k] = int(hashlib.md5(repr(k[0]).encode()).hexdigest()[:8], 16)
+        self.items[k] = item
+        self.sizes[k] = _size(item)
+        self.version += 1
+
+    def _put(self, item):
+        k = self._key(item)
+        with self.lock:
+            old = self.items.get(k)
+            self._store(k, _copy(item))
+            self.stream.append(("MODIFY" if old else "INSERT", self._key_dict(item), old, _copy(item)))
+
+    def _delete(self, key):
+        k = self._key(key)
+        with self.lock:
+            old = self.items.pop(k, None)
+            self.sizes.pop(k, None)
+            self.version += 1
+            if old:
+                self.stream.append(("REMOVE", self._key_dict(key), old, None))
+        return old
+
+    def load(self, items):
+        """Bulk load without accounting or stream records."""
+        with self.lock:
+            for item in items:
+                self._store(self._key(item), item)
+
+    # API -------------------------------------------------------------
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeNames=None,
+                 ExpressionAttributeValues=None, ReturnValues=None, **_):
+        self._hit("PutItem")
+        self._maybe_throttle("PutItem")
+        with self.lock:
+            old = self.items.get(self._key(Item))
+            if ConditionExpression is not None:
+                cond = compile_condition(ConditionExpression, ExpressionAttributeNames,
+                                         ExpressionAttributeValues)
+                if not cond(old or {}):
+                    raise _error("ConditionalCheckFailedException", "PutItem")
+            self._put(Item)
+        return {"Attributes": _copy(old)} if ReturnValues == "ALL_OLD" and old else {}
+
+    def get_item(self, Key, ProjectionExpression=None, ExpressionAttributeNames=None, **_):
+        k = self._key(Key)
+        self._hit("GetItem", self.sizes.get(k, 0))
+        self._maybe_throttle("GetItem")
+        item = self.items.get(k)
+        if item is None:
+            return {}
+        return {"Item": _copy(project(item, ProjectionExpression, ExpressionAttributeNames))}
+
+    def delete_item(self, Key, ConditionExpression=None, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, ReturnValues=None, **_):
+        self._hit("DeleteItem")
+        with self.lock:
+            if ConditionExpression is not None:
+                cond = compile_condition(ConditionExpression, ExpressionAttributeNames,
+                                         ExpressionAttributeValues)
+                if not cond(self.items.get(self._key(Key), {})):
+                    raise _error("ConditionalCheckFailedException", "DeleteItem")
+            old = self._delete(Key)
+        return {"Attributes": _copy(old)} if ReturnValues == "ALL_OLD" and old else {}
+
+    def update_item(self, Key, UpdateExpression, ConditionExpression=None,
+                    ExpressionAttributeNames=None, ExpressionAttributeValues=None,
+                    ReturnValues=None, **_):
+        self._hit("UpdateItem")
+        self._maybe_throttle("UpdateItem")
+        k = self._key(Key)
+        with self.lock:
+            old = self.items.get(k)
+            if ConditionExpression is not None:
+                cond = compile_condition(ConditionExpression, ExpressionAttributeNames,
+                                         ExpressionAttributeValues)
+                if not cond(old or {}):
+                    raise _error("ConditionalCheckFailedException", "UpdateItem")
+            new = _copy(old) if old else dict(Key)
+            apply_update(new, UpdateExpression, ExpressionAttributeNames, ExpressionAttributeValues)
+            self._put(new)
+        if ReturnValues in ("ALL_NEW", "UPDATED_NEW"):
+            return {"Attributes": _copy(new)}
+        if ReturnValues == "ALL_OLD":
+            return {"Attributes": _copy(old or {})}
+        return {}
+
+    def _page(self, keys, op, Limit, ExclusiveStartKey, FilterExpression, ProjectionExpression,
+              ExpressionAttributeNames, ExpressionAttributeValues, Select, accept=None):
+        cond = compile_condition(FilterExpression, ExpressionAttributeNames, ExpressionAttributeValues)
+        i = 0
+        if ExclusiveStartKey is not None:
+            i = getattr(ExclusiveStartKey, "pos", None)
+            if i is None:   # plain dict, e.g. restored from a checkpoint
+                start = self._key(ExclusiveStartKey)
+                i = next((n + 1 for n, k in enumerate(keys) if k == start), len(keys))
+        out, scanned, read = [], 0, 0
+        while i < len(keys):
+            k = keys[i]
+            i += 1
+            item = self.items.get(k)
+            if item is None or (accept and not accept(k)):
+                continue
+            scanned += 1
+            read += self.sizes[k]
+            if cond(item):
+                out.append(_copy(project(item, ProjectionExpression, ExpressionAttributeNames)))
+            if (Limit and scanned >= Limit) or read >= PAGE_BYTES:
+                break
+        self._hit(op, read)
+        resp = {"Count": len(out), "ScannedCount": scanned}
+        if Select != "COUNT":
+            resp["Items"] = out
+        if i < len(keys):
+            lek = _StartKey(self._key_dict(self.items[keys[i - 1]]) if keys[i - 1] in self.items
+                            else dict(zip((self.hash_key, self.range_key), keys[i - 1])))
+            lek.pos = i
+            resp["LastEvaluatedKey"] = lek
+        return resp
+
+    def scan(self, FilterExpression=None, ProjectionExpression=None, ExpressionAttributeNames=None,
+             ExpressionAttributeValues=None, ExclusiveStartKey=None, Limit=None,
+             Segment=None, TotalSegments=None, Select=None, **_):
+        self._maybe_throttle("Scan")
+        accept = None
+        if TotalSegments:
+            segments = self.segments
+            accept = lambda k: segments[k] % TotalSegments == Segment   # noqa: E731
+        return self._page(self.order, "Scan", Limit, ExclusiveStartKey, FilterExpression,
+                          ProjectionExpression, ExpressionAttributeNames,
+                          ExpressionAttributeValues, Select, accept)
+
+    def query(self, KeyConditionExpression, IndexName=None, FilterExpression=None,
+              ProjectionExpression=None, ExpressionAttributeNames=None,
+              ExpressionAttributeValues=None, ExclusiveStartKey=None, Limit=None,
+              ScanIndexForward=True, Select=None, **_):
+        self._maybe_throttle("Query")
+        if IndexName:
+            hash_attr, range_attr = self.indexes[IndexName]
+        else:
+            hash_attr, range_attr = self.hash_key, self.range_key
+        # Matching keys are cached per query while the table is unchanged so
+        # paginating a large result does not rescan the whole table per page.
+        cache_key = (IndexName, repr(KeyConditionExpression), repr(ExpressionAttributeNames),
+                     repr(sorted((ExpressionAttributeValues or {}).items())),
+                     ScanIndexForward, self.version)
+        keys = self.query_cache.get(cache_key)
+        if keys is None:
+            key_cond = compile_condition(KeyConditionExpression, ExpressionAttributeNames,
+                                         ExpressionAttributeValues)
+            with self.lock:
+                matched = [(k, it) for k, it in self.items.items()
+                           if hash_attr in it and (not range_attr or range_attr in it) and key_cond(it)]
+            if range_attr:
+                matched.sort(key=lambda kv: kv[1][range_attr], reverse=not ScanIndexForward)
+            keys = [k for k, _ in matched]
+            self.query_cache = {cache_key: keys}
+        return self._page(keys, "Query", Limit, ExclusiveStartKey,
+                          FilterExpression, ProjectionExpression, ExpressionAttributeNames,
+                          ExpressionAttributeValues, Select)
+
+    def batch_writer(self, **_):
+        return _BatchWriter(self)
+
+
+class InMemoryDynamoDB(_Service):
+    """`boto3.resource('dynamodb')` and its `.meta.client` in one object."""
+    service = "dynamodb"
+
+    def __init__(self):
+        super().__init__()
+        self.tables = {}
+
+    def add_table(self, table):
+        self.tables[table.name] = table
+        return table
+
+    def Table(self, name):
+        if name not in self.tables:
+            self.tables[name] = InMemoryTable(name)
+        return self.tables[name]
+
+    def batch_get_item(self, RequestItems, **_):
+        read = 0
+        out, unprocessed = {}, {}
+        for name, spec in RequestItems.items():
+            table = self.Table(name)
+            for key in spec["Keys"]:
+                k = table._key(key)
+                item = table.items.get(k)
+                if item is not None:
+                    read += table.sizes[k]
+                    out.setdefault(name, []).append(
+                        _copy(project(item, spec.get("ProjectionExpression"),
+                                      spec.get("ExpressionAttributeNames"))))
+        self._hit("BatchGetItem", read)
+        return {"Responses": out, "UnprocessedKeys": unprocessed}
+
+    def transact_write_items(self, TransactItems, **_):
+        self._hit("TransactWriteItems")
+        for op in TransactItems:
+            upd = op.get("Update")
+            if upd:
+                table = self.Table(upd["TableName"])
+                key = {k: _from_ddb_json(v) for k, v in upd["Key"].items()}
+                values = {k: _from_ddb_json(v) for k, v in upd.get("ExpressionAttributeValues", {}).items()}
+                table.update_item(Key=key, UpdateExpression=upd["UpdateExpression"],
+                                  ConditionExpression=upd.get("ConditionExpression"),
+                                  ExpressionAttributeNames=upd.get("ExpressionAttributeNames"),
+                                  ExpressionAttributeValues=values)
+        return {}
+
+
+def _from_ddb_json(v):
+    (t, val), = v.items()
+    if t == "S":
+        return val
+    if t == "N":
+        return Decimal(val)
+    if t == "BOOL":
+        return val
+    if t == "L":
+        return [_from_ddb_json(x) for x in val]
+    if t == "M":
+        return {k: _from_ddb_json(x) for k, x in val.items()}
+    if t == "NULL":
+        return None
+    return val
+
+
+def _to_ddb_json(v):
+    if isinstance(v, bool):
+        return {"BOOL": v}
+    if v is None:
+        return {"NULL": True}
+    if isinstance(v, (int, float, Decimal)):
+        return {"N": str(v)}
+    if isinstance(v, str):
+        return {"S": v}
+    if isinstance(v, dict):
+        return {"M": {k: _to_ddb_json(x) for k, x in v.items()}}
+    if isinstance(v, (list, tuple)):
+        return {"L": [_to_ddb_json(x) for x in v]}
+    raise TypeError(type(v))
+
+
+class InMemoryStreams(_Service):
+    """
+    `boto3.client('dynamodbstreams')` over the `stream` list of the
+    InMemoryTables: one shard per table, stream ARN "<table name>/stream".
+    """
+    service = "dynamodbstreams"
+    SHARD = "shard-0"
+
+    def __init__(self, dynamodb):
+        super().__init__()
+        self.dynamodb = dynamodb
+
+    def _table(self, arn):
+        return self.dynamodb.Table(arn.split("/")[-2] if "/stream" in arn else arn)
+
+    def describe_stream(self, StreamArn, **_):
+        self._hit("DescribeStream")
+        return {"StreamDescription": {"StreamArn": StreamArn, "Shards": [
+            {"ShardId": self.SHARD, "SequenceNumberRange": {"StartingSequenceNumber": "0"}}]}}
+
+    def get_shard_iterator(self, StreamArn, ShardId, ShardIteratorType, SequenceNumber=None, **_):
+        self._hit("GetShardIterator")
+        stream = self._table(StreamArn).stream
+        pos = {"LATEST": len(stream), "TRIM_HORIZON": 0}.get(ShardIteratorType)
+        if pos is None:
+            pos = int(SequenceNumber) + 1
+        return {"ShardIterator": f"{StreamArn}|{pos}"}
+
+    def get_records(self, ShardIterator, Limit=1000, **_):
+        self._hit("GetRecords")
+        arn, pos = ShardIterator.rsplit("|", 1)
+        pos = int(pos)
+        stream = self._table(arn).stream
+        records = []
+        for n, (name, keys, old, new) in enumerate(stream[pos:pos + Limit], pos):
+            ddb = {"Keys": _to_ddb_json(keys)["M"], "SequenceNumber": str(n)}
+            if new is not None:
+                ddb["NewImage"] = _to_ddb_json(new)["M"]
+            if old is not None:
+                ddb["OldImage"] = _to_ddb_json(old)["M"]
+            records.append({"eventName": name, "eventSource": "aws:dynamodb", "dynamodb": ddb})
+        return {"Records": records, "NextShardIterator": f"{arn}|{pos + len(records)}"}
+
+
+# ───────────────────────────── messaging ──────────────────────────
+class RecordingClient(_Service):
+    """Accepts any call and records it (SNS, SES, ...)."""
+
+    def __init__(self, service):
+        super().__init__()
+        self.service = service
+        self.sent = []
+
+    def __getattr__(self, op):
+        if op.startswith("_"):
+            raise AttributeError(op)
+
+        def call(**kwargs):
+            self._hit(op)
+            self.sent.append((op, kwargs))
+            if op == "subscribe":
+                return {"SubscriptionArn": f"arn:aws:sns:local:0:sub/{kwargs.get('Endpoint')}"}
+            return {"MessageId": str(len(self.sent))}
+        return call
+
+
+# ───────────────────────────── fake boto3 ─────────────────────────
+class _Cond:
+    def __init__(self, fn):
+        self.fn = fn
+
+    def __call__(self, item):
+        return self.fn(item)
+
+    def __and__(self, other):
+        return _Cond(lambda item: self(item) and other(item))
+
+    def __or__(self, other):
+        return _Cond(lambda item: self(item) or other(item))
+
+    def __invert__(self):
+        return _Cond(lambda item: not self(item))
+
+
+class Attr:
+    def __init__(self, name):
+        self.parts = name.split(".")
+
+    def _get(self, item):
+        return get_path(item, self.parts)
+
+    def eq(self, v):          return _Cond(lambda it: self._get(it) == v)
+    def ne(self, v):          return _Cond(lambda it: self._get(it) != v)
+    def lt(self, v):          return _Cond(lambda it: _cmp(self._get(it), "<", v))
+    def lte(self, v):         return _Cond(lambda it: _cmp(self._get(it), "<=", v))
+    def gt(self, v):          return _Cond(lambda it: _cmp(self._get(it), ">", v))
+    def gte(self, v):         return _Cond(lambda it: _cmp(self._get(it), ">=", v))
+    def between(self, a, b):  return _Cond(lambda it: _cmp(self._get(it), ">=", a) and _cmp(self._get(it), "<=", b))
+    def begins_with(self, v): return _Cond(lambda it: isinstance(self._get(it), str) and self._get(it).startswith(v))
+    def is_in(self, vs):      return _Cond(lambda it: self._get(it) in vs)
+    def exists(self):         return _Cond(lambda it: _has_path(it, self.parts))
+    def not_exists(self):     return _Cond(lambda it: not _has_path(it, self.parts))
+    def contains(self, v):    return _Cond(lambda it: self._get(it) is not None and v in self._get(it))
+
+
+Key = Attr
+
+
+class Environment:
+    """One set of stand-ins; `install()` makes `import boto3` return them."""
+
+    def __init__(self):
+        self.s3 = InMemoryS3()
+        self.dynamodb = InMemoryDynamoDB()
+        self.clients = {"s3": self.s3, "dynamodbstreams": InMemoryStreams(self.dynamodb)}
+
+    def client(self, name, *args, **kwargs):
+        if name == "dynamodb":
+            return self.dynamodb
+        if name not in self.clients:
+            self.clients[name] = RecordingClient(name)
+        return self.clients[name]
+
+    def resource(self, name, *args, **kwargs):
+        assert name == "dynamodb", name
+        return self.dynamodb
+
+    def install(self):
+        boto3 = types.ModuleType("boto3")
+        boto3.client = self.client
+        boto3.resource = self.resource
+        boto3.__stand_in__ = True
+        dyn = types.ModuleType("boto3.dynamodb")
+        cond = types.ModuleType("boto3.dynamodb.conditions")
+        cond.Attr, cond.Key = Attr, Key
+        boto3.dynamodb = dyn
+        dyn.conditions = cond
+        botocore = types.ModuleType("botocore")
+        exc = types.ModuleType("botocore.exceptions")
+        exc.ClientError = ClientError
+        botocore.exceptions = exc
+        sys.modules.update({"boto3": boto3, "boto3.dynamodb": dyn,
+                            "boto3.dynamodb.conditions": cond,
+                            "botocore": botocore, "botocore.exceptions": exc})
+        return self
+
+
+def install_fake_boto3():
+    return Environment().install()
+
+
+def ensure_common_on_path():
+    common = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common")
+    if common not in sys.path:
+        sys.path.insert(0, common)
@@ -0,0 +1,6 @@
+"""
+Helpers shared by the BirdTag Lambdas.
+
+Zip-deployed functions get this package from the layer built by
+common/Dockerfile; container-image functions copy it next to their handler.
+"""
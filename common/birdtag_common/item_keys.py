@@ -0,0 +1,85 @@
+import hashlib
+from datetime import datetime, timezone
+from botocore.exceptions import ClientError
+
+
+def media_item_id(bucket: str, key: str, version_id: str = None) -> str:
+    """
+    Deterministic catalog id for one S3 object (version).
+
+    The same upload always maps to the same uniqueId, so a retried or
+    duplicated S3 event lands on the same row instead of creating a new one.
+    """
+    source = f"{bucket}/{key}@{version_id or 'null'}"
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()[:32]
+
+
+def event_time(record: dict) -> str:
+    """S3 event time as an ISO-8601 UTC string (falls back to now)."""
+    raw = record.get("eventTime")
+    if raw:
+        try:
+            return datetime.fromisoformat(raw.replace("Z", "+00:00")).isoformat()
+        except ValueError:
+            pass
+    return datetime.utcnow().replace(tzinfo=timezone.utc).isoformat()
+
+
+def already_ingested(table, item_id: str, etag: str) -> bool:
+    """True if this exact object content is already in the catalog."""
+    if not etag:
+        return False
+    resp = table.get_item(Key={"uniqueId": item_id},
+                          ProjectionExpression="sourceETag",
+                          ConsistentRead=True)
+    return resp.get("Item", {}).get("sourceETag") == etag
+
+
+TAGS_EDITED = "tagsEdited"      # set by /modify-tags on rows whose tags a user changed
+OPTIONAL_FIELDS = ("duration", "tracks", "individuals")
+
+
+def upsert_item(table, item: dict):
+    """
+    Create or update the row of `item` unless it already holds the same
+    object content (same sourceETag), so a retry of the same upload is a
+    no-op.
+
+    Only the attributes in `item` are written. When a new upload replaces
+    the object, tags a user edited through /modify-tags (TAGS_EDITED) are
+    kept, and OPTIONAL_FIELDS the new item lacks are removed. Returns
+    (written, old row or None, row as written).
+    """
+    fields = {k: v for k, v in item.items() if k != "uniqueId"}
+    remove = [f for f in OPTIONAL_FIELDS if f not in fields]
+    # plain rows get the new tags; rows with user-edited tags keep theirs
+    for keep_tags in (False, True):
+        set_fields = {k: v for k, v in fields.items() if not (keep_tags and k == "tags")}
+        names = {f"#f{i}": k for i, k in enumerate(set_fields)}
+        names.update({f"#r{i}": k for i, k in enumerate(remove)})
+        names["#e"] = TAGS_EDITED
+        values = {f":v{i}": v for i, v in enumerate(set_fields.values())}
+        values[":etag"] = item.get("sourceETag") or ""
+        expr = "SET " + ", ".join(f"#f{i} = :v{i}" for i in range(len(set_fields)))
+        if remove:
+            expr += " REMOVE " + ", ".join(f"#r{i}" for i in range(len(remove)))
+        try:
+            resp = table.update_item(
+                Key={"uniqueId": item["uniqueId"]},
+                UpdateExpression=expr,
+                ConditionExpression="(attribute_not_exists(uniqueId) OR sourceETag <> :etag) AND "
+                                    + ("attribute_exists(#e)" if keep_tags else "attribute_not_exists(#e)"),
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=values,
+                ReturnValues="ALL_OLD",
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            continue
+        old = resp.get("Attributes") or None
+        row = {k: v for k, v in {**(old or {}), **item}.items() if k not in remove}
+        if keep_tags:
+            row["tags"] = old.get("tags")
+        return True, old, row
+    return False, None, None
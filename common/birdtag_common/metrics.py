@@ -0,0 +1,207 @@
+"""
+Per-invocation instrumentation for the Lambdas.
+
+- `stage(name)` times a block (download, model_load, decode, inference,
+  encode, upload, db_write, db_read, presign, ...); repeated stages add up.
+- `instrument_client(client)` counts every AWS API call made through a
+  boto3 client or resource as `aws.<service>.<Operation>`.
+- `instrumented` wraps a handler: resets the counters, times the whole
+  invocation and prints one CloudWatch Embedded Metric Format (EMF) JSON
+  line at the end, which CloudWatch turns into metrics without any API
+  calls from the function.
+- Setting PROFILE_SAMPLE_RATE (0..1) samples that fraction of invocations
+  with a stack-sampling profiler and logs the hottest stacks, so hot spots
+  can be found from production logs by changing configuration only.
+"""
+import functools
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+NAMESPACE = os.getenv("METRICS_NAMESPACE", "BirdTag")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_TOP = int(os.getenv("PROFILE_TOP", "25"))
+MAX_METRICS_PER_LINE = 100       # EMF limit per metric directive
+
+
+class Metrics:
+    def __init__(self, function=None, namespace=NAMESPACE):
+        self.function = function or os.getenv("AWS_LAMBDA_FUNCTION_NAME", "local")
+        self.namespace = namespace
+        self.lock = threading.Lock()
+        self.cold_start = True
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.timings = defaultdict(float)     # stage -> ms
+            self.counts = Counter()               # counter -> n
+            self.values = {}                      # gauge -> (value, unit)
+            self.dimensions = {}
+            self.properties = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            with self.lock:
+                self.timings[name] += elapsed
+
+    def incr(self, name, n=1):
+        with self.lock:
+            self.counts[name] += n
+
+    def put(self, name, value, unit="None"):
+        with self.lock:
+            self.values[name] = (value, unit)
+
+    def set_dimension(self, key, value):
+        self.dimensions[key] = str(value)
+
+    def set_property(self, key, value):
+        """Logged with the metrics line but not turned into a metric."""
+        self.properties[key] = value
+
+    def to_emf(self):
+        with self.lock:
+            metrics = {f"{k}_ms": (round(v, 2), "Milliseconds") for k, v in self.timings.items()}
+            metrics.update({k: (v, "Count") for k, v in self.counts.items()})
+            metrics.update(self.values)
+        dims = {"Function": self.function, **self.dimensions}
+        names = list(metrics)
+        lines = []
+        for start in range(0, max(1, len(names)), MAX_METRICS_PER_LINE):
+            chunk = names[start:start + MAX_METRICS_PER_LINE]
+            line = {
+                "_aws": {
+                    "Timestamp": int(time.time() * 1000),
+                    "CloudWatchMetrics": [{
+                        "Namespace": self.namespace,
+                        "Dimensions": [list(dims)],
+                        "Metrics": [{"Name": n, "Unit": metrics[n][1]} for n in chunk],
+                    }],
+                },
+                **dims,
+                **self.properties,
+                **{n: metrics[n][0] for n in chunk},
+            }
+            lines.append(line)
+        return lines
+
+    def emit(self):
+        for line in self.to_emf():
+            print(json.dumps(line, default=str))
+
+
+METRICS = Metrics()
+stage = METRICS.stage
+incr = METRICS.incr
+put = METRICS.put
+set_dimension = METRICS.set_dimension
+set_property = METRICS.set_property
+
+
+# ─────────────────────────── AWS call counting ───────────────────────────
+def _count_call(event_name=None, **_):
+    # event_name looks like "before-call.s3.GetObject"
+    parts = (event_name or "").split(".")
+    if len(parts) >= 3:
+        METRICS.incr(f"aws.{parts[1]}.{parts[2]}")
+
+
+def instrument_client(client):
+    """Count API calls of a boto3 client, or of a resource / Table's client."""
+    low_level = getattr(client.meta, "client", client)
+    low_level.meta.events.register("before-call", _count_call,
+                                   unique_id="birdtag-metrics-count")
+    return client
+
+
+# ─────────────────────────── sampling profiler ───────────────────────────
+class SamplingProfiler:
+    """Periodically samples one thread's stack and counts collapsed stacks."""
+
+    def __init__(self, thread_id, interval_ms=PROFILE_INTERVAL_MS):
+        self.thread_id = thread_id
+        self.interval = interval_ms / 1000
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def report(self, top=PROFILE_TOP):
+        # leaf-function totals are the quickest way to spot a hot spot
+        leaves = Counter()
+        for stack, n in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += n
+        return {
+            "profile": {
+                "function": METRICS.function,
+                "samples": self.samples,
+                "interval_ms": self.interval * 1000,
+                "top_leaves": leaves.most_common(top),
+                "top_stacks": self.stacks.most_common(top),
+            }
+        }
+
+
+def _profile_this_invocation():
+    try:
+        rate = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+    except ValueError:
+        return False
+    return rate > 0 and random.random() < rate
+
+
+# ─────────────────────────── handler wrapper ─────────────────────────────
+def instrumented(handler):
+    """Decorator for `lambda_handler(event, context)`."""
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        METRICS.reset()
+        METRICS.set_property("coldStart", METRICS.cold_start)
+        METRICS.cold_start = False
+        profiler = None
+        if _profile_this_invocation():
+            profiler = SamplingProfiler(threading.get_ident()).start()
+        try:
+            with METRICS.stage("total"):
+                return handler(event, context)
+        except Exception:
+            METRICS.incr("errors")
+            raise
+        finally:
+            if profiler is not None:
+                profiler.stop()
+                print(json.dumps(profiler.report()))
+            METRICS.emit()
+    return wrapper
@@ -0,0 +1,69 @@
+"""
+Newest-model-in-S3 cache for the tagger Lambdas.
+
+The taggers always use the most recently uploaded model file under a
+prefix. Listing and downloading it on every invocation costs two S3 calls
+and a multi-MB copy per event, so `LatestModelFiles` keeps the files in a
+directory that survives warm invocations (/tmp) and only downloads again
+when the newest object's key or LastModified changes. The listing itself is
+repeated at most every `refresh_sec` seconds.
+"""
+import os
+import time
+
+MODEL_DIR = os.getenv("MODEL_DIR", "/tmp/models")
+MODEL_REFRESH_SEC = int(os.getenv("MODEL_REFRESH_SEC", "300"))
+
+
+class LatestModelFiles:
+    def __init__(self, s3, bucket, prefix, suffixes, local_dir=MODEL_DIR,
+                 refresh_sec=MODEL_REFRESH_SEC):
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix
+        self.suffixes = tuple(s.lower() for s in suffixes)
+        self.local_dir = local_dir
+        self.refresh_sec = refresh_sec
+        self.versions = {}        # suffix -> (Key, LastModified)
+        self.paths = {}           # suffix -> local path
+        self.checked_at = 0.0
+
+    def _newest(self):
+        newest = {}
+        paginator = self.s3.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for obj in page.get("Contents", []):
+                for suffix in self.suffixes:
+                    if obj["Key"].lower().endswith(suffix):
+                        if suffix not in newest or obj["LastModified"] > newest[suffix]["LastModified"]:
+                            newest[suffix] = obj
+        missing = [s for s in self.suffixes if s not in newest]
+        if missing:
+            raise RuntimeError(f"No {'/'.join(missing)} file in s3://{self.bucket}/{self.prefix}")
+        return newest
+
+    def get(self, force=False):
+        """
+        Return (paths, changed): local paths in `suffixes` order and whether
+        any of them is different from what the previous call returned.
+        """
+        if self.paths and not force and time.time() - self.checked_at < self.refresh_sec:
+            return [self.paths[s] for s in self.suffixes], False
+
+        newest = self._newest()
+        self.checked_at = time.time()
+        os.makedirs(self.local_dir, exist_ok=True)
+        changed = False
+        for suffix, obj in newest.items():
+            version = (obj["Key"], str(obj["LastModified"]))
+            if self.versions.get(suffix) == version and os.path.exists(self.paths[suffix]):
+                continue
+            local = os.path.join(self.local_dir, os.path.basename(obj["Key"]))
+            self.s3.download_file(self.bucket, obj["Key"], local)
+            old = self.paths.get(suffix)
+            if old and old != local and os.path.exists(old):
+                os.remove(old)          # /tmp is small; keep one copy per file type
+            self.versions[suffix], self.paths[suffix] = version, local
+            changed = True
+            print(f"[INFO] Using model file: s3://{self.bucket}/{obj['Key']}")
+        return [self.paths[s] for s in self.suffixes], changed
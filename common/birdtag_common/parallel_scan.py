@@ -0,0 +1,208 @@
+"""
+Parallel segmented table scan for jobs that must see every row.
+
+`ParallelScan(table, segments=8)` splits the scan into DynamoDB
+Segment/TotalSegments slices, scans them on a thread pool (each segment
+follows its own LastEvaluatedKey) and yields the rows, converted to native
+Python types, to a single consumer as pages arrive:
+
+    for item in ParallelScan(table, segments=16, fields=("uniqueId", "tags")):
+        ...
+
+Throttled pages are retried with exponential backoff and full jitter, and a
+segment that keeps getting throttled slows its own next pages down until it
+recovers. With `checkpoint=path`, the last fully consumed page of every
+segment is written to a JSON file, so an interrupted job started again with
+the same file resumes where it stopped (rows of a page that was in flight
+are delivered again; consumers must tolerate that). Any table object with
+a boto3-style `scan()` works, including benchmarks/stand_ins.InMemoryTable
+for local runs.
+"""
+import json
+import os
+import queue
+import random
+import threading
+import time
+from decimal import Decimal
+
+from botocore.exceptions import ClientError
+
+RETRYABLE = {"ProvisionedThroughputExceededException", "ThrottlingException",
+             "RequestLimitExceeded", "InternalServerError", "ServiceUnavailable"}
+_DONE = object()
+
+
+def to_native(value):
+    """DynamoDB resource values -> plain Python (Decimal to int/float, sets to lists)."""
+    if isinstance(value, dict):
+        return {k: to_native(v) for k, v in value.items()}
+    if isinstance(value, (list, set)):
+        return [to_native(v) for v in value]
+    if isinstance(value, Decimal):
+        return int(value) if value % 1 == 0 else float(value)
+    return value
+
+
+# ─────────────────────────── checkpoint file ───────────────────────────
+def _encode(obj):
+    if isinstance(obj, Decimal):
+        return {"$n": str(obj)}
+    raise TypeError(f"Cannot checkpoint {type(obj).__name__}")
+
+
+def _decode(obj):
+    return Decimal(obj["$n"]) if set(obj) == {"$n"} else obj
+
+
+class Checkpoint:
+    """Per-segment scan positions ({"key": LastEvaluatedKey, "done": bool}) in a JSON file."""
+
+    def __init__(self, path, total_segments):
+        self.path = path
+        self.total_segments = total_segments
+        self.segments = {n: {"key": None, "done": False} for n in range(total_segments)}
+        self.lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as fh:
+                saved = json.load(fh, object_hook=_decode)
+            if saved.get("total_segments") != total_segments:
+                raise ValueError(f"{path} was written for {saved.get('total_segments')} segments, "
+                                 f"not {total_segments}")
+            self.segments.update({int(n): s for n, s in saved["segments"].items()})
+
+    def advance(self, segment, key):
+        with self.lock:
+            self.segments[segment] = {"key": key, "done": key is None}
+            self._save()
+
+    def _save(self):
+        if not self.path:
+            return
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump({"total_segments": self.total_segments,
+                       "segments": {str(n): s for n, s in self.segments.items()}}, fh, default=_encode)
+        os.replace(tmp, self.path)     # never leave a half-written checkpoint
+
+    @property
+    def complete(self):
+        return all(s["done"] for s in self.segments.values())
+
+
+# ───────────────────────────── scan engine ─────────────────────────────
+class ParallelScan:
+    def __init__(self, table, segments=8, workers=None, fields=None, checkpoint=None,
+                 page_limit=None, max_retries=10, base_delay=0.05, max_delay=5.0,
+                 native=True, **scan_kwargs):
+        self.table = table
+        self.total_segments = segments
+        self.workers = min(workers or segments, segments)
+        self.checkpoint = Checkpoint(checkpoint, segments)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.native = native
+        self.scan_kwargs = dict(scan_kwargs)
+        if fields:
+            self.scan_kwargs["ProjectionExpression"] = ", ".join(f"#s{n}" for n in range(len(fields)))
+            self.scan_kwargs["ExpressionAttributeNames"] = {
+                **self.scan_kwargs.get("ExpressionAttributeNames", {}),
+                **{f"#s{n}": f for n, f in enumerate(fields)}}
+        if page_limit:
+            self.scan_kwargs["Limit"] = page_limit
+        self.stats = {"pages": 0, "items": 0, "scanned": 0, "throttled": 0}
+        self._stats_lock = threading.Lock()     # "throttled" is counted by the workers
+        self._stop = threading.Event()
+
+    def _scan_page(self, kwargs, state):
+        """One scan call with retries; `state` carries the segment's current pacing delay."""
+        for attempt in range(self.max_retries + 1):
+            if state["pace"]:
+                time.sleep(state["pace"])
+            try:
+                resp = self.table.scan(**kwargs)
+                state["pace"] = state["pace"] / 2 if state["pace"] > self.base_delay else 0.0
+                return resp
+            except ClientError as e:
+                if e.response.get("Error", {}).get("Code") not in RETRYABLE or attempt == self.max_retries:
+                    raise
+                with self._stats_lock:
+                    self.stats["throttled"] += 1
+                state["pace"] = min(self.max_delay, max(state["pace"] * 2, self.base_delay))
+                time.sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)))
+
+    def _put(self, out, entry):
+        while not self._stop.is_set():
+            try:
+                out.put(entry, timeout=0.2)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _run_segment(self, segment, out):
+        saved = self.checkpoint.segments[segment]
+        if saved["done"]:
+            return
+        kwargs = dict(self.scan_kwargs, Segment=segment, TotalSegments=self.total_segments)
+        if saved["key"]:
+            kwargs["ExclusiveStartKey"] = saved["key"]
+        state = {"pace": 0.0}
+        while not self._stop.is_set():
+            resp = self._scan_page(kwargs, state)
+            next_key = resp.get("LastEvaluatedKey")
+            if not self._put(out, (segment, resp.get("Items", []), resp.get("ScannedCount", 0),
+                                   next_key)):
+                return
+            if next_key is None:
+                return
+            kwargs["ExclusiveStartKey"] = next_key
+
+    def _worker(self, segments, out):
+        try:
+            for segment in segments:
+                self._run_segment(segment, out)
+        except Exception as e:
+            self._put(out, e)
+        finally:
+            self._put(out, _DONE)
+
+    def __iter__(self):
+        out = queue.Queue(maxsize=self.workers * 2)
+        # segments dealt round-robin so every worker gets a similar share
+        plan = [list(range(self.total_segments))[w::self.workers] for w in range(self.workers)]
+        threads = [threading.Thread(target=self._worker, args=(segs, out), daemon=True)
+                   for segs in plan]
+        for t in threads:
+            t.start()
+        running = len(threads)
+        try:
+            while running:
+                entry = out.get()
+                if entry is _DONE:
+                    running -= 1
+                    continue
+                if isinstance(entry, Exception):
+                    raise entry
+                segment, items, scanned, next_key = entry
+                self.stats["pages"] += 1
+                self.stats["scanned"] += scanned
+                for item in items:
+                    self.stats["items"] += 1
+                    yield to_native(item) if self.native else item
+                # the page has been consumed: a restart can continue after it
+                self.checkpoint.advance(segment, next_key)
+        finally:
+            self._stop.set()
+            for t in threads:
+                t.join(timeout=5)
+
+    @property
+    def complete(self):
+        return self.checkpoint.complete
+
+
+def parallel_scan(table, segments=8, **kwargs):
+    """Generator of every (native-typed) row; see ParallelScan for the options."""
+    return iter(ParallelScan(table, segments, **kwargs))
@@ -0,0 +1,121 @@
+"""
+/search result cache with write-driven invalidation.
+
+Every species has a version counter in SPECIES_VERSION_TABLE (hash key
+`species`). Anything that changes which items carry a species — the
+tagger Lambdas on ingest, /modify-tags and /delete-files in web-lambda —
+calls `bump_species()` for the species it touched. The first time a species
+is seen, the special `__vocab__` counter is bumped as well, because
+substring searches ("cro") may now resolve to one more species.
+
+web-lambda caches the matching item ids (not presigned URLs, which expire)
+per normalized query together with the versions of the species the query
+depends on; an entry is only served while all of those versions are
+unchanged and it is younger than QUERY_CACHE_TTL.
+"""
+import json
+import os
+import time
+from collections import OrderedDict
+
+from birdtag_common.species import normalize
+
+SPECIES_VERSION_TABLE = os.getenv("SPECIES_VERSION_TABLE")
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+QUERY_CACHE_TTL = int(os.getenv("QUERY_CACHE_TTL", "900"))
+VERSION_TTL = float(os.getenv("VERSION_TTL", "1"))     # reuse version reads this long
+VOCAB_KEY = "__vocab__"
+BATCH_GET_LIMIT = 100
+
+
+def bump_species(table, species_ids):
+    """Invalidate cached searches that involve any of `species_ids`."""
+    new_species = False
+    for species in sorted(set(species_ids)):
+        resp = table.update_item(
+            Key={"species": species},
+            UpdateExpression="ADD #v :one",
+            ExpressionAttributeNames={"#v": "version"},
+            ExpressionAttributeValues={":one": 1},
+            ReturnValues="UPDATED_NEW",
+        )
+        new_species |= int(resp.get("Attributes", {}).get("version", 0)) == 1
+    if new_species:
+        table.update_item(Key={"species": VOCAB_KEY}, UpdateExpression="ADD #v :one",
+                          ExpressionAttributeNames={"#v": "version"},
+                          ExpressionAttributeValues={":one": 1})
+
+
+def bump_species_safely(table, species_ids):
+    """bump_species() for writers whose own write already succeeded."""
+    if table is None or not species_ids:
+        return
+    try:
+        bump_species(table, species_ids)
+    except Exception as e:
+        # cached results for these species stay up to QUERY_CACHE_TTL old
+        print(f"[WARN] Could not bump species versions {sorted(species_ids)}: {e}")
+
+
+def query_key(mode, terms, extra=None):
+    """
+    Normalized cache key: mode + sorted (term, count) pairs (+ filters).
+    Terms go through species.normalize, as in resolve(), so "Crow" and
+    "crow" share an entry.
+    """
+    return json.dumps([mode, sorted([normalize(t), int(c)] for t, c in terms), extra])
+
+
+class QueryCache:
+    def __init__(self, dynamodb, table_name=SPECIES_VERSION_TABLE, size=QUERY_CACHE_SIZE,
+                 ttl=QUERY_CACHE_TTL, version_ttl=VERSION_TTL):
+        self.dynamodb = dynamodb
+        self.table_name = table_name
+        self.size = size
+        self.ttl = ttl
+        self.version_ttl = version_ttl
+        self.entries = OrderedDict()      # key -> (ids, versions, stored_at)
+        self.known = {}                   # species -> (version, read_at)
+
+    def versions(self, species):
+        """Current version of every species in `species` (0 if never bumped)."""
+        now = time.time()
+        todo = [s for s in species if s not in self.known or now - self.known[s][1] > self.version_ttl]
+        for i in range(0, len(todo), BATCH_GET_LIMIT):
+            keys = [{"species": s} for s in todo[i:i + BATCH_GET_LIMIT]]
+            request = {self.table_name: {"Keys": keys, "ProjectionExpression": "species, #v",
+                                         "ExpressionAttributeNames": {"#v": "version"}}}
+            found = {}
+            while request:
+                resp = self.dynamodb.batch_get_item(RequestItems=request)
+                for item in resp.get("Responses", {}).get(self.table_name, []):
+                    found[item["species"]] = int(item.get("version", 0))
+                request = resp.get("UnprocessedKeys") or None
+            for key in keys:
+                self.known[key["species"]] = (found.get(key["species"], 0), now)
+        return {s: self.known[s][0] for s in species}
+
+    def get(self, key, versions):
+        """(ids, age seconds) if a valid entry exists, else None."""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        ids, stored_versions, stored_at = entry
+        age = time.time() - stored_at
+        if stored_versions != versions or age > self.ttl:
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return ids, age
+
+    def put(self, key, versions, ids):
+        self.entries[key] = (tuple(ids), dict(versions), time.time())
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def forget(self, species):
+        """Drop local version reads so this container's own writes show at once."""
+        for s in species:
+            self.known.pop(s, None)
+        self.known.pop(VOCAB_KEY, None)
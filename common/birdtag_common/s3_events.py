@@ -0,0 +1,96 @@
+"""
+Uniform view of uploads delivered either directly by S3 notifications or
+through an SQS queue (S3 -> SQS -> Lambda, with ReportBatchItemFailures).
+
+Queue mode is what gives the taggers backpressure: the event source mapping
+caps concurrency (ScalingConfig.MaximumConcurrency) and batch size, bursts
+wait in the queue instead of throttling S3 async invokes, and records a
+handler could not finish are handed back via `batch_response`.
+
+Both taggers share the rest of the plumbing: `until_low_on_time` stops
+handing out work when the invocation is about to time out (the rest is
+retried by the queue) and `respond` builds the handler's return value.
+"""
+import json
+from collections import namedtuple
+from urllib.parse import unquote_plus
+
+# message_id is None for direct S3 invocations
+S3Upload = namedtuple("S3Upload", "message_id bucket key version_id etag record")
+
+
+def _uploads_from_s3_event(s3_event, message_id=None):
+    for rec in s3_event.get("Records", []):
+        if "s3" not in rec:
+            continue
+        obj = rec["s3"]["object"]
+        yield S3Upload(
+            message_id=message_id,
+            bucket=rec["s3"]["bucket"]["name"],
+            key=unquote_plus(obj["key"]),   # S3 URL-encodes keys in events
+            version_id=obj.get("versionId"),
+            etag=obj.get("eTag", ""),
+            record=rec,
+        )
+
+
+def iter_s3_records(event):
+    """Yield every S3Upload in a direct S3 event or an SQS batch."""
+    for rec in event.get("Records", []):
+        if rec.get("eventSource") == "aws:sqs":
+            try:
+                body = json.loads(rec["body"])
+            except (TypeError, ValueError):
+                print(f"[WARN] SQS message {rec.get('messageId')} is not JSON, dropping")
+                continue
+            if body.get("Event") == "s3:TestEvent":
+                continue
+            yield from _uploads_from_s3_event(body, rec["messageId"])
+        else:
+            yield from _uploads_from_s3_event({"Records": [rec]})
+
+
+def is_queue_event(event) -> bool:
+    return any(r.get("eventSource") == "aws:sqs" for r in event.get("Records", []))
+
+
+def time_left_ms(context) -> float:
+    """Remaining invocation time; unlimited when run outside Lambda."""
+    if context is None or not hasattr(context, "get_remaining_time_in_millis"):
+        return float("inf")
+    return context.get_remaining_time_in_millis()
+
+
+def batch_response(failed_message_ids) -> dict:
+    """SQS partial batch response; failed messages become visible again."""
+    return {"batchItemFailures": [{"itemIdentifier": m}
+                                  for m in dict.fromkeys(failed_message_ids) if m]}
+
+
+def until_low_on_time(items, context, min_time_left_ms, deferred):
+    """
+    Yield `items` while at least `min_time_left_ms` of the invocation is
+    left; the ones not handed out are appended to `deferred`.
+    """
+    items = list(items)
+    for n, item in enumerate(items):
+        if time_left_ms(context) < min_time_left_ms:
+            print(f"[WARN] Low on time, deferring {len(items) - n} of {len(items)} work items")
+            deferred.extend(items[n:])
+            return
+        yield item
+
+
+def respond(event, results, failed):
+    """
+    Handler return value for `results` and the S3Uploads in `failed`: the
+    partial batch response for SQS. A direct S3 invoke raises when anything
+    failed, so Lambda's async retry runs it again.
+    """
+    if is_queue_event(event):
+        resp = batch_response(up.message_id for up in failed)
+        resp["results"] = results
+        return resp
+    if failed:
+        raise RuntimeError(f"Failed to process {[up.key for up in failed]}")
+    return results[0] if len(results) == 1 else {"statusCode": 200, "results": results}
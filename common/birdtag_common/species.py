@@ -0,0 +1,158 @@
+"""
+Species vocabulary: model labels -> canonical species ids.
+
+The same species reaches the catalog under different labels: YOLO class
+names ("Crow"), BirdNET labels ("Corvus brachyrhynchos_American Crow") and
+tags typed by users ("american_crow"). The canonical id is the normalized
+common name ("american crow"); scientific names and any extra aliases from
+the SPECIES_VOCAB file ({"pigeon": ["rock dove", "columba livia"], ...})
+resolve to it as well.
+
+Only trusted labels grow the vocabulary: `add()` / `add_tags()` register
+model output and catalog tags (the taggers, the catalog snapshot).
+`canonical()` / `canonical_tags()` only look labels up, so user input
+(/modify-tags, alert subscriptions, search terms) never adds names to a
+warm container.
+
+`resolve(query)` answers "which species does this search term mean": every
+species with a name or alias containing the (normalized) term. Names are
+indexed by their 1-, 2- and 3-grams, so a term only has to be compared with
+the few names sharing all of its trigrams, and the last RESOLVE_CACHE_SIZE
+results are cached (LRU) until a new name is added. Callers resolve each
+query term once and then compare ids per row instead of doing substring
+tests per row.
+"""
+import json
+import os
+import re
+from collections import OrderedDict, defaultdict
+
+SPECIES_VOCAB = os.getenv("SPECIES_VOCAB")     # optional aliases JSON file
+RESOLVE_CACHE_SIZE = int(os.getenv("RESOLVE_CACHE_SIZE", "4096"))
+GRAM = 3
+_SPACES = re.compile(r"\s+")
+
+
+def normalize(name):
+    """Case-fold, underscores to spaces, collapse whitespace."""
+    return _SPACES.sub(" ", str(name).replace("_", " ")).strip().casefold()
+
+
+def split_label(label):
+    """
+    (common, scientific) for a model label. BirdNET labels are
+    "Scientific name_Common Name"; anything else is just a common name.
+    """
+    sci, sep, common = str(label).partition("_")
+    if sep and common and len(sci.split()) == 2 and sci[:1].isupper():
+        return common, sci
+    return label, None
+
+
+def _grams(text):
+    return {text[i:i + n] for n in range(1, GRAM + 1) for i in range(len(text) - n + 1)}
+
+
+class SpeciesVocabulary:
+    def __init__(self, aliases=None):
+        self.names = {}                   # normalized name/alias -> canonical id
+        self.index = defaultdict(set)     # n-gram -> {normalized name}
+        self._labels = {}                 # raw label -> canonical id (memo)
+        self._resolved = OrderedDict()    # normalized query -> frozenset(ids), LRU
+        for species, extra in (aliases or {}).items():
+            self.add_alias(species, species)
+            for alias in extra:
+                self.add_alias(alias, species)
+
+    @classmethod
+    def from_file(cls, path=SPECIES_VOCAB):
+        if not path:
+            return cls()
+        with open(path, encoding="utf-8") as fh:
+            return cls(json.load(fh))
+
+    def __len__(self):
+        return len(set(self.names.values()))
+
+    def add_alias(self, name, species_id):
+        name, species_id = normalize(name), normalize(species_id)
+        if not name or name in self.names:
+            return
+        self.names[name] = species_id
+        for gram in _grams(name):
+            self.index[gram].add(name)
+        self._resolved.clear()
+
+    def _lookup(self, label):
+        """(canonical id, common name, scientific name) without registering anything."""
+        common, sci = split_label(label)
+        norm = normalize(common)
+        # a known alias ("rock dove", "columba livia") maps onto its species
+        species_id = (self.names.get(norm)
+                      or (sci and self.names.get(normalize(sci)))
+                      or norm)
+        return species_id, norm, sci
+
+    def add(self, label):
+        """Register a model label / catalog tag and return its canonical id."""
+        species_id = self._labels.get(label)
+        if species_id is not None:
+            return species_id
+        species_id, norm, sci = self._lookup(label)
+        self.add_alias(norm, species_id)
+        if sci:
+            self.add_alias(sci, species_id)
+        self._labels[label] = species_id
+        return species_id
+
+    def canonical(self, label):
+        """Canonical id of a label; read-only, safe for user input."""
+        species_id = self._labels.get(label)
+        return species_id if species_id is not None else self._lookup(label)[0]
+
+    def _tags(self, tags, to_id):
+        out = {}
+        for label, count in (tags or {}).items():
+            species_id = to_id(label)
+            out[species_id] = out.get(species_id, 0) + count
+        return out
+
+    def canonical_tags(self, tags):
+        """{label: count} -> {canonical id: count}; labels of one species add up."""
+        return self._tags(tags, self.canonical)
+
+    def add_tags(self, tags):
+        """canonical_tags() for trusted labels, registering each of them."""
+        return self._tags(tags, self.add)
+
+    def resolve(self, query):
+        """Canonical ids of every species with a name containing `query`."""
+        q = normalize(query)
+        if not q:
+            return frozenset()
+        hit = self._resolved.get(q)
+        if hit is not None:
+            self._resolved.move_to_end(q)
+            return hit
+        if len(q) <= GRAM:
+            candidates = self.index.get(q, ())
+        else:
+            postings = sorted((self.index.get(q[i:i + GRAM], set())
+                               for i in range(len(q) - GRAM + 1)), key=len)
+            candidates = set.intersection(*postings) if postings[0] else ()
+        hit = frozenset(self.names[n] for n in candidates if q in n)
+        self._resolved[q] = hit
+        if len(self._resolved) > RESOLVE_CACHE_SIZE:
+            self._resolved.popitem(last=False)
+        return hit
+
+
+_default = None
+
+
+def default_vocabulary():
+    """Process-wide vocabulary (kept across warm invocations)."""
+    global _default
+    if _default is None:
+        _default = SpeciesVocabulary.from_file()
+    return _default
@@ -0,0 +1,124 @@
+"""
+Incrementally maintained catalog statistics.
+
+STATS_TABLE (hash key `species`, range key `bucket`) holds ADD counters
+`items` (files) and `birds` (summed tag counts):
+
+    species=<id>        bucket="d#<YYYY-MM-DD>#<mediaType>"    per day
+    species=__totals__  bucket="t#<id>#<mediaType>"            all time
+
+ALL_SPECIES ("__any__") counts every file whatever its tags, so per-day
+upload volumes are there too. Writers turn a catalog change into counter
+deltas with `item_deltas()` / `change_deltas()` and apply them with
+`apply_deltas()` after their catalog write succeeded. Each counter is a
+plain ADD of its own: the `__any__` and `__totals__` counters are hit by
+every write, and transactions over them fail with TransactionConflict under
+concurrent uploads. jobs/rebuild_stats.py recomputes everything from the
+catalog if the counters ever drift.
+"""
+import os
+from collections import defaultdict
+
+from boto3.dynamodb.conditions import Key
+
+from birdtag_common.species import default_vocabulary
+
+STATS_TABLE = os.getenv("STATS_TABLE")
+TOTALS_KEY = "__totals__"
+ALL_SPECIES = "__any__"
+
+
+def day_bucket(day, media_type):
+    return f"d#{day}#{media_type}"
+
+
+def total_bucket(species, media_type):
+    return f"t#{species}#{media_type}"
+
+
+def parse_bucket(bucket):
+    """("d" | "t", day or species, mediaType)"""
+    kind, rest = bucket.split("#", 1)
+    name, _, media_type = rest.rpartition("#")
+    return kind, name, media_type
+
+
+def item_deltas(item, sign=1, vocab=None):
+    """{(species, bucket): [items, birds]} one catalog row contributes."""
+    deltas = defaultdict(lambda: [0, 0])
+    if not item:
+        return deltas
+    vocab = vocab or default_vocabulary()
+    day = str(item.get("uploadTime") or "unknown")[:10]
+    media_type = item.get("mediaType") or "unknown"
+    tags = vocab.canonical_tags(item.get("tags") if isinstance(item.get("tags"), dict) else {})
+    birds = {sid: int(n) for sid, n in tags.items() if n}
+    birds[ALL_SPECIES] = sum(birds.values())
+    for species, n in birds.items():
+        for key in ((species, day_bucket(day, media_type)),
+                    (TOTALS_KEY, total_bucket(species, media_type))):
+            deltas[key][0] += sign
+            deltas[key][1] += sign * n
+    return deltas
+
+
+def change_deltas(old_item, new_item, vocab=None):
+    """Counter changes for a row going from `old_item` to `new_item` (either may be None)."""
+    deltas = item_deltas(new_item, 1, vocab)
+    for key, (items, birds) in item_deltas(old_item, -1, vocab).items():
+        deltas[key][0] += items
+        deltas[key][1] += birds
+    return {k: v for k, v in deltas.items() if v != [0, 0]}
+
+
+def apply_deltas(dynamodb, deltas, table_name=STATS_TABLE):
+    """ADD the deltas to the counters, one update_item per counter."""
+    table = dynamodb.Table(table_name)
+    for (species, bucket), (items, birds) in sorted(deltas.items()):
+        table.update_item(
+            Key={"species": species, "bucket": bucket},
+            UpdateExpression="ADD #i :i, #b :b",
+            ExpressionAttributeNames={"#i": "items", "#b": "birds"},
+            ExpressionAttributeValues={":i": items, ":b": birds},
+        )
+
+
+def _query_all(table, condition):
+    kwargs = {"KeyConditionExpression": condition}
+    while True:
+        resp = table.query(**kwargs)
+        yield from resp.get("Items", [])
+        if "LastEvaluatedKey" not in resp:
+            return
+        kwargs["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+
+
+def read_totals(table):
+    """(species, mediaType, items, birds) all-time counters; one partition."""
+    for row in _query_all(table, Key("species").eq(TOTALS_KEY)):
+        _, species, media_type = parse_bucket(row["bucket"])
+        yield species, media_type, int(row.get("items", 0)), int(row.get("birds", 0))
+
+
+def read_days(table, species, day_from=None, day_to=None):
+    """(day, mediaType, items, birds) counters of one species, oldest first."""
+    if day_from or day_to:
+        cond = Key("bucket").between(f"d#{day_from or '0000'}", f"d#{day_to or '9999'}~")
+    else:
+        cond = Key("bucket").begins_with("d#")
+    for row in _query_all(table, Key("species").eq(species) & cond):
+        _, day, media_type = parse_bucket(row["bucket"])
+        yield day, media_type, int(row.get("items", 0)), int(row.get("birds", 0))
+
+
+def record_change_safely(dynamodb, old_item, new_item, table_name=STATS_TABLE):
+    """apply_deltas() for writers whose catalog write already succeeded."""
+    if not table_name:
+        return
+    try:
+        deltas = change_deltas(old_item, new_item)
+        if deltas:
+            apply_deltas(dynamodb, deltas, table_name)
+    except Exception as e:
+        # the counters are off until the next jobs/rebuild_stats.py run
+        print(f"[WARN] Could not update stats counters: {e}")
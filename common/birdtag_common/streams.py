@@ -0,0 +1,130 @@
+import time
+from decimal import Decimal
+
+# DynamoDB Streams allows 5 GetRecords calls per second per shard, so callers
+# that poll on every invocation are throttled to one pass per interval.
+MIN_POLL_INTERVAL = 2.0
+MAX_PAGES_PER_SHARD = 20
+
+
+class StreamFollower:
+    """
+    Tail a DynamoDB stream from a Lambda that is not subscribed to it.
+
+    Used to keep warm in-memory copies of a table up to date between
+    invocations. Records come back in the same shape as a Lambda stream
+    event record (eventName, dynamodb.NewImage / OldImage / Keys).
+
+    Call `start()` *before* loading the table so nothing written during the
+    load is missed; re-applying a record that the load already saw is
+    harmless as long as records are applied as "set to NewImage" / "delete".
+    """
+
+    def __init__(self, streams_client, stream_arn, min_interval=MIN_POLL_INTERVAL):
+        self.client = streams_client
+        self.stream_arn = stream_arn
+        self.min_interval = min_interval
+        self.iterators = {}     # shard id -> next shard iterator (None once closed)
+        self.sequences = {}     # shard id -> last sequence number applied
+        self.last_poll = 0.0
+        # every record written before this time has been returned (up to the
+        # stream's own propagation delay)
+        self.synced_at = 0.0
+
+    def _list_shards(self):
+        shards, start = [], None
+        while True:
+            kwargs = {'StreamArn': self.stream_arn}
+            if start:
+                kwargs['ExclusiveStartShardId'] = start
+            desc = self.client.describe_stream(**kwargs)['StreamDescription']
+            shards.extend(desc.get('Shards', []))
+            start = desc.get('LastEvaluatedShardId')
+            if not start:
+                return shards
+
+    def _iterator(self, shard_id, iterator_type):
+        kwargs = {'StreamArn': self.stream_arn, 'ShardId': shard_id,
+                  'ShardIteratorType': iterator_type}
+        if iterator_type == 'AFTER_SEQUENCE_NUMBER':
+            kwargs['SequenceNumber'] = self.sequences[shard_id]
+        return self.client.get_shard_iterator(**kwargs)['ShardIterator']
+
+    def start(self):
+        """Position every open shard at its tip."""
+        started = time.time()
+        for shard in self._list_shards():
+            shard_id = shard['ShardId']
+            closed = 'EndingSequenceNumber' in shard.get('SequenceNumberRange', {})
+            self.iterators[shard_id] = None if closed else self._iterator(shard_id, 'LATEST')
+        self.last_poll = time.time()
+        self.synced_at = started
+
+    def poll(self, force=False):
+        """Return the records written since the last poll, oldest first per shard."""
+        if not force and time.time() - self.last_poll < self.min_interval:
+            return []
+        started = self.last_poll = time.time()
+
+        records, drained = [], True
+        # Shards that appeared since the last poll are children of split or
+        # rotated shards; describe_stream lists parents first.
+        for shard in self._list_shards():
+            shard_id = shard['ShardId']
+            if shard_id not in self.iterators:
+                self.iterators[shard_id] = self._iterator(shard_id, 'TRIM_HORIZON')
+            drained &= self._drain(shard_id, records)
+        if drained:
+            self.synced_at = started
+        return records
+
+    def _drain(self, shard_id, records):
+        """Append the shard's new records; False if MAX_PAGES_PER_SHARD left some behind."""
+        iterator = self.iterators.get(shard_id)
+        drained = False
+        for _ in range(MAX_PAGES_PER_SHARD):
+            if iterator is None:
+                drained = True
+                break
+            try:
+                resp = self.client.get_records(ShardIterator=iterator, Limit=1000)
+            except Exception as e:
+                if 'ExpiredIterator' not in type(e).__name__ and 'ExpiredIterator' not in str(e):
+                    raise
+                # Iterators only live 15 minutes; resume from the last record
+                # we applied, or replay what the stream still retains.
+                kind = 'AFTER_SEQUENCE_NUMBER' if shard_id in self.sequences else 'TRIM_HORIZON'
+                iterator = self._iterator(shard_id, kind)
+                continue
+            page = resp.get('Records', [])
+            if page:
+                self.sequences[shard_id] = page[-1]['dynamodb']['SequenceNumber']
+                records.extend(page)
+            iterator = resp.get('NextShardIterator')
+            if not page:
+                drained = True
+                break
+        self.iterators[shard_id] = iterator
+        return drained
+
+
+def _plain(value):
+    (kind, val), = value.items()
+    if kind == 'N':
+        return Decimal(val)
+    if kind in ('S', 'B', 'BOOL'):
+        return val
+    if kind == 'NULL':
+        return None
+    if kind == 'M':
+        return {k: _plain(v) for k, v in val.items()}
+    if kind == 'L':
+        return [_plain(v) for v in val]
+    if kind == 'NS':
+        return {Decimal(v) for v in val}
+    return set(val)         # SS / BS
+
+
+def plain_image(image):
+    """DynamoDB-JSON stream image -> item as the Table resource returns it."""
+    return {k: _plain(v) for k, v in (image or {}).items()}
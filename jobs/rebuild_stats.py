@@ -0,0 +1,87 @@
+"""
+Recompute the STATS_TABLE counters from the catalog.
+
+The catalog is read with birdtag_common.parallel_scan (Segment /
+TotalSegments slices on a thread pool, with throttling backoff), every row
+is turned into counter values with the same `item_deltas()` the writers
+use, and the stats table is then overwritten: counters are put with their
+recomputed values and counters that no longer exist are deleted. Writes made while the job runs can be
+lost, so run it when uploads are quiet.
+
+    python jobs/rebuild_stats.py --catalog BirdAnalyiser --stats BirdStats
+    python jobs/rebuild_stats.py --catalog BirdAnalyiser --stats BirdStats --segments 16 --dry-run
+"""
+import argparse
+import os
+import sys
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+
+import boto3  # noqa: E402
+
+from birdtag_common.parallel_scan import ParallelScan  # noqa: E402
+from birdtag_common.stats import item_deltas  # noqa: E402
+
+FIELDS = ("uniqueId", "tags", "uploadTime", "mediaType")
+
+
+def compute(table, segments, workers=None):
+    """Counter values of the whole catalog and the number of rows read."""
+    counters = defaultdict(lambda: [0, 0])
+    scan = ParallelScan(table, segments, workers=workers, fields=FIELDS)
+    for item in scan:
+        for key, (items, birds) in item_deltas(item).items():
+            counters[key][0] += items
+            counters[key][1] += birds
+    if scan.stats["throttled"]:
+        print(f"Scan was throttled {scan.stats['throttled']} times")
+    return counters, scan.stats["items"]
+
+
+def existing_keys(stats):
+    kwargs = {"ProjectionExpression": "species, #b", "ExpressionAttributeNames": {"#b": "bucket"}}
+    keys = set()
+    while True:
+        resp = stats.scan(**kwargs)
+        keys.update((row["species"], row["bucket"]) for row in resp.get("Items", []))
+        if "LastEvaluatedKey" not in resp:
+            return keys
+        kwargs["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--catalog", default=os.getenv("TABLE_NAME", "BirdAnalyiser"))
+    ap.add_argument("--stats", default=os.getenv("STATS_TABLE"), required=not os.getenv("STATS_TABLE"))
+    ap.add_argument("--segments", type=int, default=8, help="parallel scan segments")
+    ap.add_argument("--workers", type=int, help="scan threads (default: one per segment)")
+    ap.add_argument("--dry-run", action="store_true", help="compute and report, write nothing")
+    args = ap.parse_args(argv)
+
+    dynamodb = boto3.resource("dynamodb")
+    started = time.time()
+    counters, rows = compute(dynamodb.Table(args.catalog), args.segments, args.workers)
+    counters = {k: v for k, v in counters.items() if v[0] or v[1]}
+    print(f"Scanned {rows} catalog rows in {time.time() - started:.1f}s "
+          f"({args.segments} segments): {len(counters)} counters")
+
+    stats = dynamodb.Table(args.stats)
+    stale = existing_keys(stats) - set(counters)
+    if args.dry_run:
+        print(f"Dry run: would write {len(counters)} counters and delete {len(stale)}")
+        return 0
+
+    with stats.batch_writer() as batch:
+        for (species, bucket), (items, birds) in counters.items():
+            batch.put_item(Item={"species": species, "bucket": bucket, "items": items, "birds": birds})
+        for species, bucket in stale:
+            batch.delete_item(Key={"species": species, "bucket": bucket})
+    print(f"Wrote {len(counters)} counters, deleted {len(stale)} stale ones "
+          f"in {time.time() - started:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,391 @@
+"""
+Reconcile the media buckets with the catalog table.
+
+Failed ingests and partial deletes (/delete-files carries on when an S3
+delete fails) leave objects under `raw_uploads/`, `thumbnails/` and
+`annotated/` that no row points at, and rows whose URLs point at objects
+that are gone. This job finds both without holding either side in memory:
+
+  * the S3 side is `list_objects_v2` pages, which come back sorted by key;
+  * the catalog side is a parallel segmented scan (birdtag_common.parallel_scan)
+    whose object references are sorted externally: chunks of --chunk-size
+    references are sorted in memory, spilled to temp files and merged;
+  * the two sorted streams are merge-joined location by location.
+
+Rows written before keys were decoded from S3 events hold URL-encoded keys
+("my%20bird.jpg", "my+bird.jpg"). Every URL is therefore joined under its
+raw and decoded forms, and a URL is only treated as missing once none of
+its forms exists.
+
+What happens to a mismatch:
+
+    raw upload without a row        re-enqueued as an S3 event (re-ingest):
+                                    photos/videos to --queue-url, audio to
+                                    --audio-queue-url; otherwise only reported
+    thumbnail without a row         deleted, unless its raw upload still
+                                    exists (a re-ingest will reference it)
+    annotated copy without a row    deleted (re-ingest writes a new one)
+    row whose original is missing   row deleted (+ its remaining objects)
+    row whose thumbnail/annotated   that URL removed from the row; video
+    is missing                      thumbnails are expected to be missing
+                                    (the thumbnail Lambda renders images only)
+
+Objects and rows younger than --min-age-minutes are left alone (they may
+be mid-ingest). --dry-run reports what would be done.
+
+    python jobs/reconcile_orphans.py --upload-bucket birdtag-uploads --annot-bucket birdtag-annotated --dry-run
+    python jobs/reconcile_orphans.py --upload-bucket birdtag-uploads --annot-bucket birdtag-annotated \\
+        --queue-url https://sqs.us-east-1.amazonaws.com/123456789012/birdtag-ingest \\
+        --audio-queue-url https://sqs.us-east-1.amazonaws.com/123456789012/birdtag-audio-ingest
+"""
+import argparse
+import heapq
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from urllib.parse import quote_plus, unquote, unquote_plus, urlparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+
+import boto3  # noqa: E402
+from botocore.exceptions import ClientError  # noqa: E402
+
+from birdtag_common.parallel_scan import ParallelScan  # noqa: E402
+from birdtag_common.query_cache import SPECIES_VERSION_TABLE, bump_species_safely  # noqa: E402
+from birdtag_common.species import default_vocabulary  # noqa: E402
+from birdtag_common.stats import record_change_safely  # noqa: E402
+
+URL_FIELDS = ("thumbnailURL", "originalURL", "annotatedURL")
+RAW, THUMB, ANNOT = "raw_uploads/", "thumbnails/", "annotated/"
+DELETE_LIMIT = 1000     # keys per delete_objects call
+SQS_BATCH = 10          # messages per send_message_batch call
+VIDEO_EXT = ("mp4", "avi", "mov")
+MEDIA_EXT = ("jpg", "jpeg", "png") + VIDEO_EXT              # object tagger
+AUDIO_EXT = ("wav", "mp3", "flac", "m4a", "ogg")            # audio tagger
+
+
+def location(bucket, key):
+    # Both streams are ordered by this plain string, not by (bucket, key):
+    # "a-b/..." sorts before "a/...". Within one bucket and prefix it is key
+    # order, which is how list_objects_v2 returns keys (code point order of
+    # str matches the UTF-8 byte order S3 uses).
+    return f"{bucket}/{key}"
+
+
+def url_location(url):
+    """Catalog URL (https://<bucket>.s3.<region>.amazonaws.com/<key>) -> location."""
+    parsed = urlparse(url)
+    return location(parsed.netloc.split(".")[0], parsed.path.lstrip("/"))
+
+
+def url_locations(url):
+    """Every location the URL may mean: as stored, %-decoded and +-decoded."""
+    raw = url_location(url)
+    return list(dict.fromkeys((raw, unquote(raw), unquote_plus(raw))))
+
+
+# ─────────────────────────── sorted streams ───────────────────────────
+def s3_objects(s3, bucket, prefix):
+    """(location, object) of every object under the prefix, in key order."""
+    for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            yield location(bucket, obj["Key"]), obj
+
+
+def _spill(chunk, tmpdir):
+    chunk.sort()
+    fh = tempfile.TemporaryFile("w+", encoding="utf-8", dir=tmpdir)
+    for ref in chunk:
+        fh.write(json.dumps(ref) + "\n")
+    fh.seek(0)
+    return fh
+
+
+def catalog_refs(rows, locations, young_after, chunk_size, tmpdir=None):
+    """
+    (location, uniqueId, field, young, url) for every URL of every row that
+    falls under one of `locations`, sorted by location with an external
+    merge sort (at most `chunk_size` references in memory at a time).
+    """
+    files, chunk = [], []
+    for row in rows:
+        young = str(row.get("uploadTime") or "") >= young_after
+        for field in URL_FIELDS:
+            url = row.get(field)
+            if not url:
+                continue
+            for loc in url_locations(url):
+                if loc.startswith(locations):
+                    chunk.append((loc, row["uniqueId"], field, young, url))
+        if len(chunk) >= chunk_size:
+            files.append(_spill(chunk, tmpdir))
+            chunk = []
+    files.append(_spill(chunk, tmpdir))
+    try:
+        yield from heapq.merge(*((tuple(json.loads(line)) for line in fh) for fh in files))
+    finally:
+        for fh in files:
+            fh.close()
+
+
+class SortedLines:
+    """Membership tests, in ascending order, against a sorted file of names."""
+
+    def __init__(self, fh):
+        self.lines = (line.rstrip("\n") for line in fh)
+        self.current = next(self.lines, None)
+
+    def __contains__(self, name):
+        while self.current is not None and self.current < name:
+            self.current = next(self.lines, None)
+        return self.current == name
+
+
+def merge_join(objects, refs):
+    """(location, object or None, [refs]) for every location on either side."""
+    obj = next(objects, None)
+    ref = next(refs, None)
+    while obj is not None or ref is not None:
+        loc = min(x[0] for x in (obj, ref) if x is not None)
+        found = None
+        if obj is not None and obj[0] == loc:
+            found = obj[1]
+            obj = next(objects, None)
+        group = []
+        while ref is not None and ref[0] == loc:
+            group.append(ref)
+            ref = next(refs, None)
+        yield loc, found, group
+
+
+# ─────────────────────────────── actions ───────────────────────────────
+class Actions:
+    """Batched deletes / re-enqueues / row fixes; only counted with dry_run."""
+
+    def __init__(self, s3, sqs, dynamodb, table, queue_url=None, dry_run=False, audio_queue_url=None):
+        self.s3, self.sqs, self.dynamodb, self.table = s3, sqs, dynamodb, table
+        self.versions_table = dynamodb.Table(SPECIES_VERSION_TABLE) if SPECIES_VERSION_TABLE else None
+        self.queues = {ext: queue_url for ext in MEDIA_EXT}
+        self.queues.update({ext: audio_queue_url for ext in AUDIO_EXT})
+        self.dry_run = dry_run
+        self.counts = Counter()
+        self.samples = {}
+        self.deletes = {}        # bucket -> [key]
+        self.messages = {}       # queue url -> [message body]
+
+    def exists(self, loc):
+        bucket, key = loc.split("/", 1)
+        try:
+            self.s3.head_object(Bucket=bucket, Key=key)
+            return True
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("404", "NoSuchKey", "NotFound"):
+                raise
+            return False
+
+    def found_elsewhere(self, url, loc):
+        """Whether another form of the URL than `loc` names an existing object."""
+        return any(other != loc and self.exists(other) for other in url_locations(url))
+
+    def note(self, what, detail):
+        self.counts[what] += 1
+        self.samples.setdefault(what, detail)
+
+    def delete_object(self, loc):
+        bucket, key = loc.split("/", 1)
+        self.note("objects_deleted", loc)
+        if self.dry_run:
+            return
+        pending = self.deletes.setdefault(bucket, [])
+        pending.append(key)
+        if len(pending) >= DELETE_LIMIT:
+            self._flush_deletes(bucket)
+
+    def _flush_deletes(self, bucket):
+        keys, self.deletes[bucket] = self.deletes.get(bucket, []), []
+        if keys:
+            resp = self.s3.delete_objects(Bucket=bucket, Delete={
+                "Objects": [{"Key": k} for k in keys], "Quiet": True})
+            for err in resp.get("Errors", []):
+                print(f"[WARN] Could not delete {bucket}/{err.get('Key')}: {err.get('Message')}")
+
+    def requeue(self, loc, obj):
+        """Send an S3 notification for the object to the queue of the tagger for its type."""
+        bucket, key = loc.split("/", 1)
+        queue_url = self.queues.get(key.rsplit(".", 1)[-1].lower())
+        if not queue_url:
+            self.note("uploads_unreferenced", loc)
+            return
+        self.note("uploads_requeued", loc)
+        if self.dry_run:
+            return
+        modified = obj.get("LastModified")
+        messages = self.messages.setdefault(queue_url, [])
+        messages.append({"Records": [{
+            "eventSource": "aws:s3",
+            "eventName": "ObjectCreated:Put",
+            "eventTime": modified.isoformat() if modified else None,
+            "s3": {"bucket": {"name": bucket},
+                   "object": {"key": quote_plus(key, safe="/"), "eTag": obj.get("ETag", "").strip('"'),
+                              "size": obj.get("Size")}},
+        }]})
+        if len(messages) >= SQS_BATCH:
+            self._flush_messages(queue_url)
+
+    def _flush_messages(self, queue_url):
+        batch, self.messages[queue_url] = self.messages.get(queue_url, []), []
+        if batch:
+            resp = self.sqs.send_message_batch(QueueUrl=queue_url, Entries=[
+                {"Id": str(n), "MessageBody": json.dumps(body)} for n, body in enumerate(batch)])
+            for failed in resp.get("Failed", []):
+                print(f"[WARN] Could not re-enqueue: {failed}")
+
+    def delete_row(self, unique_id, original_url):
+        """Drop a row whose original is gone, plus whatever objects it still has."""
+        self.note("rows_deleted", unique_id)
+        if self.dry_run:
+            return
+        try:
+            old = self.table.delete_item(
+                Key={"uniqueId": unique_id},
+                # a re-ingest may have repointed the row meanwhile
+                ConditionExpression="originalURL = :url",
+                ExpressionAttributeValues={":url": original_url},
+                ReturnValues="ALL_OLD",
+            ).get("Attributes")
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            return
+        if not old:
+            return
+        for field in ("thumbnailURL", "annotatedURL"):
+            for loc in url_locations(old[field]) if old.get(field) else ():
+                if self.exists(loc):
+                    self.delete_object(loc)
+        record_change_safely(self.dynamodb, old, None)
+        bump_species_safely(self.versions_table,
+                            set(default_vocabulary().canonical_tags(old.get("tags") or {})))
+
+    def clear_field(self, unique_id, field, url):
+        """Remove a URL that points at a missing object (if the row still has it)."""
+        self.note(f"{field}_cleared", unique_id)
+        if self.dry_run:
+            return
+        try:
+            self.table.update_item(
+                Key={"uniqueId": unique_id},
+                UpdateExpression="REMOVE #f",
+                ConditionExpression="#f = :url",
+                ExpressionAttributeNames={"#f": field},
+                ExpressionAttributeValues={":url": url},
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+
+    def flush(self):
+        if self.dry_run:
+            return
+        for bucket in list(self.deletes):
+            self._flush_deletes(bucket)
+        for queue_url in list(self.messages):
+            self._flush_messages(queue_url)
+
+
+# ──────────────────────────────── job ────────────────────────────────
+def reconcile(s3, sqs, dynamodb, table, upload_bucket, annot_bucket, queue_url=None,
+              min_age_minutes=60, segments=8, chunk_size=200_000, dry_run=False,
+              audio_queue_url=None):
+    cutoff = datetime.now(timezone.utc) - timedelta(minutes=min_age_minutes)
+    young_after = cutoff.isoformat()
+    prefixes = [(upload_bucket, RAW), (upload_bucket, THUMB), (annot_bucket, ANNOT)]
+    locations = tuple(location(b, p) for b, p in prefixes)
+
+    objects = heapq.merge(*(s3_objects(s3, b, p) for b, p in prefixes), key=lambda x: x[0])
+    rows = ParallelScan(table, segments, fields=("uniqueId", "uploadTime") + URL_FIELDS)
+    refs = catalog_refs(rows, locations, young_after, chunk_size)
+    actions = Actions(s3, sqs, dynamodb, table, queue_url, dry_run, audio_queue_url)
+    handled = set()          # (uniqueId, field) already acted on under another form
+
+    # raw uploads are listed before thumbnails of the same bucket ("r" < "t"),
+    # so the orphaned ones can be spilled in order and joined lazily later
+    raw_orphans = tempfile.TemporaryFile("w+", encoding="utf-8")
+    raw_seen = None
+    raw_prefix = location(upload_bucket, RAW)
+    thumb_prefix = location(upload_bucket, THUMB)
+
+    for loc, obj, group in merge_join(objects, refs):
+        if obj is not None and group:
+            actions.counts["matched"] += 1
+            continue
+        if obj is not None:
+            if obj["LastModified"] >= cutoff:
+                actions.counts["skipped_young"] += 1
+            elif loc.startswith(raw_prefix):
+                raw_orphans.write(loc[len(raw_prefix):] + "\n")
+                actions.requeue(loc, obj)
+            elif loc.startswith(thumb_prefix):
+                if raw_seen is None:
+                    raw_orphans.seek(0)
+                    raw_seen = SortedLines(raw_orphans)
+                if loc[len(thumb_prefix):] in raw_seen:
+                    actions.note("thumbnails_kept_for_requeue", loc)
+                else:
+                    actions.delete_object(loc)
+            else:
+                actions.delete_object(loc)
+            continue
+        for _, unique_id, field, young, url in group:
+            if young:
+                actions.counts["skipped_young"] += 1
+            elif (unique_id, field) in handled:
+                continue
+            elif actions.found_elsewhere(url, loc):
+                # another (encoded / decoded) form of the key exists
+                actions.counts["matched_other_form"] += 1
+                handled.add((unique_id, field))
+            elif field == "thumbnailURL" and url.rsplit(".", 1)[-1].lower() in VIDEO_EXT:
+                actions.counts["video_thumbnails_absent"] += 1
+            elif field == "originalURL":
+                handled.add((unique_id, field))
+                actions.delete_row(unique_id, url)
+            else:
+                handled.add((unique_id, field))
+                actions.clear_field(unique_id, field, url)
+    actions.flush()
+    raw_orphans.close()
+    return actions
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--catalog", default=os.getenv("TABLE_NAME", "BirdAnalyiser"))
+    ap.add_argument("--upload-bucket", required=True, help="bucket with raw_uploads/ and thumbnails/")
+    ap.add_argument("--annot-bucket", required=True, help="bucket with annotated/")
+    ap.add_argument("--queue-url", help="object tagger queue for re-enqueuing unreferenced photos/videos")
+    ap.add_argument("--audio-queue-url", help="audio tagger queue for re-enqueuing unreferenced audio")
+    ap.add_argument("--min-age-minutes", type=int, default=60)
+    ap.add_argument("--segments", type=int, default=8, help="parallel scan segments")
+    ap.add_argument("--chunk-size", type=int, default=200_000, help="references sorted in memory per spill")
+    ap.add_argument("--dry-run", action="store_true")
+    args = ap.parse_args(argv)
+
+    dynamodb = boto3.resource("dynamodb")
+    started = time.time()
+    actions = reconcile(boto3.client("s3"), boto3.client("sqs"), dynamodb, dynamodb.Table(args.catalog),
+                        args.upload_bucket, args.annot_bucket, args.queue_url, args.min_age_minutes,
+                        args.segments, args.chunk_size, args.dry_run, args.audio_queue_url)
+    print(f"{'Dry run: ' if args.dry_run else ''}reconciled in {time.time() - started:.1f}s")
+    for what, n in sorted(actions.counts.items()):
+        example = actions.samples.get(what)
+        print(f"  {what:32} {n:>8}" + (f"   e.g. {example}" if example else ""))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,11 @@
-import os, json, argparse
+import os, json, argparse, queue, shutil, subprocess, threading
 import cv2
-from ultralytics import YOLO
+import numpy as np
 from collections import defaultdict, Counter
-import supervision as sv
+from birdtag_common.metrics import stage, incr
+
+# ultralytics (torch) and supervision take seconds to import; they are
+# imported where they are first needed so cold starts only pay for them then.
 
 
 # ─────────────────────────  CONFIG  ──────────────────────────
@@ -14,13 +17,21 @@ os.makedirs(OUT_DIR, exist_ok=True)
 
 # ────────────────────────  MODEL CACHE  ──────────────────────
 _model = None
-def get_model():
-    """Load YOLOv8 model once (CPU)."""
-    global _model
-    if _model is None:
-        print(f"[init] loading model ⇒ {MODEL_PATH}")
-        _model = YOLO(MODEL_PATH).to("cpu")
-        _model.fuse()
+_model_path = None
+def get_model(path=None, reload=False):
+    """
+    Load YOLOv8 weights once (CPU); load again if `path` changes or when
+    `reload` says the file at `path` was replaced.
+    """
+    global _model, _model_path
+    path = path or _model_path or MODEL_PATH
+    if _model is None or path != _model_path or reload:
+        from ultralytics import YOLO
+        print(f"[init] loading model ⇒ {path}")
+        with stage("model_load"):
+            model = YOLO(path).to("cpu")
+            model.fuse()
+        _model, _model_path = model, path
     return _model
 
 # ─────────────────────────  HELPERS  ─────────────────────────
@@ -36,33 +47,205 @@ def draw_boxes(frame, boxes, scores, names):
                     (int(x1), int(max(0, y1)-6)),
                     cv2.FONT_HERSHEY_SIMPLEX, 0.55, (0, 255, 0), 2)
 
+# ─────────────────────  INFERENCE PLANNING  ──────────────────
+# Large photos are not decoded at full size up front: they are decoded at a
+# reduced scale (JPEG DCT scaling via IMREAD_REDUCED_*) with the longest side
+# still >= WORK_SIDE, and that image gets one cheap pass at COARSE_CONF.
+# Only where that pass is unsure (a low-confidence or small box) is the full
+# image decoded and cut into TILE_SIZE tiles, which are run as one batch;
+# tile and coarse boxes are merged with class-aware NMS. The annotated copy
+# of a large photo is written at the reduced scale.
+TILE_MODE    = os.getenv("TILE_MODE", "auto")          # off | auto | full
+TILE_TRIGGER = int(os.getenv("TILE_TRIGGER", 2000))    # plan images whose longest side exceeds this
+WORK_SIDE    = int(os.getenv("WORK_SIDE", 1600))       # min longest side of the reduced decode
+TILE_SIZE    = int(os.getenv("TILE_SIZE", 640))
+TILE_OVERLAP = float(os.getenv("TILE_OVERLAP", 0.2))
+MAX_TILES    = int(os.getenv("MAX_TILES", 12))         # bounds latency of one photo
+COARSE_CONF  = float(os.getenv("COARSE_CONF", 0.2))
+SMALL_BOX    = int(os.getenv("SMALL_BOX", 48))         # coarse boxes narrower than this (px) are re-checked
+NMS_IOU      = float(os.getenv("NMS_IOU", 0.5))
+
+_REDUCED = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4,
+            8: cv2.IMREAD_REDUCED_COLOR_8}
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def image_size(path):
+    """(width, height) from a JPEG / PNG header without decoding; None if unknown."""
+    with open(path, "rb") as fh:
+        head = fh.read(26)
+        if head[:8] == b"\x89PNG\r\n\x1a\n":
+            return int.from_bytes(head[16:20], "big"), int.from_bytes(head[20:24], "big")
+        if head[:2] != b"\xff\xd8":
+            return None
+        fh.seek(2)
+        while True:
+            marker = fh.read(2)
+            if len(marker) < 2 or marker[0] != 0xFF:
+                return None
+            if marker[1] in (0xD8, 0x01) or 0xD0 <= marker[1] <= 0xD7:
+                continue
+            length = int.from_bytes(fh.read(2), "big")
+            if marker[1] in _JPEG_SOF:
+                seg = fh.read(5)
+                return int.from_bytes(seg[3:5], "big"), int.from_bytes(seg[1:3], "big")
+            fh.seek(length - 2, 1)
+
+
+def reduction_for(size, work_side=WORK_SIDE):
+    """Largest decode reduction (1, 2, 4, 8) keeping the longest side >= work_side."""
+    factor = 1
+    while factor < 8 and max(size) / (factor * 2) >= work_side:
+        factor *= 2
+    return factor
+
+
+def nms(boxes, scores, classes, iou=NMS_IOU):
+    """Class-aware greedy non-maximum suppression; indices kept, best first."""
+    x1, y1, x2, y2 = boxes.T
+    area = (x2 - x1).clip(0) * (y2 - y1).clip(0)
+    order, keep = np.argsort(-scores), []
+    while order.size:
+        i, rest = order[0], order[1:]
+        keep.append(i)
+        w = (np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest])).clip(0)
+        h = (np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest])).clip(0)
+        overlap = w * h / (area[i] + area[rest] - w * h + 1e-9)
+        order = rest[(overlap <= iou) | (classes[rest] != classes[i])]
+    return np.array(keep, dtype=int)
+
+
+def _arrays(res):
+    b = res.boxes
+    return b.xyxy.cpu().numpy(), b.conf.cpu().numpy(), b.cls.cpu().numpy()
+
+
+def _tiles(shape, centers, mode):
+    """(x, y, side) tiles of a full-size image: around `centers`, or a grid for mode 'full'."""
+    H, W = shape[:2]
+    side = min(TILE_SIZE, W, H)
+    step = max(1, int(side * (1 - TILE_OVERLAP)))
+    if mode == "full":
+        # same MAX_TILES bound as the refine path: widen the stride until the grid fits
+        nx, ny = (-(-max(n - side, 0) // step) + 1 for n in (W, H))
+        while nx * ny > MAX_TILES and (nx > 1 or ny > 1):
+            if nx >= ny:
+                nx -= 1
+            else:
+                ny -= 1
+        xs = [(W - side) * i // max(nx - 1, 1) for i in range(nx)]
+        ys = [(H - side) * i // max(ny - 1, 1) for i in range(ny)]
+        return sorted({(x, y, side) for x in xs for y in ys})
+    tiles, margin = [], side * TILE_OVERLAP / 2
+    for cx, cy, need in centers:
+        t = max(side, min(int(need), W, H))
+        if any(x + margin <= cx <= x + s - margin and y + margin <= cy <= y + s - margin
+               for x, y, s in tiles):
+            continue        # already well inside a tile
+        x = int(min(max(cx - t / 2, 0), W - t))
+        y = int(min(max(cy - t / 2, 0), H - t))
+        tiles.append((x, y, t))
+        if len(tiles) >= MAX_TILES:
+            break
+    return tiles
+
+
+def _refine(path, img, dets, conf_thr, mode):
+    """Re-check the uncertain parts of a reduced decode on full-resolution tiles."""
+    boxes, scores, classes = dets
+    confident = scores > conf_thr
+    width = boxes[:, 2] - boxes[:, 0]
+    unsure = (~confident & (scores >= COARSE_CONF)) | (confident & (width < SMALL_BOX))
+    if mode != "full" and not unsure.any():
+        return boxes[confident], scores[confident], classes[confident]
+
+    with stage("decode_full"):
+        full = cv2.imread(path)
+    scale = max(full.shape[:2]) / max(img.shape[:2])
+    centers = []
+    if mode != "full":      # the full grid does not look at the coarse boxes
+        order = np.argsort(-scores[unsure])
+        centers = [((b[0] + b[2]) / 2 * scale, (b[1] + b[3]) / 2 * scale,
+                    max(b[2] - b[0], b[3] - b[1]) * scale * 1.5)
+                   for b in boxes[unsure][order]]
+    tiles = _tiles(full.shape, centers, mode)
+    incr("tiles", len(tiles))
+
+    merged = [(boxes[confident], scores[confident], classes[confident])]
+    if tiles:
+        with stage("inference_tiles"):
+            results = get_model()([full[y:y + t, x:x + t] for x, y, t in tiles],
+                                  verbose=False, conf=conf_thr)
+        H, W = full.shape[:2]
+        for (x, y, t), res in zip(tiles, results):
+            tb, ts, tc = _arrays(res)
+            # a box cut by an inner tile edge is seen whole by a neighbour / the coarse pass
+            cut = (((tb[:, 0] < 2) & (x > 0)) | ((tb[:, 1] < 2) & (y > 0))
+                   | ((tb[:, 2] > t - 2) & (x + t < W)) | ((tb[:, 3] > t - 2) & (y + t < H)))
+            keep = (ts > conf_thr) & ~cut
+            merged.append(((tb[keep] + [x, y, x, y]) / scale, ts[keep], tc[keep]))
+    boxes, scores, classes = (np.concatenate(parts) for parts in zip(*merged))
+    keep = nms(boxes, scores, classes)
+    return boxes[keep], scores[keep], classes[keep]
+
+
+def detect_images(paths, conf_thr=CONF_THR, tile_mode=None):
+    """
+    Decode and run the model on several images with one batched call (plus
+    one tile batch per large photo that needs it). Returns
+    [(image as decoded, boxes, scores, class ids, full-size / decoded scale)].
+    """
+    tile_mode = tile_mode or TILE_MODE
+    imgs, planned = [], []
+    for path in paths:
+        size = image_size(path) if tile_mode != "off" else None
+        plan = bool(size) and max(size) > TILE_TRIGGER
+        factor = reduction_for(size) if plan else 1
+        with stage("decode"):
+            img = cv2.imread(path, _REDUCED.get(factor, cv2.IMREAD_COLOR))
+        if img is None:
+            raise RuntimeError(f"Cannot read {path}")
+        imgs.append(img)
+        planned.append((plan, max(size) / max(img.shape[:2]) if plan else 1.0))
+        if factor > 1:
+            incr("reduced_decodes")
+
+    model = get_model()
+    with stage("inference"):
+        results = model(imgs, verbose=False, conf=min(COARSE_CONF, conf_thr))
+    incr("images", len(imgs))
+
+    out = []
+    for path, img, res, (plan, scale) in zip(paths, imgs, results, planned):
+        boxes, scores, classes = _arrays(res)
+        if plan:
+            boxes, scores, classes = _refine(path, img, (boxes, scores, classes), conf_thr, tile_mode)
+        else:
+            keep = scores > conf_thr
+            boxes, scores, classes = boxes[keep], scores[keep], classes[keep]
+        out.append((img, boxes, scores, classes, scale))
+    return out
+
+
 # ───────────────────────  IMAGE  MODE  ───────────────────────
-def tag_image(path, conf_thr=CONF_THR):
-    img = cv2.imread(path)
-    if img is None:
-        raise RuntimeError(f"Cannot read {path}")
-
-    res      = get_model()(img, verbose=False)[0]
-    conf_arr = res.boxes.conf.cpu().numpy()
-    keep     = conf_arr > conf_thr
-    boxes    = res.boxes.xyxy.cpu().numpy()[keep]
-    scores   = conf_arr[keep]
-    classes  = res.boxes.cls.cpu().numpy()[keep]
+def _finish_image(path, img, boxes, scores, classes, out_dir):
+    """Draw boxes, write annotated copy + JSON meta."""
     names    = [get_model().names[int(c)] for c in classes]
 
     draw_boxes(img, boxes, scores, names)
 
     base = os.path.basename(path)
     stem, ext = os.path.splitext(base) 
-    out_path = os.path.join(OUT_DIR, f"{stem}_annotated{ext}")
+    out_path = os.path.join(out_dir or OUT_DIR, f"{stem}_annotated{ext}")
 
     # Set default JPEG quality or use PNG compression
-    if ext.lower() in [".jpg", ".jpeg"]:
-        cv2.imwrite(out_path, img, [cv2.IMWRITE_JPEG_QUALITY, 90])
-    elif ext.lower() == ".png":
-        cv2.imwrite(out_path, img, [cv2.IMWRITE_PNG_COMPRESSION, 3])
-    else:
-        cv2.imwrite(out_path, img)
+    with stage("encode"):
+        if ext.lower() in [".jpg", ".jpeg"]:
+            cv2.imwrite(out_path, img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        elif ext.lower() == ".png":
+            cv2.imwrite(out_path, img, [cv2.IMWRITE_PNG_COMPRESSION, 3])
+        else:
+            cv2.imwrite(out_path, img)
 
     # count boxes per species
     counts = dict(Counter(names))
@@ -80,6 +263,23 @@ def tag_image(path, conf_thr=CONF_THR):
 
     dump_json(out_path + ".json", meta)
     print(f"Image done → {out_path}")
+    return meta
+
+
+def tag_images(paths, conf_thr=CONF_THR, out_dir=None, tile_mode=None):
+    """
+    Tag several images with a single batched model call (large photos are
+    planned, see INFERENCE PLANNING). `out_dir` may be one directory or a
+    list with one per image.
+    """
+    out_dirs = out_dir if isinstance(out_dir, (list, tuple)) else [out_dir] * len(paths)
+    return [_finish_image(path, img, boxes, scores, classes, d)
+            for path, (img, boxes, scores, classes, _), d
+            in zip(paths, detect_images(paths, conf_thr, tile_mode), out_dirs)]
+
+
+def tag_image(path, conf_thr=CONF_THR, out_dir=None, tile_mode=None):
+    return tag_images([path], conf_thr, out_dir, tile_mode)[0]
 
 
 def _fourcc_for(ext: str) -> str:
@@ -87,25 +287,141 @@ def _fourcc_for(ext: str) -> str:
     return {"avi": "XVID", "mov": "mp4v", "mp4": "mp4v"}.get(ext.lstrip("."), "mp4v")
 
 
+# ──────────────────────  VIDEO  ENCODING  ────────────────────
+FFMPEG         = os.getenv("FFMPEG_PATH") or shutil.which("ffmpeg")
+VIDEO_CRF      = os.getenv("VIDEO_CRF", "26")
+VIDEO_PRESET   = os.getenv("VIDEO_PRESET", "veryfast")
+VIDEO_MAX_SIDE = int(os.getenv("VIDEO_MAX_SIDE", 0))     # 0 = keep the source resolution
+FRAME_BUFFERS  = int(os.getenv("FRAME_BUFFERS", 4))
+
+
+class FrameWriter:
+    """
+    Writes annotated frames on a background thread, piping raw BGR frames
+    into ffmpeg (H.264, yuv420p) or, without ffmpeg, into cv2.VideoWriter.
+    Frames live in a fixed pool of pre-allocated buffers: take one with
+    `buffer()`, fill it, `write()` it; it returns to the pool once encoded.
+    """
+
+    def __init__(self, path, width, height, fps, buffers=FRAME_BUFFERS):
+        self.free = queue.Queue()
+        for _ in range(buffers):
+            self.free.put(np.empty((height, width, 3), np.uint8))
+        self.todo = queue.Queue()
+        self.error = None
+        self.proc = self.vw = None
+        if FFMPEG:
+            ext = os.path.splitext(path)[1].lower()
+            cmd = [FFMPEG, "-loglevel", "error", "-y",
+                   "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{width}x{height}",
+                   "-r", f"{fps:.3f}", "-i", "-", "-an",
+                   "-c:v", "libx264", "-preset", VIDEO_PRESET, "-crf", VIDEO_CRF,
+                   "-pix_fmt", "yuv420p"]
+            if ext in (".mp4", ".mov"):
+                cmd += ["-movflags", "+faststart"]     # playable while downloading
+            self.proc = subprocess.Popen(cmd + [path], stdin=subprocess.PIPE,
+                                         stderr=subprocess.PIPE)
+        else:
+            print("[WARN] ffmpeg not found, writing with cv2.VideoWriter")
+            self.vw = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*_fourcc_for(path.rsplit(".", 1)[-1])),
+                                      fps, (width, height))
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def buffer(self):
+        if self.error:
+            raise self.error
+        return self.free.get()
+
+    def write(self, frame):
+        self.todo.put(frame)
+
+    def _run(self):
+        while True:
+            frame = self.todo.get()
+            if frame is None:
+                return
+            try:
+                if self.error is None:
+                    if self.proc:
+                        self.proc.stdin.write(memoryview(frame).cast("B"))
+                    else:
+                        self.vw.write(frame)
+            except Exception as e:      # surfaced by buffer() / close()
+                self.error = e
+            self.free.put(frame)
+
+    def close(self):
+        self.todo.put(None)
+        self.thread.join()
+        if self.proc:
+            self.proc.stdin.close()
+            err = self.proc.stderr.read().decode(errors="replace")
+            if self.proc.wait() != 0:      # more useful than the broken pipe
+                self.error = RuntimeError(f"ffmpeg failed: {err.strip()}")
+        else:
+            self.vw.release()
+        if self.error:
+            raise self.error
+
+
+TRACK_MIN_FRAMES = int(os.getenv("TRACK_MIN_FRAMES", 5))    # shorter tracks are not individuals
+MAX_TRACKS       = int(os.getenv("MAX_TRACKS", 100))         # summaries kept per video (longest)
+
+
+def track_summaries(tracks, accum, locked, fps):
+    """
+    ([{id, species, first, last, start, end, frames, peak}], {species: n})
+    from per-track stats: first/last frame (start/end in seconds), frames
+    seen and peak confidence. Tracks of at least TRACK_MIN_FRAMES frames
+    count as individuals; the MAX_TRACKS longest are kept, by first frame.
+    """
+    summaries = []
+    for tid, t in tracks.items():
+        if t["frames"] < TRACK_MIN_FRAMES:
+            continue
+        species = locked.get(tid) or max(accum[tid], key=accum[tid].get)
+        summaries.append({"id": int(tid), "species": species,
+                          "first": t["first"], "last": t["last"],
+                          "start": round(t["first"] / fps, 2), "end": round(t["last"] / fps, 2),
+                          "frames": t["frames"], "peak": round(t["peak"], 3)})
+    individuals = Counter(t["species"] for t in summaries)
+    summaries = sorted(summaries, key=lambda t: -t["frames"])[:MAX_TRACKS]
+    return sorted(summaries, key=lambda t: t["first"]), dict(individuals)
+
+
+def _even(n):
+    return max(2, int(n) // 2 * 2)      # yuv420p needs even dimensions
+
+
 # ───────────────────────  VIDEO  MODE  ───────────────────────
-def tag_video(path, conf_thr=0.7, out_fps=24, lock_after=10):
+def tag_video(path, conf_thr=0.7, out_fps=None, lock_after=10, out_dir=None, max_side=None):
+    """
+    Track and tag birds in a video and write an annotated copy at the source
+    frame rate (or `out_fps`) and resolution, downscaled so the longest side
+    is at most `max_side` / VIDEO_MAX_SIDE when set.
+    """
+    import supervision as sv      # only the video path needs tracking
+
     cap = cv2.VideoCapture(path)
     if not cap.isOpened():
         raise RuntimeError(f"Cannot open video: {path}")
 
     W, H = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    fps = out_fps or cap.get(cv2.CAP_PROP_FPS) or 24
+    max_side = max_side if max_side is not None else VIDEO_MAX_SIDE
+    scale = min(1.0, max_side / max(W, H)) if max_side else 1.0
+    w, h = _even(W * scale), _even(H * scale)
+    resize = (w, h) != (W, H)
+
     base, stem = os.path.basename(path), os.path.splitext(os.path.basename(path))[0]
     out_ext = os.path.splitext(path)[1].lower()       # keep .mp4 / .avi / .mov
-    out_mp  = os.path.join(OUT_DIR, f"{stem}_annotated{out_ext}")
-    vw = cv2.VideoWriter(
-        out_mp,
-        cv2.VideoWriter_fourcc(*_fourcc_for(out_ext)),
-        out_fps,
-        (W, H),
-    )
+    out_mp  = os.path.join(out_dir or OUT_DIR, f"{stem}_annotated{out_ext}")
+    writer  = FrameWriter(out_mp, w, h, fps)
+    src     = np.empty((H, W, 3), np.uint8) if resize else None
 
     model   = get_model()
-    tracker = sv.ByteTrack(frame_rate=out_fps)
+    tracker = sv.ByteTrack(frame_rate=int(round(fps)))
     box_annot  = sv.BoxAnnotator(color_lookup=sv.ColorLookup.TRACK)
     label_annot = sv.LabelAnnotator(text_thickness=2, text_position=sv.Position.TOP_LEFT)
 
@@ -116,39 +432,62 @@ def tag_video(path, conf_thr=0.7, out_fps=24, lock_after=10):
     # keep max-simultaneous counts per species
     max_frame_counts: Counter = Counter()
 
-    while True:
-        ok, frame = cap.read()
-        if not ok:
-            break
-
-        res   = model(frame, verbose=False)[0]
-        confs = res.boxes.conf.cpu().numpy()
-        keep  = confs > conf_thr
-        dets  = sv.Detections.from_ultralytics(res)[keep]
-        dets  = tracker.update_with_detections(detections=dets)
-
-        final_labels = []
-        for tid, cls_idx, conf in zip(dets.tracker_id, dets.class_id, dets.confidence):
-            sp = model.names[int(cls_idx)]
-            if tid not in locked:
-                accum[tid][sp] += float(conf)
-                if sum(accum[tid].values()) >= lock_after:
-                    locked[tid] = max(accum[tid], key=accum[tid].get)
-            final_labels.append(locked.get(tid, sp))
-
-        # --------- update per-frame max counts -------------
-        frame_counts = Counter(final_labels)
-        for k, v in frame_counts.items():
-            if v > max_frame_counts[k]:
-                max_frame_counts[k] = v
-
-        # -------------- annotate & write -------------------
-        box_annot.annotate(frame, detections=dets)
-        label_annot.annotate(frame, detections=dets, labels=final_labels)
-        vw.write(frame)
-
-    cap.release()
-    vw.release()
+    # per-track first/last frame, frames seen and peak confidence
+    tracks: dict[int, dict] = {}
+
+    n_frames = 0
+    try:
+        while True:
+            frame = writer.buffer()
+            with stage("decode"):
+                # decode straight into a pooled buffer (or the one source buffer)
+                target = src if resize else frame
+                ok, got = cap.read(target)
+                if ok and got is not target:
+                    np.copyto(target, got)
+                if ok and resize:
+                    cv2.resize(src, (w, h), dst=frame, interpolation=cv2.INTER_AREA)
+            if not ok:
+                writer.free.put(frame)
+                break
+            n_frames += 1
+
+            with stage("inference"):
+                res   = model(frame, verbose=False)[0]
+            confs = res.boxes.conf.cpu().numpy()
+            keep  = confs > conf_thr
+            dets  = sv.Detections.from_ultralytics(res)[keep]
+            dets  = tracker.update_with_detections(detections=dets)
+
+            final_labels = []
+            for tid, cls_idx, conf in zip(dets.tracker_id, dets.class_id, dets.confidence):
+                sp = model.names[int(cls_idx)]
+                if tid not in locked:
+                    accum[tid][sp] += float(conf)
+                    if sum(accum[tid].values()) >= lock_after:
+                        locked[tid] = max(accum[tid], key=accum[tid].get)
+                final_labels.append(locked.get(tid, sp))
+                t = tracks.setdefault(tid, {"first": n_frames - 1, "frames": 0, "peak": 0.0})
+                t["last"] = n_frames - 1
+                t["frames"] += 1
+                t["peak"] = max(t["peak"], float(conf))
+
+            # --------- update per-frame max counts -------------
+            frame_counts = Counter(final_labels)
+            for k, v in frame_counts.items():
+                if v > max_frame_counts[k]:
+                    max_frame_counts[k] = v
+
+            # -------------- annotate & hand to the writer ------
+            with stage("annotate"):
+                box_annot.annotate(frame, detections=dets)
+                label_annot.annotate(frame, detections=dets, labels=final_labels)
+            writer.write(frame)
+    finally:
+        cap.release()
+        with stage("encode"):
+            writer.close()
+    incr("video_frames", n_frames)
 
     print(f"Detected {sum(max_frame_counts.values())} boxes: {max_frame_counts}")
 
@@ -157,13 +496,18 @@ def tag_video(path, conf_thr=0.7, out_fps=24, lock_after=10):
     else:
         detected = True
 
+    summaries, individuals = track_summaries(tracks, accum, locked, fps)
+
     meta = {
-        "detected" : detected,
-        "file"     : base,
-        "file_type": os.path.splitext(base)[1][1:],
-        "type"     : "video",
-        "tags"     : dict(max_frame_counts)  # highest simultaneous count
+        "detected"   : detected,
+        "file"       : base,
+        "file_type"  : os.path.splitext(base)[1][1:],
+        "type"       : "video",
+        "tags"       : dict(max_frame_counts),  # highest simultaneous count
+        "individuals": individuals,             # distinct tracks per species
+        "tracks"     : summaries,
     }
     dump_json(out_mp + ".json", meta)
     print(f"Video done → {out_mp}")
+    return meta
 
@@ -1,119 +1,221 @@
-import os, tempfile, json, boto3, importlib
-from datetime import datetime, timezone
+import os, tempfile, boto3
 from decimal import Decimal
 import cv2
+import image_video_tagger as iv
+from birdtag_common.item_keys import media_item_id, event_time, already_ingested, upsert_item
+from birdtag_common.s3_events import iter_s3_records, until_low_on_time, respond
+from birdtag_common.metrics import instrumented, instrument_client, stage, incr
+from birdtag_common.model_cache import LatestModelFiles
+from birdtag_common.species import default_vocabulary
+from birdtag_common.query_cache import bump_species_safely, SPECIES_VERSION_TABLE
+from birdtag_common.stats import record_change_safely
 
 # ─── Environment ───────────────────────────────────────────────────────────────
 ANNOT_BUCKET   = os.environ["ANNOT_BUCKET"]
 TABLE_NAME     = os.environ["TABLE_NAME"]
 
-MODEL_BUCKET   = os.getenv("MODEL_BUCKET")            
+MODEL_BUCKET   = os.getenv("MODEL_BUCKET")
 MODEL_PREFIX   = os.getenv("MODEL_PREFIX", "birdtag-ImageVideo-model/")
 REGION         = os.getenv("AWS_REGION", "us-east-1")
 
-ANNOT_PREFIX = "annotated/"
+IMAGE_BATCH      = int(os.getenv("IMAGE_BATCH", 8))          # images per model call
+MIN_TIME_LEFT_MS = int(os.getenv("MIN_TIME_LEFT_MS", 60000))  # don't start work after this
+PRELOAD_MODEL    = os.getenv("PRELOAD_MODEL", "1") == "1"     # load weights during init
 
-s3    = boto3.client("s3")
-table = boto3.resource("dynamodb").Table(TABLE_NAME)
+ANNOT_PREFIX = "annotated/"
+IMAGE_EXT    = ("jpg", "jpeg", "png")
+VIDEO_EXT    = ("mp4", "avi", "mov")
+
+s3       = instrument_client(boto3.client("s3"))
+dynamodb = instrument_client(boto3.resource("dynamodb"))
+table    = instrument_client(dynamodb.Table(TABLE_NAME))
+# per-species versions that invalidate cached /search results (optional)
+versions_table = (instrument_client(dynamodb.Table(SPECIES_VERSION_TABLE))
+                  if SPECIES_VERSION_TABLE else None)
+
+# ─── Model: *latest* .pt under MODEL_PREFIX, kept in /tmp across invocations ───
+_weights = LatestModelFiles(s3, MODEL_BUCKET, MODEL_PREFIX, [".pt"])
+
+def _load_latest_model(force=False):
+    """Download the newest weights if they changed and (re)load them."""
+    with stage("model_download"):
+        (local,), changed = _weights.get(force)
+    # a re-upload under the same file name lands on the same local path
+    return iv.get_model(local, reload=changed)
+
+# Load during the init phase so the first event does not wait for it (and
+# provisioned concurrency starts warm); a failure here is retried in the handler.
+if PRELOAD_MODEL and MODEL_BUCKET:
+    try:
+        _load_latest_model(force=True)
+    except Exception as e:
+        print(f"[WARN] Model preload failed, loading on first event: {e}")
+
+# ─── Helper: one upload's work dir, download & catalog write ───────────────────
+class _Job:
+    def __init__(self, n, up, tmp):
+        self.up      = up
+        self.fname   = os.path.basename(up.key)
+        self.ext     = self.fname.rsplit(".", 1)[-1]
+        self.item_id = media_item_id(up.bucket, up.key, up.version_id)
+        self.workdir = os.path.join(tmp, str(n))   # same basename can arrive twice
+        self.local   = os.path.join(self.workdir, self.fname)
+
+    @property
+    def is_video(self):
+        return self.ext.lower() in VIDEO_EXT
+
+    def download(self):
+        os.makedirs(self.workdir, exist_ok=True)
+        with stage("download"):
+            s3.download_file(self.up.bucket, self.up.key, self.local)
+
+
+def _finish(job, meta):
+    """Upload the annotated copy and write the catalog row."""
+    stem = os.path.splitext(job.fname)[0]
+    ext  = job.ext.lower() if job.is_video else job.ext   # tag_video lower-cases
+    annot_local = os.path.join(job.workdir, f"{stem}_annotated.{ext}")
+    if not os.path.exists(annot_local):
+        raise FileNotFoundError(annot_local)
+
+    src_bkt, src_key = job.up.bucket, job.up.key
+
+    # ── URLs & metadata ---------------------------------------------------
+    org_url   = f"https://{src_bkt}.s3.{REGION}.amazonaws.com/{src_key}"
+    thumb_key = src_key.replace("raw_uploads/", "thumbnails/", 1)
+    thumb_url = f"https://{src_bkt}.s3.{REGION}.amazonaws.com/{thumb_key}"
+
+    annot_key = f"{ANNOT_PREFIX}{os.path.basename(annot_local)}"
+    with stage("upload"):
+        s3.upload_file(annot_local, ANNOT_BUCKET, annot_key)
+    annot_url = f"https://{ANNOT_BUCKET}.s3.{REGION}.amazonaws.com/{annot_key}"
+
+    file_size = Decimal(os.path.getsize(job.local))
+    duration  = None
+    if job.is_video:
+        cap = cv2.VideoCapture(job.local)
+        if cap.isOpened():
+            fps     = cap.get(cv2.CAP_PROP_FPS) or 30
+            frames  = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+            seconds = round(frames / fps, 1)
+            duration = Decimal(str(seconds))
+        cap.release()
+
+    upload_time = event_time(job.up.record)
+    tags        = default_vocabulary().add_tags(meta["tags"])   # "Crow" -> "crow"
+    tags_dec    = {k: Decimal(str(v)) for k, v in tags.items()}
+
+    item = {
+        "uniqueId"     : job.item_id,
+        "sourceETag"   : job.up.etag,
+        "uploadTime"   : upload_time,
+        "deleted"      : False,
+        "detected"     : meta["detected"],
+        "fileSize"     : file_size,
+        "format"       : job.ext,
+        "mediaID"      : job.fname,
+        "mediaType"    : meta["type"],
+        "originalURL"  : org_url,
+        "annotatedURL" : annot_url,
+        "thumbnailURL" : thumb_url,
+        "tags"         : tags_dec,
+    }
+    if duration is not None:
+        item["duration"] = duration
+    if "tracks" in meta:
+        # per-track summaries: distinct-individual searches without reprocessing
+        vocab = default_vocabulary()
+        item["individuals"] = {k: Decimal(str(v)) for k, v in
+                               vocab.add_tags(meta["individuals"]).items()}
+        item["tracks"] = [
+            {k: vocab.add(v) if k == "species" else Decimal(str(v)) for k, v in t.items()}
+            for t in meta["tracks"]
+        ]
+
+    with stage("db_write"):
+        written, replaced, row = upsert_item(table, item)
+    if written:
+        # a replaced row may have carried species the new one no longer has
+        old_tags = default_vocabulary().canonical_tags((replaced or {}).get("tags") or {})
+        new_tags = default_vocabulary().canonical_tags(row.get("tags") or {})  # user edits kept
+        bump_species_safely(versions_table, set(new_tags) | set(old_tags))
+        record_change_safely(dynamodb, replaced, row)      # STATS_TABLE counters
+    else:
+        print(f"[INFO] {job.item_id} was written by a concurrent invocation")
+    return {"statusCode": 200, "meta": meta, "uniqueId": job.item_id}
 
-# ─── Helper: download *latest* .pt under MODEL_PREFIX ──────────────────────────
-def _download_latest_model(tmpdir: str) -> str:
+# ─── Lambda entry ──────────────────────────────────────────────────────────────
+@instrumented
+def lambda_handler(event, ctx):
     """
-    Pick the most-recent *.pt* file in MODEL_BUCKET/MODEL_PREFIX,
-    download to `tmpdir`, return its local path.
+    Accepts a direct S3 notification or an SQS batch of S3 notifications.
+    Every record is processed; images are run through the model in batches
+    of IMAGE_BATCH. With SQS, failed or deferred records are returned as
+    batchItemFailures and retried by the queue.
     """
-    resp  = s3.list_objects_v2(Bucket=MODEL_BUCKET, Prefix=MODEL_PREFIX)
-    pats  = [o for o in resp.get("Contents", []) if o["Key"].lower().endswith(".pt")]
-    if not pats:
-        raise RuntimeError("No .pt model in S3 folder")
+    results, failed = [], []
 
-    newest = max(pats, key=lambda o: o["LastModified"])
-    local  = os.path.join(tmpdir, os.path.basename(newest["Key"]))
-    s3.download_file(MODEL_BUCKET, newest["Key"], local)
-
-    print(f"[INFO] Using model: s3://{MODEL_BUCKET}/{newest['Key']}")
-    return local
-
-# ─── Lambda entry ──────────────────────────────────────────────────────────────
-def lambda_handler(event, _ctx):
-    rec      = event["Records"][0]
-    src_bkt  = rec["s3"]["bucket"]["name"]
-    src_key  = rec["s3"]["object"]["key"]
-
-    fname = os.path.basename(src_key)
-    ext   = fname.rsplit(".", 1)[-1]
-    is_img = ext.lower() in ("jpg", "jpeg", "png")
-    is_vid = ext.lower() in ("mp4", "avi", "mov")
-    if not (is_img or is_vid):
-        return {"statusCode": 415, "msg": "unsupported file type"}
-
-    # ── Create temp dir, pull user file & latest model ────────────────────────
     with tempfile.TemporaryDirectory() as tmp:
-        local_file = os.path.join(tmp, fname)
-        s3.download_file(src_bkt, src_key, local_file)
-
-        local_model = _download_latest_model(tmp)
-        # Tell image_video_tagger which weights to load
-        os.environ["YOLO_WEIGHTS"] = local_model
-
-        # Lazy import *after* env var is set so get_model() sees it
-        iv = importlib.import_module("image_video_tagger")
-
-        iv.OUT_DIR = tmp                    # force output into temp dir
-        stem       = os.path.splitext(fname)[0]
-
-        if is_img:
-            iv.tag_image(local_file)
-            annot_local = os.path.join(tmp, f"{stem}_annotated.{ext}")
+        # ── Sort records into work units ──────────────────────────────────
+        images, videos = [], []
+        for n, up in enumerate(iter_s3_records(event)):
+            job = _Job(n, up, tmp)
+            if job.ext.lower() not in IMAGE_EXT + VIDEO_EXT:
+                print(f"[WARN] Unsupported file type: {up.key}")
+                results.append({"statusCode": 415, "msg": "unsupported file type"})
+                continue
+            # Same object ⇒ same row; skip retries of work already done
+            try:
+                done = already_ingested(table, job.item_id, up.etag)
+            except Exception as e:
+                print(f"[ERROR] {up.key}: could not check the catalog: {e}")
+                failed.append(job)
+                continue
+            if done:
+                print(f"[INFO] {up.key} already ingested as {job.item_id}, skipping")
+                results.append({"statusCode": 200, "msg": "already ingested",
+                                "uniqueId": job.item_id})
+                continue
+            (videos if job.is_video else images).append(job)
+
+        units = [images[i:i + IMAGE_BATCH] for i in range(0, len(images), IMAGE_BATCH)]
+        units += [[v] for v in videos]
+        if units:
+            _load_latest_model()
+
+        # Backpressure: leave the rest in the queue rather than time out
+        deferred = []
+        for unit in until_low_on_time(units, ctx, MIN_TIME_LEFT_MS, deferred):
+            results_unit, failed_unit = _run_unit(unit)
+            results += results_unit
+            failed  += failed_unit
+        failed += [job for unit in deferred for job in unit]
+
+    incr("records_ok", len(results))
+    incr("records_failed", len(failed))
+    return respond(event, results, [job.up for job in failed])
+
+
+def _run_unit(unit):
+    """Run one video or one image batch; isolate failures to single uploads."""
+    try:
+        for job in unit:
+            job.download()
+        if unit[0].is_video:
+            metas = [iv.tag_video(unit[0].local, out_dir=unit[0].workdir)]
         else:
-            iv.tag_video(local_file)
-            annot_local = os.path.join(tmp, f"{stem}_annotated.{ext}")
+            metas = iv.tag_images([j.local for j in unit], out_dir=[j.workdir for j in unit])
+        return [_finish(job, meta) for job, meta in zip(unit, metas)], []
+    except Exception as e:
+        if len(unit) == 1:
+            print(f"[ERROR] {unit[0].up.key}: {e}")
+            return [], unit
+        print(f"[WARN] Batch of {len(unit)} failed ({e}), retrying one by one")
+        results, failed = [], []
+        for job in unit:
+            r, f = _run_unit([job])
+            results += r
+            failed  += f
+        return results, failed
 
-        if not os.path.exists(annot_local):
-            raise FileNotFoundError(annot_local)
-
-        # ── URLs & metadata ---------------------------------------------------
-        org_url   = f"https://{src_bkt}.s3.{REGION}.amazonaws.com/{src_key}"
-        thumb_key = src_key.replace("raw_uploads/", "thumbnails/", 1)
-        thumb_url = f"https://{src_bkt}.s3.{REGION}.amazonaws.com/{thumb_key}"
-
-        annot_key = f"{ANNOT_PREFIX}{os.path.basename(annot_local)}"
-        s3.upload_file(annot_local, ANNOT_BUCKET, annot_key)
-        annot_url = f"https://{ANNOT_BUCKET}.s3.{REGION}.amazonaws.com/{annot_key}"
-
-        with open(annot_local + ".json") as fh:
-            meta = json.load(fh)
-
-        file_size = Decimal(os.path.getsize(local_file))
-        duration  = None
-        if is_vid:
-            cap = cv2.VideoCapture(local_file)
-            if cap.isOpened():
-                fps     = cap.get(cv2.CAP_PROP_FPS) or 30
-                frames  = cap.get(cv2.CAP_PROP_FRAME_COUNT)
-                seconds = round(frames / fps, 1)
-                duration = Decimal(str(seconds))
-            cap.release()
-
-        upload_time = datetime.utcnow().replace(tzinfo=timezone.utc).isoformat()
-        tags_dec    = {k: Decimal(str(v)) for k, v in meta["tags"].items()}
-
-        item = {
-            "uniqueId"     : upload_time,
-            "uploadTime"   : upload_time,
-            "deleted"      : False,
-            "detected"     : meta["detected"],
-            "fileSize"     : file_size,
-            "format"       : ext,
-            "mediaID"      : fname,
-            "mediaType"    : meta["type"],
-            "originalURL"  : org_url,
-            "annotatedURL" : annot_url,
-            "thumbnailURL" : thumb_url,
-            "tags"         : tags_dec,
-        }
-        if duration is not None:
-            item["duration"] = duration
-
-        table.put_item(Item=item)
-        return {"statusCode": 200, "meta": meta}
\ No newline at end of file
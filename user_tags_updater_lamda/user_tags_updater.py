@@ -1,10 +1,13 @@
 import json
 import boto3
 from botocore.exceptions import ClientError
+from birdtag_common.metrics import instrumented, instrument_client, stage
+from birdtag_common.species import default_vocabulary
 
 dynamodb = boto3.resource('dynamodb')
-table = dynamodb.Table('userDetails-Alert')
+table = instrument_client(dynamodb.Table('userDetails-Alert'))
 
+@instrumented
 def lambda_handler(event, context):
     # Handle CORS preflight
     if event.get('httpMethod') == 'OPTIONS':
@@ -31,21 +34,25 @@ def lambda_handler(event, context):
                 return respond(400, "Invalid or missing 'email' field.")
             if not new_tags or not isinstance(new_tags, list):
                 return respond(400, "Invalid or missing 'values' field. It must be a list.")
+            # same species ids as the catalog tags the alerts are matched against
+            new_tags = [default_vocabulary().canonical(t) for t in new_tags if isinstance(t, str) and t.strip()]
 
             # Fetch existing item from DynamoDB
-            response = table.get_item(Key={'email': email})
+            with stage("db_read"):
+                response = table.get_item(Key={'email': email})
             existing_tags = response.get('Item', {}).get('tags', [])
 
             # Merge tags uniquely
             combined_tags = list(set(existing_tags) | set(new_tags))
 
             # Update DynamoDB with merged tags
-            table.update_item(
-                Key={'email': email},
-                UpdateExpression='SET tags = :tags',
-                ExpressionAttributeValues={':tags': combined_tags},
-                ReturnValues='UPDATED_NEW'
-            )
+            with stage("db_write"):
+                table.update_item(
+                    Key={'email': email},
+                    UpdateExpression='SET tags = :tags',
+                    ExpressionAttributeValues={':tags': combined_tags},
+                    ReturnValues='UPDATED_NEW'
+                )
 
             # Return updated tags in the response
             return respond(200, "Tags updated successfully.", {'tags': combined_tags})
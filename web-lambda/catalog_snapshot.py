@@ -0,0 +1,315 @@
+"""
+Warm in-memory snapshot of the media catalog for /search.
+
+Tag counts are kept as a sparse CSR matrix (rows = catalog items, columns =
+canonical species ids): `indptr` / `cols` / `counts` numpy arrays plus a
+`row_of` array mapping every stored count to its row, so "crow >= 2 AND
+pigeon >= 1" is a few vectorized passes over the non-zeros instead of a
+table scan and a `decimal_to_native` per item. URLs are stored once per
+row as interned strings. Distinct-individual counts of tracked videos
+(`individuals`) live in the same matrix under their own columns.
+
+Changes after the initial load go to a small list of pending rows and a
+tombstone mask; both are folded into the arrays when the pending list
+grows past COMPACT_AT. The per-row arrays (filter columns, tombstones)
+are views of buffers that grow by doubling, so an upsert costs amortized
+O(1) rather than a copy of every array.
+
+The snapshot requires the catalog table's stream (CATALOG_STREAM_ARN, new
+and old images): it is loaded with one scan per container and then kept
+fresh incrementally from the stream, so a warm container never rescans the
+table. Writes made by this container are applied at once. Without a
+stream, web-lambda does not build a snapshot and /search reads through the
+index/scan planner in search_filters instead.
+"""
+import os
+import sys
+
+import numpy as np
+
+from birdtag_common.streams import StreamFollower, plain_image
+from search_filters import FILTER_FIELDS, MEDIA_TYPES, to_epoch
+
+CATALOG_STREAM_ARN = os.getenv("CATALOG_STREAM_ARN")
+COMPACT_AT = int(os.getenv("SNAPSHOT_COMPACT_AT", "2000"))
+URL_FIELDS = ("thumbnailURL", "originalURL", "annotatedURL")
+INDIVIDUALS = "individuals"       # distinct tracks per species, videos only
+FIELDS = ("uniqueId", "tags", INDIVIDUALS) + FILTER_FIELDS + URL_FIELDS
+MEDIA_CODES = {m: n + 1 for n, m in enumerate(MEDIA_TYPES)}     # 0 = unknown
+ROW_ARRAYS = ("alive", "times", "media", "sizes", "durations", "tracked")
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) and value else None
+
+
+def _float(value):
+    return float("nan") if value is None else float(value)
+
+
+def _filter_values(item):
+    """(upload epoch, media code, size, duration) with NaN for missing values."""
+    ts = to_epoch(item.get("uploadTime"))
+    return (_float(ts), MEDIA_CODES.get(item.get("mediaType"), 0),
+            _float(item.get("fileSize")), _float(item.get("duration")))
+
+
+class CatalogSnapshot:
+    def __init__(self, vocab):
+        self.vocab = vocab
+        self.columns = {}                 # species id or (INDIVIDUALS, species id) -> column
+        self.ids = []                     # row -> uniqueId
+        self.urls = []                    # row -> (thumbnailURL, originalURL, annotatedURL)
+        self.row = {}                     # uniqueId -> row
+        self.pending = {}                 # row -> {column: count} not yet in the arrays
+        self.indptr = np.zeros(1, np.int64)
+        self.cols = np.zeros(0, np.int32)
+        self.counts = np.zeros(0, np.float64)
+        self.row_of = np.zeros(0, np.int32)
+        self.alive = np.zeros(0, bool)
+        # per-row filter columns (pending rows included)
+        self.times = np.zeros(0)
+        self.media = np.zeros(0, np.int8)
+        self.sizes = np.zeros(0)
+        self.durations = np.zeros(0)
+        self.tracked = np.zeros(0, bool)  # row has `individuals`
+        self.buffers = {}                 # ROW_ARRAYS name -> spare-capacity buffer
+
+    def __len__(self):
+        return int(self.alive.sum())
+
+    # ───────────────────────── building ─────────────────────────
+    def _column(self, species_id):
+        col = self.columns.get(species_id)
+        if col is None:
+            col = self.columns[species_id] = len(self.columns)
+        return col
+
+    def _row_tags(self, item):
+        row = {}
+        for field in ("tags", INDIVIDUALS):
+            counts = item.get(field)
+            if isinstance(counts, dict):
+                row.update({self._column(sid if field == "tags" else (INDIVIDUALS, sid)): float(n)
+                            for sid, n in self.vocab.add_tags(counts).items() if n})
+        return row
+
+    def load(self, items):
+        """Replace the contents with `items` (any iterable of catalog rows)."""
+        self.__init__(self.vocab)
+        indptr, cols, counts, values, tracked = [0], [], [], [], []
+        for item in items:
+            tags = self._row_tags(item)
+            self.row[item["uniqueId"]] = len(self.ids)
+            self.ids.append(item["uniqueId"])
+            self.urls.append(tuple(_intern(item.get(f)) for f in URL_FIELDS))
+            values.append(_filter_values(item))
+            tracked.append(isinstance(item.get(INDIVIDUALS), dict))
+            cols.extend(tags)
+            counts.extend(tags.values())
+            indptr.append(len(cols))
+        self._set_arrays(indptr, cols, counts, np.ones(len(self.ids), bool))
+        if values:
+            times, media, sizes, durations = zip(*values)
+            self.times = np.array(times)
+            self.media = np.array(media, np.int8)
+            self.sizes = np.array(sizes)
+            self.durations = np.array(durations)
+            self.tracked = np.array(tracked, bool)
+        return self
+
+    def _set_arrays(self, indptr, cols, counts, alive):
+        self.indptr = np.asarray(indptr, np.int64)
+        self.cols = np.asarray(cols, np.int32)
+        self.counts = np.asarray(counts, np.float64)
+        self.row_of = np.repeat(np.arange(len(self.indptr) - 1, dtype=np.int32),
+                                np.diff(self.indptr))
+        self.alive = alive
+        self.buffers = {}
+
+    def upsert(self, item):
+        """Insert or replace one catalog row."""
+        self.remove(item["uniqueId"])
+        r = len(self.ids)
+        self.row[item["uniqueId"]] = r
+        self.ids.append(item["uniqueId"])
+        self.urls.append(tuple(_intern(item.get(f)) for f in URL_FIELDS))
+        self.pending[r] = self._row_tags(item)
+        self._append_row((True,) + _filter_values(item) + (isinstance(item.get(INDIVIDUALS), dict),))
+        if len(self.pending) >= COMPACT_AT:
+            self.compact()
+
+    def _append_row(self, values):
+        """Append one value to each of ROW_ARRAYS, doubling a buffer when it is full."""
+        n = len(self.alive)
+        for name, value in zip(ROW_ARRAYS, values):
+            view = getattr(self, name)
+            buf = self.buffers.get(name)
+            if buf is None or len(buf) <= n:
+                buf = self.buffers[name] = np.empty(max(2 * n, 16), view.dtype)
+                buf[:n] = view
+            buf[n] = value
+            setattr(self, name, buf[:n + 1])
+
+    def remove(self, unique_id):
+        r = self.row.pop(unique_id, None)
+        if r is not None:
+            self.alive[r] = False
+            self.pending.pop(r, None)
+
+    def compact(self):
+        """Fold pending rows into the arrays and drop deleted rows."""
+        base_rows = len(self.indptr) - 1
+        keep = np.flatnonzero(self.alive)
+        indptr, cols, counts = [0], [], []
+        ids, urls = [], []
+        for r in keep:
+            if r < base_rows:
+                lo, hi = self.indptr[r], self.indptr[r + 1]
+                cols.extend(self.cols[lo:hi].tolist())
+                counts.extend(self.counts[lo:hi].tolist())
+            else:
+                tags = self.pending.get(r, {})
+                cols.extend(tags)
+                counts.extend(tags.values())
+            indptr.append(len(cols))
+            ids.append(self.ids[r])
+            urls.append(self.urls[r])
+        self.ids, self.urls, self.pending = ids, urls, {}
+        self.row = {uid: n for n, uid in enumerate(ids)}
+        self.times, self.media = self.times[keep], self.media[keep]
+        self.sizes, self.durations = self.sizes[keep], self.durations[keep]
+        self.tracked = self.tracked[keep]
+        self._set_arrays(indptr, cols, counts, np.ones(len(ids), bool))
+
+    # ───────────────────────── queries ──────────────────────────
+    def _columns_for(self, species_ids, individuals=False):
+        keys = [(INDIVIDUALS, s) for s in species_ids] if individuals else species_ids
+        return np.fromiter((self.columns[k] for k in keys if k in self.columns), np.int32)
+
+    def _sums(self, species_ids, individuals=False):
+        """
+        Per-row total count over the given species (base rows + pending rows);
+        with `individuals`, distinct tracks for tracked rows and tag counts
+        for the rest.
+        """
+        if individuals:
+            return np.where(self.tracked, self._sums_of(self._columns_for(species_ids, True)),
+                            self._sums(species_ids))
+        return self._sums_of(self._columns_for(species_ids))
+
+    def _sums_of(self, cols):
+        n_rows = len(self.ids)
+        if len(cols) == 0:
+            return np.zeros(n_rows)
+        hit = np.isin(self.cols, cols)
+        sums = np.bincount(self.row_of[hit], weights=self.counts[hit], minlength=n_rows)
+        if len(sums) < n_rows:
+            sums = np.concatenate([sums, np.zeros(n_rows - len(sums))])
+        wanted = set(cols.tolist())
+        for r, tags in self.pending.items():
+            sums[r] = sum(n for c, n in tags.items() if c in wanted)
+        return sums
+
+    def filter_mask(self, filters=None):
+        """Live rows passing the SearchFilters (NaN never passes a bound)."""
+        mask = self.alive.copy()
+        if not filters:
+            return mask
+        if filters.media_types:
+            mask &= np.isin(self.media, [MEDIA_CODES[m] for m in filters.media_types])
+        if filters.has_time:
+            lo, hi = filters.epoch_range()
+            mask &= (self.times >= lo) & (self.times <= hi)
+        for values, lo, hi in ((self.durations, filters.min_duration, filters.max_duration),
+                               (self.sizes, filters.min_size, filters.max_size)):
+            if lo is not None:
+                mask &= values >= lo
+            if hi is not None:
+                mask &= values <= hi
+        return mask
+
+    def match_all(self, terms, filters=None, individuals=False):
+        """Rows where, for every (species ids, count) term, the summed count >= count."""
+        mask = self.filter_mask(filters)
+        for species_ids, count in terms:
+            mask &= self._sums(species_ids, individuals) >= count
+        return np.flatnonzero(mask)
+
+    def match_any(self, species_ids, filters=None):
+        """Rows tagged with at least one of the species."""
+        return np.flatnonzero(self.filter_mask(filters) & (self._sums(species_ids) > 0))
+
+    def match_every(self, species_ids):
+        """Rows tagged with every one of the species."""
+        return self.match_all([({sid}, 1) for sid in species_ids])
+
+
+# ─────────────────────────── warm-container cache ───────────────────────────
+class SnapshotCache:
+    """Keeps one CatalogSnapshot per container, following the catalog stream."""
+
+    def __init__(self, table, vocab, streams_client, stream_arn=CATALOG_STREAM_ARN):
+        if not stream_arn:
+            raise ValueError("CatalogSnapshot needs the catalog stream (CATALOG_STREAM_ARN)")
+        self.table = table
+        self.vocab = vocab
+        self.streams_client = streams_client
+        self.stream_arn = stream_arn
+        self.snapshot = None
+        self.follower = None
+
+    def _scan_all(self):
+        kwargs = {"ProjectionExpression": ", ".join(f"#f{n}" for n in range(len(FIELDS))),
+                  "ExpressionAttributeNames": {f"#f{n}": f for n, f in enumerate(FIELDS)}}
+        while True:
+            resp = self.table.scan(**kwargs)
+            yield from resp.get("Items", [])
+            if "LastEvaluatedKey" not in resp:
+                return
+            kwargs["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+
+    def _reload(self):
+        # position on the stream first so nothing written during the load is lost
+        self.follower = StreamFollower(self.streams_client, self.stream_arn)
+        self.follower.start()
+        self.snapshot = CatalogSnapshot(self.vocab).load(self._scan_all())
+        print(f"Loaded catalog snapshot: {len(self.snapshot)} items, "
+              f"{len(self.snapshot.columns)} species")
+
+    def _apply(self, records):
+        for rec in records:
+            ddb = rec.get("dynamodb", {})
+            if rec.get("eventName") == "REMOVE":
+                self.snapshot.remove(plain_image(ddb.get("Keys")).get("uniqueId"))
+            elif ddb.get("NewImage"):
+                self.snapshot.upsert(plain_image(ddb["NewImage"]))
+
+    @property
+    def synced_at(self):
+        """Every catalog write before this time is in the snapshot."""
+        return self.follower.synced_at if self.follower is not None else 0.0
+
+    def get(self, poll=True):
+        """The snapshot; `poll` applies new stream records first (if a poll is due)."""
+        if self.snapshot is None:
+            self._reload()
+            return self.snapshot
+        if not poll:
+            return self.snapshot
+        try:
+            self._apply(self.follower.poll())
+        except Exception as e:
+            # e.g. records trimmed from the stream while this container was idle
+            print(f"Error polling catalog stream, reloading snapshot: {e}")
+            self._reload()
+        return self.snapshot
+
+    # writes made by this container, visible before the stream catches up
+    def upsert(self, item):
+        if self.snapshot is not None:
+            self.snapshot.upsert(item)
+
+    def remove(self, unique_id):
+        if self.snapshot is not None:
+            self.snapshot.remove(unique_id)
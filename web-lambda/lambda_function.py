@@ -1,26 +1,104 @@
+import os
 import json
 import boto3
 import base64
+import gzip
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
 from decimal import Decimal
 from boto3.dynamodb.conditions import Attr
 from urllib.parse import urlparse
-
-dynamodb = boto3.resource("dynamodb")
-s3 = boto3.client('s3')
-table = dynamodb.Table('BirdAnalyiser')
+from birdtag_common.metrics import instrumented, instrument_client, stage, incr, put, set_dimension, set_property
+from birdtag_common.species import default_vocabulary, normalize
+from birdtag_common.query_cache import (QueryCache, query_key, bump_species_safely,
+                                        SPECIES_VERSION_TABLE, VOCAB_KEY)
+from birdtag_common.stats import STATS_TABLE, record_change_safely, read_totals, read_days
+from search_filters import SearchFilters, FILTER_FIELDS
+
+dynamodb = instrument_client(boto3.resource("dynamodb"))
+s3 = instrument_client(boto3.client('s3'))
+table = instrument_client(dynamodb.Table('BirdAnalyiser'))
+VOCAB = default_vocabulary()
+URL_FIELDS = ('thumbnailURL', 'originalURL', 'annotatedURL')
+DEFAULT_PAGE_SIZE = 100
+
+# /search?ids=...: batch_get_item chunks read in parallel, throttled keys retried
+MAX_IDS = int(os.getenv('MAX_IDS', '500'))
+BATCH_GET_WORKERS = int(os.getenv('BATCH_GET_WORKERS', '4'))
+BATCH_GET_RETRIES = 8
+BATCH_GET_BASE_DELAY = 0.05
+BATCH_GET_MAX_DELAY = 2.0
+
+# Attributes each route reads; nothing else leaves DynamoDB
+SEARCH_FIELDS = ('uniqueId', 'tags') + URL_FIELDS
+TRACK_FIELDS = ('individuals',)                  # read by countMode=individuals only
+ROW_FIELDS = SEARCH_FIELDS + FILTER_FIELDS       # enough to refresh the snapshot
+
+# Opt-in gzip of large responses for clients sending Accept-Encoding: gzip
+# (the API needs binary media types "*/*" so API Gateway passes it through)
+GZIP_RESPONSES = os.getenv('GZIP_RESPONSES', '0') == '1'
+GZIP_MIN_BYTES = int(os.getenv('GZIP_MIN_BYTES', '4096'))
+
+# Tag search results cached per query, invalidated through per-species versions
+versions_table = None
+query_cache = None
+if SPECIES_VERSION_TABLE:
+    versions_table = instrument_client(dynamodb.Table(SPECIES_VERSION_TABLE))
+    query_cache = QueryCache(dynamodb)
+
+# Per-species / day / mediaType counters served by /stats (optional)
+stats_table = instrument_client(dynamodb.Table(STATS_TABLE)) if STATS_TABLE else None
+STATS_GRANULARITY = {'day': 10, 'month': 7, 'year': 4}     # prefix length of the day
+
+try:
+    from catalog_snapshot import SnapshotCache   # needs numpy (layer)
+except ImportError as e:
+    print(f"Catalog snapshot unavailable, searching with table scans: {e}")
+    SnapshotCache = None
+
+# Warm in-memory catalog for tag searches, kept current from the catalog
+# stream; without CATALOG_STREAM_ARN (or with CATALOG_SNAPSHOT=0) searches
+# read through the index/scan planner
+snapshots = None
+if SnapshotCache is not None and os.getenv('CATALOG_SNAPSHOT', '1') == '1':
+    if os.getenv('CATALOG_STREAM_ARN'):
+        snapshots = SnapshotCache(table, VOCAB, instrument_client(boto3.client('dynamodbstreams')))
+    else:
+        print("CATALOG_STREAM_ARN is not set, searching without the catalog snapshot")
 
 def generate_presigned_url(bucket, key, expiration=3600):
     try:
-        url = s3.generate_presigned_url(
-            'get_object',
-            Params={'Bucket': bucket, 'Key': key},
-            ExpiresIn=expiration
-        )
+        with stage("presign"):
+            url = s3.generate_presigned_url(
+                'get_object',
+                Params={'Bucket': bucket, 'Key': key},
+                ExpiresIn=expiration
+            )
+        incr("presigned_urls")
         return url
     except Exception as e:
         print(f"Error generating presigned URL for {bucket}/{key}: {e}")
         return None
 
+def presign_urls(s3_urls):
+    """
+    {s3 url: presigned url} for many URLs, each distinct URL signed once in
+    one presign stage; URLs that cannot be signed map to themselves.
+    """
+    signed = {}
+    with stage("presign"):
+        for url in dict.fromkeys(u for u in s3_urls if u):
+            try:
+                bucket, key = extract_bucket_key_from_url(url)
+                signed[url] = s3.generate_presigned_url(
+                    'get_object', Params={'Bucket': bucket, 'Key': key}, ExpiresIn=3600)
+            except Exception as e:
+                print(f"Failed to generate presigned URL for {url}: {e}")
+                signed[url] = url
+    incr("presigned_urls", len(signed))
+    return signed
+
 def decimal_to_native(obj):
     if isinstance(obj, list):
         return [decimal_to_native(i) for i in obj]
@@ -31,13 +109,19 @@ def decimal_to_native(obj):
     else:
         return obj
 
+def projection(fields):
+    """ProjectionExpression kwargs for a read of `fields` (names may be reserved words)."""
+    return {'ProjectionExpression': ', '.join(f'#p{i}' for i in range(len(fields))),
+            'ExpressionAttributeNames': {f'#p{i}': f for i, f in enumerate(fields)}}
+
 def parse_tag_count_query(params):
+    """tag1=crow&count1=2&... -> {tag: count}; the pairs are taken out of `params`."""
     tag_counts = {}
     i = 1
     while f'tag{i}' in params and f'count{i}' in params:
-        tag = params.get(f'tag{i}').strip()
+        tag = params.pop(f'tag{i}').strip()
         try:
-            count = int(params.get(f'count{i}'))
+            count = int(params.pop(f'count{i}'))
             if tag and count > 0:
                 tag_counts[tag] = count
         except:
@@ -45,6 +129,41 @@ def parse_tag_count_query(params):
         i += 1
     return tag_counts
 
+def as_count(value, strings=False):
+    """A tag count given as an int (or a numeric string if `strings`), else None."""
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if strings and isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    return None
+
+def learn_species(items):
+    """Register every tag name in `items` so query terms can resolve to them."""
+    for item in items:
+        tags = item.get('tags')
+        if isinstance(tags, dict):
+            for tag_name in tags:
+                VOCAB.add(tag_name)
+
+def snapshot_links(snap, rows):
+    """Presigned thumbnail/original/annotated links of snapshot rows, in field order."""
+    links = []
+    for r in rows:
+        for url in snap.urls[r]:
+            if url:
+                links.append(get_presigned_url_from_s3_url(url))
+    return links
+
+def species_changed(species):
+    """Invalidate cached tag searches that involve any of these species."""
+    bump_species_safely(versions_table, species)
+    if query_cache is not None:
+        query_cache.forget(species)
+
+def get_snapshot(poll=True):
+    with stage("snapshot"):
+        return snapshots.get(poll)
+
 def extract_tags_from_file(file_bytes):
     # Replace with actual ML model logic
     return {"crow": 1, "pigeon": 2}
@@ -67,6 +186,38 @@ def build_cors_response(status_code, body_dict):
         'body': json.dumps(body_dict)
     }
 
+def compress_response(response, event):
+    """Gzip a large response body when enabled and the client accepts it."""
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    body = response['body']
+    if (not GZIP_RESPONSES or 'gzip' not in headers.get('accept-encoding', '')
+            or len(body) < GZIP_MIN_BYTES):
+        return response
+    packed = gzip.compress(body.encode('utf-8'), compresslevel=5)
+    put("response_bytes_gzip", len(packed), "Bytes")
+    response['headers'].update({'Content-Encoding': 'gzip', 'Vary': 'Accept-Encoding'})
+    response['body'] = base64.b64encode(packed).decode('ascii')
+    response['isBase64Encoded'] = True
+    return response
+
+def compact_records(matches):
+    """
+    {hosts, records} body for format=compact: one record per item with its
+    presigned links split into an index into `hosts` and the rest of the URL.
+    """
+    hosts, records = {}, []
+    for uid, urls in matches:
+        record = {'id': uid}
+        for name, url in zip(('thumb', 'orig', 'annot'), urls):
+            if not url:
+                continue
+            scheme, _, rest = get_presigned_url_from_s3_url(url).partition('://')
+            host, _, path = rest.partition('/')
+            n = hosts.setdefault(f'{scheme}://{host}', len(hosts))
+            record[name] = [n, '/' + path]
+        records.append(record)
+    return {'hosts': list(hosts), 'records': records}
+
 def get_presigned_url_from_s3_url(s3_url):
     try:
         bucket, key = extract_bucket_key_from_url(s3_url)
@@ -79,7 +230,264 @@ def get_presigned_url_from_s3_url(s3_url):
         print(f"Failed to generate presigned URL for {s3_url}: {e}")
         return s3_url  # fallback to original URL
 
+# ---------- tag search ----------
+
+def tag_search(mode, terms, filters=None, page=None, page_size=DEFAULT_PAGE_SIZE, compact=False):
+    """
+    Links of the items matching a tag search. mode 'count': for every
+    (tag, count) term the item holds at least `count` birds of the species
+    the tag resolves to; 'individuals': the same over distinct tracked
+    birds (`individuals` of videos, tag counts of other items); mode
+    'any': the item has one of the tags' species.
+    Only items passing `filters` (SearchFilters) are returned; `compact`
+    groups the links per item (see compact_records).
+    """
+    ids, urls = cached_tag_search(mode, terms, filters)
+    body = {}
+    if page is not None:
+        body.update(total=len(ids), page=page, pageSize=page_size)
+        ids = ids[page * page_size:(page + 1) * page_size]
+    if urls is None:
+        matches = urls_for_ids(ids)             # cache hit: ids only
+    else:
+        matches = [(uid, urls[uid]) for uid in ids]
+    if compact:
+        body.update(compact_records(matches))
+        return body
+    links = []
+    for _, urls in matches:
+        for url in urls:
+            if url:
+                links.append(get_presigned_url_from_s3_url(url))
+    body['links'] = links
+    return body
+
+def cached_tag_search(mode, terms, filters=None):
+    """
+    (matching uniqueIds, {uniqueId: urls}) -- the URL map is None when the
+    ids come from the result cache.
+    """
+    if snapshots is not None:
+        # loads on first use (teaching VOCAB every species in the catalog);
+        # stream polling is left to the match, after the versions are read
+        get_snapshot(poll=False)
+    if query_cache is None or not terms:
+        # filter-only results depend on no species, so nothing invalidates them
+        matches = match_tag_search(mode, terms, filters)
+        return [uid for uid, _ in matches], dict(matches)
+
+    key = query_key(mode, terms, filters.key() if filters else None)
+    asked = time.time()
+    with stage("cache"):
+        species = set().union(*(VOCAB.resolve(t) for t, _ in terms))
+        versions = query_cache.versions(sorted(species | {VOCAB_KEY}))
+        had_entry = key in query_cache.entries
+        hit = query_cache.get(key, versions)
+    if hit is not None:
+        ids, age = hit
+        incr("query_cache_hit")
+        put("query_cache_age_s", round(age, 1), "Seconds")
+        return list(ids), None
+
+    incr("query_cache_stale" if had_entry else "query_cache_miss")
+    matches = match_tag_search(mode, terms, filters)
+    ids = [uid for uid, _ in matches]
+    # Only cache what is at least as new as the versions: a snapshot that has
+    # not applied the stream since they were read may miss the writes behind
+    # them, and a species learned meanwhile has no version in the entry.
+    if snapshots is not None and (snapshots.synced_at < asked or
+                                  set().union(*(VOCAB.resolve(t) for t, _ in terms)) != species):
+        incr("query_cache_not_stored")
+    else:
+        query_cache.put(key, versions, ids)
+    return ids, dict(matches)
+
+def match_tag_search(mode, terms, filters=None):
+    """(uniqueId, (thumbnailURL, originalURL, annotatedURL)) of matching items."""
+    if snapshots is not None:
+        snap = get_snapshot()
+        set_property('plan', 'snapshot')
+        with stage("match"):
+            if mode != 'any':
+                rows = snap.match_all([(VOCAB.resolve(tag), count) for tag, count in terms], filters,
+                                      individuals=mode == 'individuals')
+            else:
+                rows = snap.match_any(frozenset().union(*(VOCAB.resolve(t) for t, _ in terms)), filters)
+        return [(snap.ids[r], snap.urls[r]) for r in rows]
+
+    with stage("db_read"):
+        fields = ROW_FIELDS if filters else SEARCH_FIELDS
+        items = list(read_catalog(filters, fields + TRACK_FIELDS if mode == 'individuals' else fields))
+
+    # Resolve each query tag (case-insensitive substring of a species
+    # name or alias) to species ids once, not per row
+    learn_species(items)
+    if mode != 'any':
+        wanted = [(VOCAB.resolve(tag), count) for tag, count in terms]
+    else:
+        wanted_any = frozenset().union(*(VOCAB.resolve(t) for t, _ in terms))
+
+    matches = []
+    for item in items:
+        item = decimal_to_native(item)
+        item_tags = item.get('tags', {})
+        if not isinstance(item_tags, dict):
+            item_tags = {}
+        if filters and not filters.matches(item):
+            continue
+        if mode == 'individuals' and isinstance(item.get('individuals'), dict):
+            item_tags = item['individuals']
+        if mode != 'any':
+            ok = all(sum_matching_tags(item_tags, ids) >= count for ids, count in wanted)
+        else:
+            # any of its tags is one of the requested species
+            ok = any(VOCAB.canonical(tag_name) in wanted_any for tag_name in item_tags)
+        if ok:
+            matches.append((item['uniqueId'], tuple(item.get(f) for f in URL_FIELDS)))
+    return matches
+
+def sum_matching_tags(tags_dict, species_ids):
+    """Sum counts of the item's tags that belong to one of the resolved species."""
+    total_count = 0
+    for tag_name, tag_count in tags_dict.items():
+        if VOCAB.canonical(tag_name) in species_ids:
+            total_count += tag_count
+    return total_count
+
+def read_pages(operation, **kwargs):
+    """Every row of a scan or query, following LastEvaluatedKey."""
+    while True:
+        response = operation(**kwargs)
+        yield from response.get('Items', [])
+        if 'LastEvaluatedKey' not in response:
+            return
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def read_catalog(filters=None, fields=SEARCH_FIELDS):
+    """
+    `fields` of the catalog rows that may pass `filters`, read through the
+    index the planner picks (mediaType + uploadTime) or a scan.
+    """
+    reads = filters.plan() if filters else [('scan', {})]
+    set_property('plan', '+'.join(kind for kind, _ in reads))
+    for kind, kwargs in reads:
+        yield from read_pages(table.query if kind == 'query' else table.scan,
+                              **kwargs, **projection(fields))
+
+def _batch_get_chunk(ids, fields):
+    """One batch_get_item of at most 100 keys, retrying UnprocessedKeys with jittered backoff."""
+    request = {table.name: {'Keys': [{'uniqueId': uid} for uid in ids], **projection(fields)}}
+    found = {}
+    for attempt in range(BATCH_GET_RETRIES + 1):
+        response = dynamodb.batch_get_item(RequestItems=request)
+        for item in response.get('Responses', {}).get(table.name, []):
+            found[item['uniqueId']] = item
+        request = response.get('UnprocessedKeys')
+        if not request:
+            return found
+        incr("unprocessed_keys", len(request[table.name]['Keys']))
+        if attempt < BATCH_GET_RETRIES:
+            time.sleep(random.uniform(0, min(BATCH_GET_MAX_DELAY, BATCH_GET_BASE_DELAY * 2 ** attempt)))
+    raise RuntimeError(f"batch_get_item left {len(request[table.name]['Keys'])} keys unprocessed")
+
+def batch_get(ids, fields):
+    """{uniqueId: item} of the ids that exist, read in chunks of 100 on a small thread pool."""
+    ids = list(dict.fromkeys(ids))
+    chunks = [ids[i:i + 100] for i in range(0, len(ids), 100)]
+    fields = ('uniqueId',) + tuple(f for f in fields if f != 'uniqueId')
+    found = {}
+    with stage("db_read"):
+        if len(chunks) > 1 and BATCH_GET_WORKERS > 1:
+            with ThreadPoolExecutor(min(BATCH_GET_WORKERS, len(chunks))) as pool:
+                parts = list(pool.map(lambda chunk: _batch_get_chunk(chunk, fields), chunks))
+        else:
+            parts = [_batch_get_chunk(chunk, fields) for chunk in chunks]
+    for part in parts:
+        found.update(part)
+    return found
+
+def urls_for_ids(ids):
+    """(uniqueId, urls) for cached ids, in order; rows deleted since are dropped."""
+    if snapshots is not None:
+        snap = get_snapshot()
+        return [(uid, snap.urls[snap.row[uid]]) for uid in ids if uid in snap.row]
+    found = batch_get(ids, URL_FIELDS)
+    return [(uid, tuple(found[uid].get(f) for f in URL_FIELDS)) for uid in ids if uid in found]
+
+def items_by_ids(ids):
+    """
+    Body of /search?ids=: thumbnail and tags of every id that exists, in the
+    order asked for, with one batched presign; ids without a row are listed
+    under `missing`.
+    """
+    found = batch_get(ids, ('thumbnailURL', 'tags'))
+    signed = presign_urls(item.get('thumbnailURL') for item in found.values())
+    items, missing = [], []
+    for uid in dict.fromkeys(ids):
+        item = found.get(uid)
+        if item is None:
+            missing.append(uid)
+            continue
+        item = decimal_to_native(item)
+        items.append({'uniqueId': uid,
+                      'thumbnailURL': signed.get(item.get('thumbnailURL'), item.get('thumbnailURL')),
+                      'tags': item.get('tags')})
+    return {'items': items, 'missing': missing}
+
+# ---------- stats ----------
+
+def stats_report(params):
+    """
+    {species: {period: {mediaType: {items, birds}}}} from the STATS_TABLE
+    counters: one query for all-time totals, one per species otherwise.
+    """
+    granularity = params.get('granularity') or 'total'
+    if granularity != 'total' and granularity not in STATS_GRANULARITY:
+        raise ValueError(f"Unknown granularity {granularity!r}")
+    media_types = {m.strip().lower() for m in (params.get('mediaType') or '').split(',') if m.strip()}
+    day_from, day_to = params.get('from'), params.get('to')
+    for day in (day_from, day_to):
+        if day is not None and (len(day) != 10 or not day[:4].isdigit()):
+            raise ValueError(f"Expected YYYY-MM-DD, got {day!r}")
+
+    species = None
+    if params.get('species'):
+        # a name the vocabulary has not seen yet may still have counters
+        species = set().union(*(VOCAB.resolve(t) or {normalize(t)}
+                                for t in params['species'].split(',') if t.strip()))
+
+    report = {}
+    def add(sid, period, media_type, items, birds):
+        if (media_types and media_type not in media_types) or not (items or birds):
+            return
+        slot = report.setdefault(sid, {}).setdefault(period, {}).setdefault(
+            media_type, {'items': 0, 'birds': 0})
+        slot['items'] += items
+        slot['birds'] += birds
+
+    with stage("db_read"):
+        if granularity == 'total' and not (day_from or day_to):
+            for sid, media_type, items, birds in read_totals(stats_table):
+                if species is None or sid in species:
+                    add(sid, 'all', media_type, items, birds)
+        else:
+            if species is None:
+                species = {sid for sid, *_ in read_totals(stats_table)}
+            width = STATS_GRANULARITY.get(granularity)
+            for sid in sorted(species):
+                for day, media_type, items, birds in read_days(stats_table, sid, day_from, day_to):
+                    add(sid, day[:width] if width else 'all', media_type, items, birds)
+    return {'granularity': granularity, 'species': report}
+
+def summarize_event(event):
+    # one short line instead of the whole event (bodies can be base64 files)
+    params = event.get('queryStringParameters') or {}
+    return (f"{event.get('httpMethod')} {event.get('path')} "
+            f"params={sorted(params)} body_bytes={len(event.get('body') or '')}")
+
+@instrumented
 def lambda_handler(event, context):
+    set_dimension("Route", event.get('path') or "unknown")
     if event['httpMethod'] == 'OPTIONS':
         return {
             'statusCode': 200,
@@ -91,7 +499,7 @@ def lambda_handler(event, context):
             'body': ''
         }
 
-    print("Event received:", json.dumps(event))
+    print("Event received:", summarize_event(event))
     http_method = event.get('httpMethod')
     path = event.get('path')
 
@@ -107,17 +515,20 @@ def lambda_handler(event, context):
                 return build_cors_response(400, {'error': 'Invalid or missing "urls" or "thumbnailURL"'})
 
             deleted_urls = []
+            touched_species = set()
 
             for url in urls:
                 if not isinstance(url, str) or not url.strip():
                     continue
 
                 # Scan for record that contains this URL in any field
-                response = table.scan(
-                    FilterExpression=Attr('thumbnailURL').eq(url) |
-                                    Attr('originalURL').eq(url) |
-                                    Attr('annotatedURL').eq(url)
-                )
+                with stage("db_read"):
+                    response = table.scan(
+                        FilterExpression=Attr('thumbnailURL').eq(url) |
+                                        Attr('originalURL').eq(url) |
+                                        Attr('annotatedURL').eq(url),
+                        **projection(ROW_FIELDS)
+                    )
                 items = response.get('Items', [])
                 for item in items:
                     # Collect all 3 URLs from the item
@@ -126,8 +537,13 @@ def lambda_handler(event, context):
 
                     # Delete DB entry
                     try:
-                        table.delete_item(Key={'uniqueId': item['uniqueId']})
+                        with stage("db_write"):
+                            table.delete_item(Key={'uniqueId': item['uniqueId']})
                         deleted_urls.append(url)
+                        if snapshots is not None:
+                            snapshots.remove(item['uniqueId'])
+                        touched_species |= set(VOCAB.canonical_tags(item.get('tags') or {}))
+                        record_change_safely(dynamodb, item, None)
                     except Exception as e:
                         print(f"Failed to delete DynamoDB record for {url}: {e}")
                         continue
@@ -136,11 +552,13 @@ def lambda_handler(event, context):
                     for file_url in file_urls:
                         try:
                             bucket, key = extract_bucket_key_from_url(file_url)
-                            s3.delete_object(Bucket=bucket, Key=key)
+                            with stage("s3_delete"):
+                                s3.delete_object(Bucket=bucket, Key=key)
                             print(f"Deleted from S3: {bucket}/{key}")
                         except Exception as e:
                             print(f"Failed to delete {file_url} from S3: {e}")
 
+            species_changed(touched_species)
             return build_cors_response(200, {'message': 'Deletion completed'})
 
         except Exception as e:
@@ -166,7 +584,7 @@ def lambda_handler(event, context):
             for t in tags:
                 parts = t.split(',')
                 if len(parts) == 2:
-                    tag_name = parts[0].strip()
+                    tag_name = VOCAB.canonical(parts[0].strip())
                     try:
                         tag_count = int(parts[1].strip())
                         if tag_name and tag_count > 0:
@@ -178,10 +596,15 @@ def lambda_handler(event, context):
                 return build_cors_response(400, {'error': 'No valid tags to add/remove'})
 
             updated_files = []
+            touched_species = set()
             for url in urls:
-                response = table.scan(
-                    FilterExpression=Attr('thumbnailURL').eq(url)
-                )
+                with stage("db_read"):
+                    # video thumbnails are never rendered; videos go by their original
+                    response = table.scan(
+                        FilterExpression=Attr('thumbnailURL').eq(url) |
+                                        Attr('originalURL').eq(url),
+                        **projection(ROW_FIELDS + TRACK_FIELDS)
+                    )
                 items = response.get('Items', [])
                 if not items:
                     continue
@@ -190,6 +613,8 @@ def lambda_handler(event, context):
                 tags_dict = item.get('tags', {})
                 if not isinstance(tags_dict, dict):
                     tags_dict = {}
+                # rows written before canonical ids get rewritten in canonical form
+                tags_dict = VOCAB.canonical_tags(tags_dict)
 
                 if operation == 1:
                     for tag, count in parsed_tags.items():
@@ -204,15 +629,22 @@ def lambda_handler(event, context):
                                 tags_dict.pop(tag, None)
 
                 try:
-                    table.update_item(
-                        Key={'uniqueId': item['uniqueId']},
-                        UpdateExpression='SET tags = :newtags',
-                        ExpressionAttributeValues={':newtags': tags_dict}
-                    )
+                    with stage("db_write"):
+                        table.update_item(
+                            Key={'uniqueId': item['uniqueId']},
+                            # a re-ingest of the file keeps tags edited here
+                            UpdateExpression='SET tags = :newtags, tagsEdited = :edited',
+                            ExpressionAttributeValues={':newtags': tags_dict, ':edited': True}
+                        )
                     updated_files.append(url)
+                    if snapshots is not None:
+                        snapshots.upsert({**item, 'tags': tags_dict})
+                    touched_species |= set(parsed_tags)
+                    record_change_safely(dynamodb, item, {**item, 'tags': tags_dict})
                 except Exception as e:
                     print(f"Error updating tags for {url}: {str(e)}")
 
+            species_changed(touched_species)
             presigned_urls = [get_presigned_url_from_s3_url(url) for url in updated_files]
             return build_cors_response(200, {'updated': presigned_urls})
 
@@ -229,11 +661,18 @@ def lambda_handler(event, context):
                 return build_cors_response(400, {'error': 'Missing or invalid "file" field'})
 
             file_bytes = base64.b64decode(file_base64)
-            detected_tags = extract_tags_from_file(file_bytes)
+            detected_tags = VOCAB.canonical_tags(extract_tags_from_file(file_bytes))
             if not detected_tags:
                 return build_cors_response(400, {'error': 'No tags detected in file'})
 
-            response = table.scan()
+            if snapshots is not None:
+                snap = get_snapshot()
+                with stage("match"):
+                    rows = snap.match_every(detected_tags)
+                return build_cors_response(200, {'links': snapshot_links(snap, rows)})
+
+            with stage("db_read"):
+                response = table.scan(**projection(SEARCH_FIELDS))
             items = response.get('Items', [])
             matching_links = []
 
@@ -242,6 +681,7 @@ def lambda_handler(event, context):
                 tags = item.get('tags', {})
                 if not isinstance(tags, dict):
                     continue
+                tags = {VOCAB.canonical(t) for t in tags}
                 if all(tag in tags for tag in detected_tags):
                     for url_field in ['thumbnailURL', 'originalURL', 'annotatedURL']:
                         if item.get(url_field):
@@ -254,13 +694,25 @@ def lambda_handler(event, context):
             print("Error processing /query-by-file:", str(e))
             return build_cors_response(500, {'error': 'Internal server error'})
 
+    # ---------- /stats GET ----------
+    if path == '/stats' and http_method == 'GET':
+        if stats_table is None:
+            return build_cors_response(404, {'error': 'Stats are not enabled'})
+        try:
+            return build_cors_response(200, stats_report(event.get('queryStringParameters') or {}))
+        except ValueError as e:
+            return build_cors_response(400, {'error': str(e)})
+        except Exception as e:
+            print("Error reading stats:", str(e))
+            return build_cors_response(500, {'error': 'Internal server error'})
+
     # ---------- /search GET or POST ----------
 
     if path != '/search':
         return build_cors_response(404, {'error': 'Route not found'})
 
     if http_method == 'GET':
-        params = event.get('queryStringParameters') or {}
+        params = dict(event.get('queryStringParameters') or {})   # consumed below
     elif http_method == 'POST':
         try:
             params = json.loads(event.get('body') or '{}')
@@ -270,6 +722,22 @@ def lambda_handler(event, context):
     else:
         return build_cors_response(405, {'error': f'Method {http_method} not allowed'})
 
+    # Many unique ids at once: ids=a,b,c (GET) or "ids": [...] (POST)
+    if 'ids' in params:
+        ids = params['ids']
+        if isinstance(ids, str):
+            ids = [i.strip().strip('"') for i in ids.split(',')]
+        if not isinstance(ids, list) or not all(isinstance(i, str) for i in ids):
+            return build_cors_response(400, {'error': 'Invalid ids parameter'})
+        ids = [i for i in ids if i]
+        if not ids or len(ids) > MAX_IDS:
+            return build_cors_response(400, {'error': f'Between 1 and {MAX_IDS} ids per request'})
+        try:
+            return compress_response(build_cors_response(200, items_by_ids(ids)), event)
+        except Exception as e:
+            print("Error reading ids from DynamoDB:", str(e))
+            return build_cors_response(500, {'error': 'Internal server error'})
+
     # Search by unique id
     if 'id' in params:
         unique_id = params['id']
@@ -278,7 +746,9 @@ def lambda_handler(event, context):
         else:
             return build_cors_response(400, {'error': 'Invalid id parameter'})
         try:
-            response = table.get_item(Key={'uniqueId': unique_id})
+            with stage("db_read"):
+                response = table.get_item(Key={'uniqueId': unique_id},
+                                          **projection(('thumbnailURL', 'tags')))
             item = response.get('Item')
             if not item:
                 return build_cors_response(404, {'error': 'Item not found'})
@@ -298,9 +768,13 @@ def lambda_handler(event, context):
         if not isinstance(thumbnail_url, str) or not thumbnail_url:
             return build_cors_response(400, {'error': 'Invalid or missing thumbnailURL'})
         try:
-            response = table.scan(
-                FilterExpression=Attr('thumbnailURL').eq(thumbnail_url)
-            )
+            with stage("db_read"):
+                # video thumbnails are never rendered; videos go by their original
+                response = table.scan(
+                    FilterExpression=Attr('thumbnailURL').eq(thumbnail_url) |
+                                    Attr('originalURL').eq(thumbnail_url),
+                    **projection(('originalURL',))
+                )
             items = response.get('Items', [])
             if not items:
                 return build_cors_response(404, {'error': 'Thumbnail not found'})
@@ -314,50 +788,54 @@ def lambda_handler(event, context):
             print("Error scanning for thumbnailURL:", str(e))
             return build_cors_response(500, {'error': 'Internal server error'})
 
+    # Optional paging of tag searches: page (0-based) and pageSize
+    page, page_size = params.pop('page', None), params.pop('pageSize', None)
+    try:
+        page = int(page) if page is not None else None
+        page_size = int(page_size) if page_size is not None else DEFAULT_PAGE_SIZE
+    except (TypeError, ValueError):
+        return build_cors_response(400, {'error': 'Invalid page or pageSize'})
+
+    # format=compact groups links per item under a shared host table
+    compact = params.pop('format', None) == 'compact'
+
+    # countMode=individuals compares counts with distinct tracked birds
+    count_mode = params.pop('countMode', 'birds')
+    if count_mode not in ('birds', 'individuals'):
+        return build_cors_response(400, {'error': 'countMode must be birds or individuals'})
+
+    # Optional filters: from/to, mediaType, min/maxDuration, min/maxSize
+    try:
+        filters = SearchFilters(params)
+    except (TypeError, ValueError) as e:
+        return build_cors_response(400, {'error': f'Invalid filter: {e}'})
+
     # Parse tag+count queries (only for GET)
     tag_counts = parse_tag_count_query(params) if http_method == 'GET' else {}
 
-    # If no tag_counts from parse but all params values are int, treat all params as tag counts
-    if not tag_counts and all(isinstance(v, int) for v in params.values()):
-        tag_counts = {k: v for k, v in params.items() if isinstance(v, int)}
+    # Otherwise, if every remaining param is a count, they are all tag counts:
+    # crow=2 (query string values are strings, so numeric strings count on GET)
+    is_get = http_method == 'GET'
+    if not tag_counts and params and all(as_count(v, is_get) is not None for v in params.values()):
+        tag_counts = {k: as_count(v, is_get) for k, v in params.items()}
+        params = {}
 
-    # Function to sum counts of matching tags (case-insensitive substring match)
-    def sum_matching_tags(tags_dict, query_tag):
-        query_tag_lower = query_tag.lower()
-        total_count = 0
-        for tag_name, tag_count in tags_dict.items():
-            if query_tag_lower in tag_name.lower():
-                total_count += tag_count
-        return total_count
+    raw_tags = params.pop('tag', None) if not tag_counts else None
+    if params:
+        return build_cors_response(400, {'error': f'Unknown parameters: {", ".join(sorted(params))}'})
 
     if tag_counts:
         try:
-            response = table.scan()
-            items = response.get('Items', [])
-            filtered_links = []
-
-            for item in items:
-                item = decimal_to_native(item)
-                item_tags = item.get('tags', {})
-                if not isinstance(item_tags, dict):
-                    continue
-
-                # Check if all requested tag counts match with case-insensitive substring
-                if all(sum_matching_tags(item_tags, tag) >= count for tag, count in tag_counts.items()):
-                    for url_field in ['thumbnailURL', 'originalURL', 'annotatedURL']:
-                        if item.get(url_field):
-                            presigned_url = get_presigned_url_from_s3_url(item[url_field])
-                            filtered_links.append(presigned_url)
-
-            return build_cors_response(200, {'links': filtered_links})
+            mode = 'individuals' if count_mode == 'individuals' else 'count'
+            results = tag_search(mode, list(tag_counts.items()), filters, page, page_size, compact)
+            return compress_response(build_cors_response(200, results), event)
 
         except Exception as e:
             print("Error scanning DynamoDB:", str(e))
             return build_cors_response(500, {'error': 'Internal server error'})
 
     # Search by tag(s) only (no counts)
-    elif 'tag' in params:
-        raw_tags = params['tag']
+    elif raw_tags is not None:
         if isinstance(raw_tags, str):
             requested_tags = [t.strip().lower() for t in raw_tags.split(',') if t.strip()]
         elif isinstance(raw_tags, list):
@@ -369,27 +847,21 @@ def lambda_handler(event, context):
             return build_cors_response(400, {'error': 'Missing or empty tag parameter'})
 
         try:
-            response = table.scan()
-            items = response.get('Items', [])
-            filtered_links = []
-
-            for item in items:
-                item = decimal_to_native(item)
-                item_tags = item.get('tags', {})
-
-                if isinstance(item_tags, dict):
-                    # Return item if any requested tag substring is found in item tags (case-insensitive)
-                    if any(any(req_tag in tag_name.lower() for tag_name in item_tags) for req_tag in requested_tags):
-                        for url_field in ['thumbnailURL', 'originalURL', 'annotatedURL']:
-                            if item.get(url_field):
-                                presigned_url = get_presigned_url_from_s3_url(item[url_field])
-                                filtered_links.append(presigned_url)
-
-            return build_cors_response(200, {'links': filtered_links})
+            results = tag_search('any', [(t, 1) for t in requested_tags], filters, page, page_size, compact)
+            return compress_response(build_cors_response(200, results), event)
 
         except Exception as e:
             print("Error scanning DynamoDB:", str(e))
             return build_cors_response(500, {'error': 'Internal server error'})
 
-    return build_cors_response(400, {'error': 'Missing valid parameters (id, tag, tag+count, thumbnailURL, or file)'})
+    # Filters only, e.g. every video from last week
+    elif filters:
+        try:
+            results = tag_search('count', [], filters, page, page_size, compact)
+            return compress_response(build_cors_response(200, results), event)
+        except Exception as e:
+            print("Error reading DynamoDB:", str(e))
+            return build_cors_response(500, {'error': 'Internal server error'})
+
+    return build_cors_response(400, {'error': 'Missing valid parameters (id, tag, tag+count, filters, thumbnailURL, or file)'})
 
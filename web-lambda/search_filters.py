@@ -0,0 +1,168 @@
+"""
+Composable /search filters and the read planner for them.
+
+Filters (all optional, combinable with each other and with tag searches):
+
+    from, to                 uploadTime range, ISO date or date-time (UTC);
+                             a date-only `to` includes that whole day
+    mediaType                image / video / audio, comma separated
+    minDuration, maxDuration seconds (items without a duration never match)
+    minSize, maxSize         fileSize in bytes
+
+Without the in-memory snapshot the planner lets the most selective
+predicate drive the DynamoDB read: a media type and/or time range becomes
+one Query per media type on MEDIA_TIME_INDEX (hash `mediaType`, range
+`uploadTime`), so "videos of crows from last week" reads only last week's
+videos; otherwise it falls back to a Scan. Size and duration are pushed
+down as FilterExpressions either way, and tags are checked on what comes
+back.
+"""
+import os
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+from boto3.dynamodb.conditions import Attr, Key
+
+MEDIA_TYPES = ("image", "video", "audio")
+FILTER_FIELDS = ("uploadTime", "mediaType", "fileSize", "duration")
+MEDIA_TIME_INDEX = os.getenv("MEDIA_TIME_INDEX", "mediaType-uploadTime-index")
+
+
+def parse_time(value, end=False):
+    """ISO date / date-time -> aware UTC datetime; date-only `end` is end of day."""
+    text = str(value).strip().replace("Z", "+00:00")
+    dt = datetime.fromisoformat(text)
+    if end and len(text) == 10:
+        dt += timedelta(days=1, microseconds=-1)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+
+def to_epoch(upload_time):
+    """Stored uploadTime string -> epoch seconds (None if missing/unparseable)."""
+    if not upload_time:
+        return None
+    try:
+        return parse_time(upload_time).timestamp()
+    except ValueError:
+        return None
+
+
+def _number(params, name):
+    value = params.pop(name, None)
+    return None if value in (None, "") else float(value)
+
+
+class SearchFilters:
+    def __init__(self, params):
+        """Take the filter parameters out of `params`; ValueError if invalid."""
+        start, end = params.pop("from", None), params.pop("to", None)
+        self.time_from = parse_time(start) if start else None
+        self.time_to = parse_time(end, end=True) if end else None
+
+        media = params.pop("mediaType", None)
+        if isinstance(media, str):
+            media = media.split(",")
+        self.media_types = tuple(sorted({m.strip().lower() for m in media or [] if m.strip()}))
+        unknown = set(self.media_types) - set(MEDIA_TYPES)
+        if unknown:
+            raise ValueError(f"Unknown mediaType {sorted(unknown)}")
+
+        self.min_duration = _number(params, "minDuration")
+        self.max_duration = _number(params, "maxDuration")
+        self.min_size = _number(params, "minSize")
+        self.max_size = _number(params, "maxSize")
+
+    def __bool__(self):
+        return any(v is not None for v in (self.time_from, self.time_to, self.min_duration,
+                                          self.max_duration, self.min_size, self.max_size)) \
+            or bool(self.media_types)
+
+    def key(self):
+        """Stable representation for cache keys."""
+        return [self.time_from and self.time_from.isoformat(),
+                self.time_to and self.time_to.isoformat(),
+                list(self.media_types), self.min_duration, self.max_duration,
+                self.min_size, self.max_size]
+
+    @property
+    def has_time(self):
+        return self.time_from is not None or self.time_to is not None
+
+    def epoch_range(self):
+        lo = self.time_from.timestamp() if self.time_from else float("-inf")
+        hi = self.time_to.timestamp() if self.time_to else float("inf")
+        return lo, hi
+
+    # ───────────────────────── row checks ─────────────────────────
+    def matches(self, item):
+        """Check one (native-typed) catalog row against every filter."""
+        if self.media_types and item.get("mediaType") not in self.media_types:
+            return False
+        if self.has_time:
+            ts = to_epoch(item.get("uploadTime"))
+            lo, hi = self.epoch_range()
+            if ts is None or not lo <= ts <= hi:
+                return False
+        for value, lo, hi in ((item.get("duration"), self.min_duration, self.max_duration),
+                              (item.get("fileSize"), self.min_size, self.max_size)):
+            if lo is None and hi is None:
+                continue
+            if value is None or (lo is not None and value < lo) or (hi is not None and value > hi):
+                return False
+        return True
+
+    # ───────────────────────── read planning ──────────────────────
+    def _attribute_condition(self, with_keys):
+        conds = []
+        for name, lo, hi in (("duration", self.min_duration, self.max_duration),
+                             ("fileSize", self.min_size, self.max_size)):
+            if lo is not None:
+                conds.append(Attr(name).gte(_dec(lo)))
+            if hi is not None:
+                conds.append(Attr(name).lte(_dec(hi)))
+        if with_keys:
+            if self.media_types:
+                conds.append(Attr("mediaType").is_in(list(self.media_types)))
+            lo, hi = self._time_strings()
+            if self.time_from:
+                conds.append(Attr("uploadTime").gte(lo))
+            if self.time_to:
+                conds.append(Attr("uploadTime").lte(hi))
+        cond = None
+        for c in conds:
+            cond = c if cond is None else cond & c
+        return cond
+
+    def _time_strings(self):
+        # uploadTime is stored as UTC ISO-8601; '~' sorts after any suffix
+        # ('.000', 'Z', '+00:00') of the last second in the range
+        lo = self.time_from.strftime("%Y-%m-%dT%H:%M:%S") if self.time_from else "0000"
+        hi = (self.time_to.strftime("%Y-%m-%dT%H:%M:%S") + "~") if self.time_to else "9999"
+        return lo, hi
+
+    def plan(self, index_name=MEDIA_TIME_INDEX):
+        """
+        List of ("query" | "scan", kwargs) reads that together return every
+        row passing the filters (callers still check tags on the results).
+        """
+        if index_name and (self.media_types or self.has_time):
+            lo, hi = self._time_strings()
+            cond = self._attribute_condition(with_keys=False)
+            reads = []
+            for media in self.media_types or MEDIA_TYPES:
+                key = Key("mediaType").eq(media)
+                if self.has_time:
+                    key = key & Key("uploadTime").between(lo, hi)
+                kwargs = {"IndexName": index_name, "KeyConditionExpression": key}
+                if cond is not None:
+                    kwargs["FilterExpression"] = cond
+                reads.append(("query", kwargs))
+            return reads
+        cond = self._attribute_condition(with_keys=True)
+        return [("scan", {"FilterExpression": cond} if cond is not None else {})]
+
+
+def _dec(value):
+    return Decimal(str(value))